@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""Rotation benchmark for KAREEM_NET_FRED against local fakes
+
+Runs the rotation paths in-process against the stand-ins in fakes.py
+instead of live tor and public APIs:
+
+  loop      run_rotations back to back with NEWNYM, geolocation, the log
+            and Telegram, as in the interactive loop and the daemon
+  isolated  IdentityRotator rotating SOCKS credentials, no NEWNYM
+  startup   median import and --help time, from bench_startup.py
+
+and reports rotations per minute and p50/p99 cycle latency. A loop cycle
+runs from the start of a rotation until every pipeline stage is done
+with it, so slow geolocation, logging or Telegram show up in it. The
+fake tor rate limits NEWNYM to one every 10 seconds like the real one,
+so the loop is bound by it unless --newnym-rate-limit lowers it; the
+isolated rotator shows the overhead of everything else. p99 is only
+reported from MIN_P99_SAMPLES cycles up.
+
+--save-baseline stores the results in baselines.json. Later runs are
+compared against it, and --max-regression fails the run when a metric
+got worse by more than that percentage.
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(HERE, os.pardir, "src"), HERE]
+
+import stem.control  # noqa: E402
+import KAREEM_NET_FRED as kareem  # noqa: E402
+import bench_startup  # noqa: E402
+from fakes import Fault, FakeNetwork  # noqa: E402
+
+BASELINE_FILE = os.path.join(HERE, "baselines.json")
+SCENARIOS = ("loop", "isolated", "startup")
+MIN_P99_SAMPLES = 20  # With fewer cycles p99 is just the slowest one
+
+# Metrics where a higher value is an improvement; everything else is a latency
+HIGHER_IS_BETTER = ("rotations_per_min",)
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a list of samples, None if there are none"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def to_ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+def summarize(cycles, elapsed, failed, phases=None):
+    result = {
+        "rotations": len(cycles),
+        "failed": failed,
+        "rotations_per_min": round(len(cycles) / elapsed * 60, 2) if cycles and elapsed else None,
+        "cycle_p50_ms": to_ms(percentile(cycles, 0.5)),
+        "cycle_p99_ms": to_ms(percentile(cycles, 0.99)) if len(cycles) >= MIN_P99_SAMPLES else None,
+    }
+    if phases:
+        result["phase_p50_ms"] = {phase: to_ms(percentile(values, 0.5)) for phase, values in sorted(phases.items())}
+    return result
+
+class TimedPipeline(kareem.RotationPipeline):
+    """RotationPipeline that calls on_done(event, seconds) once every sink has finished with an event
+
+    A last stage behind the sinks sees each event once per sink; seconds
+    runs from submit to the last of them.
+    """
+
+    def __init__(self, on_done):
+        super().__init__(display=False)
+        self.on_done = on_done
+        self._sinks = list(self.enrich.downstream)
+        self._pending = {}
+        done = kareem.PipelineStage('done', self._sink_done)
+        for sink in self._sinks:
+            sink.then(done)
+        self.stages.append(done)  # Stopped last, after the sinks feeding it
+
+    def submit(self, event):
+        event["submitted_at"] = time.monotonic()
+        super().submit(event)
+
+    def _sink_done(self, event):
+        submitted = event["submitted_at"]
+        seen = self._pending.pop(submitted, 0) + 1
+        if seen < len(self._sinks):
+            self._pending[submitted] = seen
+        else:
+            self.on_done(event, time.monotonic() - submitted)
+
+def bench_loop(rotations):
+    """run_rotations with every pipeline stage but the screen, until rotations are done"""
+    cycles, phases, failed, submitted = [], {}, [0], [0]
+    if rotations <= 0:
+        return summarize(cycles, 0, 0)
+    stop = threading.Event()
+
+    def on_rotation(event):
+        submitted[0] += 1
+        if submitted[0] >= rotations:
+            stop.set()
+
+    def on_done(event, pipeline_seconds):
+        timings = event["timings"]  # The loop's phases, merged with enrich's by the stage
+        for phase, seconds in timings.items():
+            phases.setdefault(phase, []).append(seconds)
+        phases.setdefault("pipeline", []).append(pipeline_seconds)
+        cycles.append(timings.get("rotation", 0) + timings.get("mac", 0) + pipeline_seconds)
+        failed[0] += not event["new_ip"]
+
+    pipeline = TimedPipeline(on_done).start()
+    scheduler = kareem.RotationScheduler(0.001, jitter=0, overrun='skip')  # Back to back
+    started = time.monotonic()
+    try:
+        kareem.run_rotations(scheduler, pipeline, stop, on_rotation)
+    finally:
+        pipeline.stop()  # Drains every stage, so each submitted rotation has completed
+        elapsed = time.monotonic() - started
+        kareem.flush_log()
+        kareem.get_telegram_notifier().flush(5)
+    # Rotations still in a stage after the drain timeout count as failed
+    return summarize(cycles, elapsed, failed[0] + submitted[0] - len(cycles), phases)
+
+def bench_isolated(rotations):
+    """IdentityRotator switching SOCKS credentials, rotations times"""
+    cycles, phases, failed = [], {}, 0
+    with kareem.IdentityRotator(kareem.TorConfig(isolate=True), name="bench") as rotator:
+        rotator.current_identity()
+        started = time.monotonic()
+        for _ in range(rotations):
+            with kareem.metrics.breakdown() as timings:
+                begun = time.monotonic()
+                failed += not rotator.rotate().ip
+                cycles.append(time.monotonic() - begun)
+            for phase, seconds in timings.items():
+                phases.setdefault(phase, []).append(seconds)
+        elapsed = time.monotonic() - started
+    return summarize(cycles, elapsed, failed, phases)
+
+def bench_startup_times(runs):
+    bench_startup.run_once(bench_startup.SCENARIOS["import"])  # Warm the bytecode cache
+    return {f"{name}_ms": round(statistics.median(bench_startup.run_once(command) * 1000 for _ in range(runs)), 1)
+            for name, command in bench_startup.SCENARIOS.items() if name != "baseline"}
+
+def configure(network, workdir, args):
+    """Point the module at the fakes and keep its files out of the working directory"""
+    network.configure(kareem)
+    kareem.LOG_FILE = os.path.join(workdir, "rotations.log")
+    kareem.geo_cache.path = None
+    kareem.TELEGRAM_ENABLED = args.telegram
+    kareem.TELEGRAM_BOT_TOKEN, kareem.TELEGRAM_CHAT_ID = "0:bench", "1"
+    kareem.TELEGRAM_MAX_RATE = 10 ** 6  # Deliver every message rather than coalescing them
+    if args.newnym_rate_limit != 10:
+        # stem assumes tor's 10 second limit when working out when a NEWNYM takes effect
+        limit = args.newnym_rate_limit
+        stem.control.Controller.get_newnym_wait = lambda self: max(0.0, self._last_newnym + limit - time.time())
+
+def format_ms(value):
+    return "n/a" if value is None else f"{value:.1f} ms"
+
+def compare(results, baseline, max_regression):
+    """Print each metric next to its baseline; returns the metrics that regressed past max_regression"""
+    regressed = []
+    for scenario, metrics in results.items():
+        for name, value in metrics.items():
+            old = baseline.get(scenario, {}).get(name)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or name in ("rotations", "failed"):
+                continue
+            change = (value - old) / old * 100 if old else 0.0
+            worse = -change if name in HIGHER_IS_BETTER else change
+            over = max_regression is not None and worse > max_regression
+            if over:
+                regressed.append(f"{scenario}.{name}")
+            print(f"  {scenario + '.' + name:32} {old:10.1f} -> {value:10.1f}   {change:+6.1f}%"
+                  f"{'   REGRESSION' if over else ''}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark KAREEM_NET_FRED rotations against local fakes")
+    parser.add_argument("--scenarios", default="loop,isolated,startup",
+                        help="comma separated: loop, isolated, startup (default: all)")
+    parser.add_argument("--rotations", type=int, default=50, help="isolated rotations (default: 50)")
+    parser.add_argument("--loop-rotations", type=int, default=4, help="NEWNYM loop rotations (default: 4)")
+    parser.add_argument("--startup-runs", type=int, default=7, help="runs per start-up scenario (default: 7)")
+    parser.add_argument("--newnym-rate-limit", type=float, default=10,
+                        help="seconds the fake tor makes NEWNYMs wait for each other (default: 10)")
+    parser.add_argument("--circuit-delay", type=float, default=0.5, help="seconds to build a circuit (default: 0.5)")
+    parser.add_argument("--circuit-jitter", type=float, default=0.25, help="extra random build seconds (default: 0.25)")
+    parser.add_argument("--latency", type=float, default=20, help="HTTP service latency in ms (default: 20)")
+    parser.add_argument("--stream-latency", type=float, default=50,
+                        help="SOCKS connect latency in ms, tor attaching a stream (default: 50)")
+    parser.add_argument("--fail-rate", type=float, default=0.0,
+                        help="fraction of requests and circuits that fail (default: 0)")
+    parser.add_argument("--no-telegram", dest="telegram", action="store_false", help="leave Telegram disabled")
+    parser.add_argument("--baseline", default="default", help="baseline name in baselines.json (default: default)")
+    parser.add_argument("--baseline-file", default=BASELINE_FILE, help=argparse.SUPPRESS)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="fail if a metric is this many percent worse than the baseline")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario {', '.join(unknown)}, expected some of {', '.join(SCENARIOS)}")
+    if min(args.rotations, args.loop_rotations) < 0:
+        parser.error("rotation counts cannot be negative")
+    if args.startup_runs < 1:
+        parser.error("--startup-runs must be at least 1")
+
+    latency, failures = args.latency / 1000, args.fail_rate
+    services = ("torproject", "httpbin", "ipify", "ipapi", "ipwhois", "telegram")
+    network = FakeNetwork(circuit=Fault(args.circuit_delay, args.circuit_jitter, failures),
+                          newnym_rate_limit=args.newnym_rate_limit,
+                          stream=Fault(args.stream_latency / 1000, fail_rate=failures),
+                          faults={service: Fault(latency, latency / 2, failures) for service in services})
+
+    results = {}
+    with network, tempfile.TemporaryDirectory() as workdir:
+        configure(network, workdir, args)
+        for name in scenarios:
+            print(f"[*] Running {name}...", file=sys.stderr)
+            # The module reports on stdout as it rotates; only the results belong there
+            with contextlib.redirect_stdout(io.StringIO()):
+                if name == "loop":
+                    results[name] = bench_loop(args.loop_rotations)
+                elif name == "isolated":
+                    results[name] = bench_isolated(args.rotations)
+                else:
+                    results[name] = bench_startup_times(args.startup_runs)
+        results["fakes"] = {"requests": dict(sorted(network.services.requests.items())),
+                            "newnyms": network.tor.newnyms, "circuits_built": network.tor.circuits_built}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name in scenarios:
+            metrics = results[name]
+            if name == "startup":
+                print(f"{name:10} " + "   ".join(f"{key[:-3]} {value:7.1f} ms" for key, value in metrics.items()))
+                continue
+            rate = metrics["rotations_per_min"]
+            print(f"{name:10} {'n/a' if rate is None else f'{rate:.1f}':>8} rotations/min"
+                  f"   p50 {format_ms(metrics['cycle_p50_ms']):>11}   p99 {format_ms(metrics['cycle_p99_ms']):>11}"
+                  f"   failed {metrics['failed']}/{metrics['rotations']}")
+            if metrics.get("phase_p50_ms"):
+                print(f"{'':10} phases p50: " + ", ".join(f"{phase} {format_ms(ms)}"
+                                                          for phase, ms in metrics["phase_p50_ms"].items()))
+
+    config = {key: getattr(args, key) for key in ("rotations", "loop_rotations", "newnym_rate_limit", "circuit_delay",
+                                                  "circuit_jitter", "latency", "stream_latency", "fail_rate", "telegram")}
+    try:
+        with open(args.baseline_file) as f:
+            baselines = json.load(f)
+    except (OSError, ValueError):
+        baselines = {}
+
+    failed = False
+    baseline = baselines.get(args.baseline)
+    if baseline and not args.save_baseline:
+        print(f"\nAgainst baseline {args.baseline!r} ({baseline.get('recorded', 'unknown date')}):")
+        if baseline.get("config") != config:
+            print("  (recorded with different fake settings, so the numbers are not comparable one to one)")
+        regressed = compare(results, baseline.get("results", {}), args.max_regression)
+        if regressed:
+            print(f"Regressed: {', '.join(regressed)}")
+            failed = True
+
+    if args.save_baseline:
+        baselines[args.baseline] = {
+            "recorded": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": config,
+            "results": {name: metrics for name, metrics in results.items() if name in scenarios},
+        }
+        with open(args.baseline_file, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nSaved baseline {args.baseline!r} to {args.baseline_file}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""Start-up time benchmark for KAREEM_NET_FRED
+
+Runs each scenario in a fresh interpreter several times and reports the
+median wall time. With --max-ms the script exits non-zero when a median is
+over budget, so it can gate CI against start-up regressions.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")
+SCRIPT = os.path.join(SRC, "KAREEM_NET_FRED.py")
+
+SCENARIOS = {
+    "baseline": [sys.executable, "-c", "pass"],
+    "import": [sys.executable, "-c", "import KAREEM_NET_FRED"],
+    "help": [sys.executable, SCRIPT, "--help"],
+}
+
+def run_once(command):
+    """Wall time of one run in seconds"""
+    env = dict(os.environ, PYTHONPATH=SRC)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)  # Measure start-up as users see it, from cached bytecode
+    started = time.perf_counter()
+    subprocess.run(command, cwd=SRC, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure KAREEM_NET_FRED start-up time")
+    parser.add_argument("--runs", type=int, default=15, help="runs per scenario (default: 15)")
+    parser.add_argument("--max-ms", type=float, default=None,
+                        help="fail if the import or help median exceeds this many milliseconds")
+    args = parser.parse_args()
+
+    run_once(SCENARIOS["import"])  # Warm the bytecode cache and page cache
+    failed = False
+    for name, command in SCENARIOS.items():
+        samples = sorted(run_once(command) * 1000 for _ in range(args.runs))
+        median = statistics.median(samples)
+        over = args.max_ms is not None and name != "baseline" and median > args.max_ms
+        failed = failed or over
+        print(f"{name:10} median {median:7.1f} ms   min {samples[0]:7.1f} ms   max {samples[-1]:7.1f} ms"
+              f"{'   OVER BUDGET' if over else ''}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,475 @@
+"""Local stand-ins for tor and the web services KAREEM_NET_FRED talks to
+
+FakeTor speaks enough of the control protocol for AUTHENTICATE, SIGNAL
+NEWNYM, GETINFO, SETEVENTS and CIRC/NOTICE events. It builds a new
+circuit a configurable delay after each NEWNYM and rate limits NEWNYM
+the way tor does. FakeSocks is a SOCKS5 proxy that hands every stream to
+FakeServices, one HTTP server behind the get_ip() endpoints, ipapi.co,
+ipwhois.app and the Telegram Bot API. All of them run in-process, so the
+exit IP a service reports follows the current fake circuit and the
+stream's SOCKS credentials, like IsolateSOCKSAuth.
+
+Latency and failures are injected with a Fault per service.
+"""
+import base64
+import hashlib
+import http.server
+import json
+import math
+import random
+import select
+import socket
+import socketserver
+import threading
+import time
+from datetime import datetime, timezone
+
+# Locations handed out by the fake geo services and tor's ip-to-country
+LOCATIONS = [
+    ('DE', 'Germany', 'Frankfurt am Main'),
+    ('NL', 'Netherlands', 'Amsterdam'),
+    ('FR', 'France', 'Paris'),
+    ('SE', 'Sweden', 'Stockholm'),
+    ('CH', 'Switzerland', 'Zurich'),
+    ('US', 'United States', 'New York'),
+    ('CA', 'Canada', 'Montreal'),
+    ('RO', 'Romania', 'Bucharest'),
+]
+
+def _digest(*parts):
+    return hashlib.sha256(":".join(str(part) for part in parts).encode()).digest()
+
+def exit_ip(circuit, username=""):
+    """Exit address of a circuit, as seen by streams with the given SOCKS username"""
+    digest = _digest("exit", circuit, username)
+    return f"185.{digest[0]}.{digest[1]}.{digest[2] or 1}"
+
+def location(ip):
+    """(country code, country name, city) the fakes report for an IP"""
+    return LOCATIONS[_digest("geo", ip)[0] % len(LOCATIONS)]
+
+class Fault:
+    """Latency and failures injected into one fake service
+
+    Every request waits latency plus up to jitter seconds, then fails
+    with probability fail_rate.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, fail_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+
+    def delay(self):
+        return self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def apply(self):
+        """Wait out the latency; returns True if this request should fail"""
+        delay = self.delay()
+        if delay > 0:
+            time.sleep(delay)
+        return self.fail_rate > 0 and random.random() < self.fail_rate
+
+def _recv_exact(conn, size):
+    data = b""
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("peer closed the connection")
+        data += chunk
+    return data
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+class FakeTorHandler(socketserver.StreamRequestHandler):
+    """One control connection"""
+
+    def setup(self):
+        super().setup()
+        self.events = set()
+        self._write_lock = threading.Lock()
+
+    def send(self, *lines):
+        try:
+            with self._write_lock:
+                self.wfile.write("".join(f"{line}\r\n" for line in lines).encode())
+        except OSError:
+            pass
+
+    def handle(self):
+        tor = self.server
+        tor.connections.add(self)
+        try:
+            for raw in self.rfile:
+                line = raw.decode(errors="replace").strip()
+                command, _, args = line.partition(" ")
+                command = command.upper()
+                tor.commands.append(command)
+
+                if command == "PROTOCOLINFO":
+                    self.send("250-PROTOCOLINFO 1", "250-AUTH METHODS=NULL",
+                              f'250-VERSION Tor="{tor.version}"', "250 OK")
+                elif command == "SETEVENTS":
+                    self.events = set(args.upper().split())
+                    self.send("250 OK")
+                elif command == "SIGNAL":
+                    if args.upper() == "NEWNYM":
+                        tor.newnym()
+                    self.send("250 OK")
+                elif command == "GETINFO":
+                    self._getinfo(args.split())
+                elif command == "CLOSECIRCUIT":
+                    circuit = args.split()[0] if args else ""
+                    self.send("250 OK" if tor.close_circuit(circuit) else f'552 Unknown circuit "{circuit}"')
+                elif command == "QUIT":
+                    self.send("250 closing connection")
+                    return
+                else:
+                    self.send("250 OK")  # AUTHENTICATE, SETCONF, RESETCONF, TAKEOWNERSHIP...
+        finally:
+            tor.connections.discard(self)
+
+    def _getinfo(self, keys):
+        values = {}
+        for key in keys:
+            value = self.server.getinfo(key)
+            if value is None:
+                self.send(f'552 Unrecognized key "{key}"')
+                return
+            values[key] = value
+
+        lines = []
+        for key, value in values.items():
+            if "\n" in value:
+                lines += [f"250+{key}="] + value.split("\n") + ["."]
+            else:
+                lines.append(f"250-{key}={value}")
+        self.send(*lines, "250 OK")
+
+class FakeTor(_Server):
+    """Control port that builds a new circuit after each NEWNYM
+
+    Circuits take circuit.delay() seconds to build and fail (and are
+    retried) at circuit.fail_rate. Like tor, a NEWNYM less than
+    newnym_rate_limit seconds after the previous one is announced with a
+    "Rate limiting NEWNYM request" notice and applied once the limit is up.
+    """
+
+    version = "0.4.8.9"
+
+    def __init__(self, port=0, circuit=None, newnym_rate_limit=10):
+        super().__init__(("127.0.0.1", port), FakeTorHandler)
+        self.circuit = circuit or Fault(latency=0.5)
+        self.newnym_rate_limit = newnym_rate_limit
+        self.connections = set()
+        self.commands = []
+        self.newnyms = 0
+        self.circuits_built = 0
+        self._lock = threading.Lock()
+        self._circuit_id = 1
+        self._next_id = 2
+        self._newnym_at = None
+        self._exits = {self._fingerprint("exit", 1): 1}  # exit fingerprint -> circuit id, for ns/id lookups
+
+    @property
+    def current_circuit(self):
+        with self._lock:
+            return self._circuit_id
+
+    def emit(self, event, line):
+        for connection in list(self.connections):
+            if event in connection.events:
+                connection.send(f"650 {line}")
+
+    def newnym(self):
+        with self._lock:
+            self.newnyms += 1
+            now = time.monotonic()
+            # tor counts whole seconds
+            delay = 0 if self._newnym_at is None else max(0, math.ceil(self._newnym_at + self.newnym_rate_limit - now))
+            self._newnym_at = now + delay
+        if delay:
+            self.emit("NOTICE", f"NOTICE Rate limiting NEWNYM request: delaying by {delay} second(s)")
+        self._build_later(delay)
+
+    def close_circuit(self, circuit):
+        with self._lock:
+            if circuit != str(self._circuit_id):
+                return False
+        self.emit("CIRC", f"CIRC {circuit} CLOSED {self._path(circuit)} PURPOSE=GENERAL REASON=REQUESTED")
+        self._build_later(0)
+        return True
+
+    def _build_later(self, wait):
+        def build():
+            time.sleep(wait)
+            while True:
+                with self._lock:
+                    circuit = self._next_id
+                    self._next_id += 1
+                failed = self.circuit.apply()
+                if not failed:
+                    break
+                self.emit("CIRC", f"CIRC {circuit} FAILED {self._path(circuit)} PURPOSE=GENERAL REASON=TIMEOUT")
+            with self._lock:
+                self._circuit_id = circuit
+                self.circuits_built += 1
+                self._exits[self._fingerprint("exit", circuit)] = circuit
+            self.emit("CIRC", f"CIRC {circuit} BUILT {self._path(circuit)} BUILD_FLAGS=NEED_CAPACITY "
+                              f"PURPOSE=GENERAL TIME_CREATED={self._created()}")
+        threading.Thread(target=build, daemon=True).start()
+
+    @staticmethod
+    def _fingerprint(role, circuit):
+        return _digest(role, circuit)[:20].hex().upper()
+
+    def _path(self, circuit):
+        return ",".join(f"${self._fingerprint(role, circuit)}~{role}{circuit}" for role in ("guard", "middle", "exit"))
+
+    @staticmethod
+    def _created():
+        return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+    def getinfo(self, key):
+        """Value of a GETINFO key, or None if unrecognized"""
+        if key == "version":
+            return f"{self.version} (git-0000000000000000)"
+        if key == "status/bootstrap-phase":
+            return 'NOTICE BOOTSTRAP PROGRESS=100 TAG=done SUMMARY="Done"'
+        if key == "status/circuit-established":
+            return "1"
+        if key == "circuit-status":
+            circuit = self.current_circuit
+            return (f"{circuit} BUILT {self._path(circuit)} BUILD_FLAGS=NEED_CAPACITY PURPOSE=GENERAL "
+                    f"TIME_CREATED={self._created()}")
+        if key.startswith("ip-to-country/"):
+            return location(key.split("/", 1)[1])[0].lower()
+        if key.startswith("ns/id/"):
+            fingerprint = key.split("/", 2)[2].lstrip("$").upper()
+            with self._lock:
+                circuit = self._exits.get(fingerprint)
+            if circuit is None:
+                return None
+            identity = base64.b64encode(bytes.fromhex(fingerprint)).decode().rstrip("=")
+            return (f"r exit{circuit} {identity} AAAAAAAAAAAAAAAAAAAAAAAAAAA 2024-01-01 00:00:00 "
+                    f"{exit_ip(circuit)} 443 0\ns Exit Fast Running Stable Valid\nw Bandwidth=1000")
+        return None
+
+class FakeSocksHandler(socketserver.BaseRequestHandler):
+    """SOCKS5 CONNECT (no auth or username/password) relayed to FakeServices"""
+
+    def handle(self):
+        proxy, conn = self.server, self.request
+        try:
+            _, count = _recv_exact(conn, 2)
+            methods = _recv_exact(conn, count)
+            username = ""
+            if 2 in methods:
+                conn.sendall(b"\x05\x02")
+                _, length = _recv_exact(conn, 2)
+                username = _recv_exact(conn, length).decode()
+                _recv_exact(conn, _recv_exact(conn, 1)[0])  # Password: only the username picks the circuit here
+                conn.sendall(b"\x01\x00")
+            elif 0 in methods:
+                conn.sendall(b"\x05\x00")
+            else:
+                conn.sendall(b"\x05\xff")
+                return
+
+            _, command, _, address_type = _recv_exact(conn, 4)
+            if address_type == 1:
+                _recv_exact(conn, 4)
+            elif address_type == 3:
+                _recv_exact(conn, _recv_exact(conn, 1)[0])
+            elif address_type == 4:
+                _recv_exact(conn, 16)
+            _recv_exact(conn, 2)
+            if command != 1:
+                conn.sendall(b"\x05\x07\x00\x01" + b"\x00" * 6)
+                return
+            if proxy.stream.apply():
+                conn.sendall(b"\x05\x04\x00\x01" + b"\x00" * 6)  # Host unreachable, as when a circuit fails
+                return
+
+            upstream = socket.create_connection(proxy.upstream)
+        except (OSError, ConnectionError):
+            return
+
+        local_port = upstream.getsockname()[1]
+        proxy.exits[local_port] = exit_ip(proxy.tor.current_circuit, username)
+        try:
+            conn.sendall(b"\x05\x00\x00\x01" + b"\x00" * 6)
+            self._relay(conn, upstream)
+        except OSError:
+            pass
+        finally:
+            proxy.exits.pop(local_port, None)
+            upstream.close()
+
+    @staticmethod
+    def _relay(conn, upstream):
+        peers = {conn: upstream, upstream: conn}
+        while True:
+            readable, _, _ = select.select(list(peers), [], [])
+            for sock in readable:
+                data = sock.recv(65536)
+                if not data:
+                    return
+                peers[sock].sendall(data)
+
+class FakeSocks(_Server):
+    """SOCKS5 proxy whose streams exit at FakeTor's current circuit
+
+    Whatever host a stream asks for, it is connected to upstream (the
+    FakeServices address). stream delays and fails connects, standing in
+    for tor attaching the stream to a circuit.
+    """
+
+    def __init__(self, tor, upstream, port=0, stream=None):
+        super().__init__(("127.0.0.1", port), FakeSocksHandler)
+        self.tor = tor
+        self.upstream = upstream
+        self.stream = stream or Fault()
+        self.exits = {}  # local port of an upstream connection -> exit IP it stands for
+
+class FakeServicesHandler(http.server.BaseHTTPRequestHandler):
+    """Routes requests to the IP check, geolocation and Telegram fakes"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _client_ip(self):
+        # Streams from FakeSocks are known by the port they connect from
+        return self.server.exits.get(self.client_address[1], self.client_address[0])
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0].strip("/").split("/")
+        routes = {
+            ("torproject", "api", "ip"): ("torproject", lambda ip: {"IsTor": True, "IP": ip}),
+            ("httpbin", "ip"): ("httpbin", lambda ip: {"origin": ip}),
+            ("ipify",): ("ipify", lambda ip: {"ip": ip}),
+        }
+        if tuple(path) in routes:
+            service, payload = routes[tuple(path)]
+            self._serve(service, lambda: payload(self._client_ip()))
+        elif len(path) == 3 and path[0] == "ipapi" and path[2] == "json":
+            code, country, city = location(path[1])
+            self._serve("ipapi", lambda: {"ip": path[1], "country_code": code, "country_name": country, "city": city},
+                        failure=(429, {"error": True, "reason": "RateLimited"}))
+        elif len(path) == 3 and path[:2] == ["ipwhois", "json"]:
+            code, country, city = location(path[2])
+            self._serve("ipwhois", lambda: {"ip": path[2], "success": True, "country_code": code,
+                                            "country": country, "city": city})
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        path = self.path.strip("/").split("/")
+        if len(path) == 3 and path[0] == "telegram" and path[1].startswith("bot") and path[2] == "sendMessage":
+            def accept():
+                self.server.messages.append(body)
+                return {"ok": True, "result": {"message_id": len(self.server.messages)}}
+            self._serve("telegram", accept, failure=(502, {"ok": False, "error_code": 502, "description": "Bad Gateway"}))
+        else:
+            self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+
+    def _serve(self, service, payload, failure=(503, {"error": "injected failure"})):
+        self.server.requests[service] = self.server.requests.get(service, 0) + 1
+        if self.server.faults.get(service, Fault()).apply():
+            self._reply(*failure)
+        else:
+            self._reply(200, payload())
+
+class FakeServices(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """HTTP fakes of the IP check endpoints, ipapi.co, ipwhois.app and the Telegram Bot API
+
+    faults maps a service name ('torproject', 'httpbin', 'ipify', 'ipapi',
+    'ipwhois' or 'telegram') to its Fault.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+    request_queue_size = 1024
+    start, stop, port = _Server.start, _Server.stop, _Server.port
+
+    def __init__(self, port=0, faults=None):
+        super().__init__(("127.0.0.1", port), FakeServicesHandler)
+        self.faults = dict(faults or {})
+        self.requests = {}  # service -> requests served
+        self.messages = []  # Telegram message bodies
+        self.exits = {}  # Shared with FakeSocks: local port of a proxied connection -> its exit IP
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+class FakeNetwork:
+    """FakeTor, FakeSocks and FakeServices wired together"""
+
+    IP_CHECK_HOST = "ipcheck.invalid"  # Resolved by nothing: socks5h hands the name to FakeSocks
+
+    def __init__(self, circuit=None, newnym_rate_limit=10, stream=None, faults=None):
+        self.tor = FakeTor(circuit=circuit, newnym_rate_limit=newnym_rate_limit)
+        self.services = FakeServices(faults=faults)
+        self.socks = FakeSocks(self.tor, self.services.server_address, stream=stream)
+        self.services.exits = self.socks.exits
+
+    def start(self):
+        for server in (self.tor, self.services, self.socks):
+            server.start()
+        return self
+
+    def stop(self):
+        for server in (self.socks, self.services, self.tor):
+            server.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def settings(self):
+        """Module globals that point KAREEM_NET_FRED at the fakes"""
+        host = f"http://{self.IP_CHECK_HOST}"
+        return {
+            "TOR_SOCKS_PROXY": f"socks5h://127.0.0.1:{self.socks.port}",
+            "TOR_CONTROL_PORT": self.tor.port,
+            "TOR_CONTROL_SOCKET": None,
+            "TOR_CONTROL_PASSWORD": None,
+            "IP_CHECK_ENDPOINTS": [f"{host}/torproject/api/ip", f"{host}/httpbin/ip", f"{host}/ipify?format=json"],
+            "GEO_IPAPI_URL": f"{self.services.url}/ipapi",
+            "GEO_IPWHOIS_URL": f"{self.services.url}/ipwhois",
+            "TELEGRAM_API_URL": f"{self.services.url}/telegram",
+        }
+
+    def configure(self, module):
+        for name, value in self.settings().items():
+            setattr(module, name, value)
@@ -1,17 +1,90 @@
 #!/usr/bin/env python3
 import time
-import requests
+import sys
+import importlib
+import importlib.util
 import uuid
 import os
 import subprocess
-from stem import Signal
-from stem.control import Controller
+import threading
+import atexit
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 import getpass
-from collections import OrderedDict
+from collections import OrderedDict, deque, namedtuple
 import re
 import random
+import queue
+import gzip
+import glob
+import shutil
+import mmap
+import argparse
+import fnmatch
+import struct
+import math
+import hashlib
+import select
+import errno
+import contextlib
+import signal
+import weakref
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+from urllib.parse import urlsplit, parse_qs
+import ipaddress
+import socket
+import bisect
+import csv
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+
+class _LazyImport:
+    """Stand-in for a module, or a name inside one, that imports it on first use
+
+    requests, stem and asyncio account for most of the start-up time, and
+    subcommands like analytics never touch them, so they are only loaded by
+    the first attribute access or call.
+    """
+
+    def __init__(self, module, name=None):
+        self._module = module
+        self._name = name
+        self._target = None
+
+    def _load(self):
+        if self._target is None:
+            target = importlib.import_module(self._module)
+            self._target = getattr(target, self._name) if self._name else target
+        return self._target
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+    def __repr__(self):
+        return f"<lazy {self._module}{'.' + self._name if self._name else ''}>"
+
+requests = _LazyImport('requests')
+stem = _LazyImport('stem')
+Signal = _LazyImport('stem', 'Signal')
+CircStatus = _LazyImport('stem', 'CircStatus')
+CircPurpose = _LazyImport('stem', 'CircPurpose')
+CircBuildFlag = _LazyImport('stem', 'CircBuildFlag')
+StreamStatus = _LazyImport('stem', 'StreamStatus')
+Controller = _LazyImport('stem.control', 'Controller')
+EventType = _LazyImport('stem.control', 'EventType')
+State = _LazyImport('stem.control', 'State')
+asyncio = _LazyImport('asyncio')
+ProcessPoolExecutor = _LazyImport('concurrent.futures', 'ProcessPoolExecutor')
 
 # Colors
 BLUE = "\033[94m"
@@ -25,78 +98,235 @@ RESET = "\033[0m"
 # Default configuration
 TOR_SOCKS_PROXY = "socks5h://127.0.0.1:9050"
 TOR_CONTROL_PORT = 9051
+TOR_CONTROL_SOCKET = None  # Unix ControlSocket path, preferred over the port when set
+TOR_CONTROL_PASSWORD = None  # HashedControlPassword; cookie auth is detected automatically
+TOR_RECONNECT_DELAYS = (0.05, 0.1, 0.25, 0.5, 1, 2)  # Backoff between control reconnect attempts
+NEWNYM_WAIT_TIMEOUT = 30  # Upper bound on waiting for a fresh circuit after NEWNYM
+TOR_READY_TIMEOUT = 120  # Deadline for tor to bootstrap after it is (re)started
+TOR_READY_POLL_INTERVAL = 1  # Re-check bootstrap status this often when no event arrives
+
+# Tor instance pool: standby instances with pre-built circuits make rotation an
+# instant switch of the active SOCKS endpoint (0 uses the single configured tor)
+TOR_POOL_SIZE = 0
+TOR_POOL_DIR = "KAREEM_NET_FRED_pool"  # Parent of each instance's DataDirectory
+TOR_POOL_PORT_OFFSET = 1000  # Instance ports start this far above the configured SOCKS/control ports
+TOR_POOL_START_TIMEOUT = 120  # Seconds allowed for the first instance to bootstrap
+TOR_POOL_VERIFY = 'http'  # Confirm standby exits over HTTP ('http') or trust the control port ('controller')
+TOR_POOL_MAX_STANDBY_AGE = 300  # Standbys unused for longer rebuild their circuit
+TOR_POOL_CHECK_INTERVAL = 5  # Seconds between supervisor health checks
+TOR_BINARY = "tor"
+
+# Local rotating proxy ("proxy" subcommand); 0 disables a rotation trigger
+PROXY_LISTEN = "127.0.0.1"
+PROXY_PORT = 9080
+PROXY_ROTATE_REQUESTS = 0  # Rotate after this many client connections
+PROXY_ROTATE_BYTES = 0  # Rotate after this many bytes relayed
+PROXY_ROTATE_INTERVAL = 600  # Rotate after this many seconds
+PROXY_ISOLATION = 'client'  # 'client' gives each client address its own circuits, 'shared' does not
+PROXY_DRAIN_TIMEOUT = 30  # Seconds connections on a rotated-out identity get before they are closed
+PROXY_CONNECT_TIMEOUT = 30
+PROXY_BUFFER_SIZE = 65536
+PROXY_BACKLOG = 1024
+
+# IP check endpoints, queried concurrently through Tor
+IP_CHECK_ENDPOINTS = [
+    "https://check.torproject.org/api/ip",
+    "https://httpbin.org/ip",
+    "https://api.ipify.org?format=json"
+]
+IP_CHECK_TIMEOUT = 10
+IP_CHECK_DEMOTE_AFTER = 3  # Consecutive failures before an endpoint is demoted
+IP_CHECK_HEDGE_DELAY = 1.0  # Head start healthy endpoints get over demoted ones
+
+# How the current identity is resolved: 'http' asks the IP check endpoints,
+# 'controller' reads the exit relay of the circuit in use from the control port
+IP_RESOLVE_MODE = 'http'
+IP_RESOLVE_VERIFY = False  # In controller mode, also confirm the exit IP over HTTP
+
+# Geolocation cache
+GEO_CACHE_FILE = "KAREEM_NET_FRED_geo.json"
+GEO_CACHE_SIZE = 1024  # Entries kept, least recently used evicted first
+GEO_CACHE_TTL = 24 * 3600  # Seconds before a cached location is looked up again
+GEO_CACHE_SAVE_INTERVAL = 60  # Minimum seconds between writes of the cache file
+
+# Geolocation backend: 'remote' (ipapi.co/ipwhois.app), 'offline' (local range
+# database only) or 'offline+remote' (local country, remote city enrichment)
+GEO_BACKEND = 'remote'
+GEO_DATABASE_FILE = None  # Optional CSV of start,end,country[,city] ranges
+GEO_IPAPI_URL = "https://ipapi.co"  # Remote services, asked in this order
+GEO_IPWHOIS_URL = "https://ipwhois.app"
+TOR_GEOIP_FILES = [
+    '/usr/share/tor/geoip',
+    '/usr/share/tor/geoip6',
+    '/usr/local/share/tor/geoip',
+    '/usr/local/share/tor/geoip6'
+]
+
+# Circuit quality probe: new circuits are test-downloaded and slow exits re-rolled.
+# PROBE_URL is required with probing: run "probe-server" on a host you control and point it there.
+PROBE_ENABLED = False
+PROBE_URL = None  # e.g. "http://your-server:8000/"; there is no default third-party target
+PROBE_BYTES = 128 * 1024  # Bytes downloaded per probe
+PROBE_TIMEOUT = 15
+PROBE_MAX_TTFB = 2.0  # Seconds; slower first bytes fail the probe (0 disables)
+PROBE_MIN_THROUGHPUT = 50 * 1024  # Bytes per second; slower transfers fail the probe (0 disables)
+PROBE_MAX_RETRIES = 3  # Re-rolls per rotation before the last circuit is kept anyway
+
+# Seen-exit index: rotations landing on a recently used exit are re-rolled
+EXIT_AVOID_REPEATS = True
+EXIT_REPEAT_BUDGET = 30  # Seconds a rotation may spend re-rolling repeated exits
+EXIT_HISTORY_BACKEND = 'lru'  # 'lru' (exact) or 'bloom' (compact, for week-long runs)
+EXIT_HISTORY_SIZE = 10000  # Exits remembered
+EXIT_HISTORY_TTL = 24 * 3600  # Seconds before an exit may be used again (0 keeps it until evicted)
+EXIT_AVOID_RECENT_COUNTRIES = 0  # Also avoid the countries of this many previous exits
+
+# Country schedule: which country each rotation exits from, using an index of
+# exits built from the consensus. Modes: None (tor decides), 'round_robin',
+# 'no_repeat' or 'weighted'; COUNTRY_SCHEDULE is a list of codes, or
+# {code: weight} for 'weighted'
+COUNTRY_SCHEDULE_MODE = None
+COUNTRY_SCHEDULE = []
+
+# Rotation schedule: deadlines on the monotonic clock, so rotation time never delays the next one
+ROTATION_JITTER = 0  # Random offset (seconds, +/-) applied to each rotation, capped at half the interval
+ROTATION_OVERRUN = 'catch_up'  # 'catch_up' runs missed slots right away, 'skip' waits for the next one
+ROTATION_MAX_CATCH_UP = 3  # Missed slots run back to back before the rest are skipped
+ROTATION_CRON = None  # Cron expression, e.g. '*/5 * * * *', used instead of the interval
+ROTATION_ADAPTIVE = False  # Rotate sooner while the circuit quality probe keeps failing
+ROTATION_ADAPTIVE_FACTOR = 0.5  # Interval multiplier per consecutive degraded rotation
+ROTATION_MIN_INTERVAL = 5  # Floor for the adaptive interval
+
+# Rotation pipeline: side effects run as stages off the rotation's critical path
+PIPELINE_QUEUE_SIZE = 16  # Pending events per stage
+PIPELINE_OVERFLOW = 'drop_oldest'  # 'drop_oldest', 'drop_newest' or 'block' when a stage falls behind
+PIPELINE_STAGE_TIMEOUTS = {'enrich': 60, 'log': 5, 'notify': 15, 'display': 5}
+PIPELINE_DRAIN_TIMEOUT = 10  # Seconds each stage gets to finish queued events on stop
+
+# Metrics: per-phase timings and counters in the Prometheus text format
+METRICS_LISTEN = "127.0.0.1"
+METRICS_PORT = 0  # Serve them on http://METRICS_LISTEN:METRICS_PORT/metrics (0 disables)
+METRICS_TEXTFILE = None  # Also write them here after every rotation, e.g. for node_exporter's textfile collector
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # Histogram bounds, seconds
+
+# Headless daemon ("daemon" subcommand): settings come from a JSON file whose
+# keys match the daemon's flags (socks_port, mac, log_file, ...) and flags win
+DAEMON_PID_FILE = "KAREEM_NET_FRED.pid"
+DAEMON_STATUS_FILE = "KAREEM_NET_FRED_status.json"  # Rewritten on every state change and rotation
+DAEMON_INTERVAL = 30  # Seconds between rotations unless the settings give an interval or cron
+DAEMON_RETRY_DELAY = 10  # Seconds before the rotation loop restarts after an error
+
+# Start-up: a passed requirement check is cached against a fingerprint of the
+# interpreter, PATH and package directories (None always re-checks)
+ENV_CACHE_FILE = os.path.expanduser("~/.cache/KAREEM_NET_FRED_env.json")
+ENV_CACHE_MAX_AGE = 7 * 24 * 3600  # Re-check at least this often, in seconds
 
 # Telegram Configuration
 TELEGRAM_BOT_TOKEN = None
 TELEGRAM_CHAT_ID = None
 TELEGRAM_ENABLED = False
+TELEGRAM_API_URL = "https://api.telegram.org"
+TELEGRAM_MAX_RATE = 20  # Messages per minute; faster events are coalesced
+TELEGRAM_BUFFER_SIZE = 100  # Undelivered messages kept while Telegram is unreachable
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+TELEGRAM_BATCH_SEPARATOR = "\n➖➖➖➖➖\n"
+TELEGRAM_RETRY_BACKOFF = (2, 5, 15, 30, 60, 120)  # Seconds between retries after errors
+TELEGRAM_FLUSH_TIMEOUT = 5  # Seconds spent delivering queued messages on exit
 
 # Logging Configuration
 LOG_ENABLED = False
 LOG_FILE = "KAREEM_NET_FRED.log"
+LOG_FLUSH_INTERVAL = 1.0  # Seconds between flushes of buffered entries
+LOG_FSYNC = 'interval'  # 'never', 'interval' (with every flush) or 'always' (every entry)
+LOG_ROTATE_BYTES = 10 * 1024 * 1024  # Rotate when the file reaches this size (0 disables)
+LOG_ROTATE_INTERVAL = 0  # Rotate when the file is this many seconds old (0 disables)
+LOG_ROTATE_COMPRESS = True  # gzip rotated segments
+LOG_BACKUP_COUNT = 10  # Rotated segments kept (0 keeps all)
+LOG_CLOSE_TIMEOUT = 5  # Seconds allowed for flushing on shutdown
 
 # MAC Address Configuration
 MAC_CHANGE_ENABLED = False
 MAC_CHANGE_METHOD = None  # 'random', 'specific'
 NEW_MAC = None
 DEFAULT_INTERFACE = "eth0"
+MAC_BACKEND = 'auto'  # 'native' (ioctl/netlink), 'subprocess' (macchanger/ifconfig/ip) or 'auto'
+LINK_WAIT_TIMEOUT = 5  # Seconds to wait for the link to come back up after a MAC change
+MAC_INTERFACES = None  # Interfaces (or patterns like 'wlan*', '*' for all) to rotate; None is DEFAULT_INTERFACE only
+MAC_EXCLUDE_INTERFACES = ['lo', 'docker*', 'veth*', 'br-*', 'virbr*']  # Never rotated
+MAC_ROLLBACK_ON_FAILURE = True  # Restore all interfaces if any of them fails to change
 
 # Session tracking
 visited_countries = OrderedDict()
+visited_countries_lock = threading.Lock()  # Written by the pipeline, read by the screen
 
 def clear_screen():
     """Clear the terminal screen"""
     os.system('cls' if os.name == 'nt' else 'clear')
 
-def check_requirements():
+def pause(seconds):
+    """Hold a status message on screen; skipped when not run from a terminal"""
+    if sys.stdin.isatty() and sys.stdout.isatty():
+        time.sleep(seconds)
+
+def _environment_fingerprint():
+    """Hash of what the requirement checks depend on: interpreter, PATH and package directories"""
+    parts = [sys.executable, sys.version, os.environ.get('PATH', '')]
+    # sys.path[0] is the script's own directory, which changes whenever a log is written
+    for directory in os.environ.get('PATH', '').split(os.pathsep) + sys.path[1:]:
+        try:
+            parts.append(f"{directory}:{os.stat(directory).st_mtime_ns}")
+        except OSError:
+            continue
+    return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+def load_environment_cache():
+    """Return True if the last successful requirement check still applies"""
+    if not ENV_CACHE_FILE:
+        return False
+    try:
+        with open(ENV_CACHE_FILE, 'r') as f:
+            cached = json.load(f)
+        if time.time() - cached['checked'] > ENV_CACHE_MAX_AGE:
+            return False
+        return cached['fingerprint'] == _environment_fingerprint()
+    except Exception:
+        return False
+
+def save_environment_cache():
+    """Remember that the current environment passed the requirement check"""
+    if not ENV_CACHE_FILE:
+        return
+    try:
+        os.makedirs(os.path.dirname(ENV_CACHE_FILE) or '.', exist_ok=True)
+        with open(ENV_CACHE_FILE, 'w') as f:
+            json.dump({'fingerprint': _environment_fingerprint(), 'checked': time.time()}, f)
+    except OSError:
+        pass
+
+def check_requirements(use_cache=True):
     """Check system requirements and attempt to install missing ones"""
+    if use_cache and load_environment_cache():
+        print(f"\n{GREEN}[✓] All requirements are installed! {YELLOW}(cached check){RESET}")
+        return True
+    
     requirements = {
         'tor': {'installed': False, 'name': 'Tor Service'},
         'stem': {'installed': False, 'name': 'Stem Package'},
         'requests': {'installed': False, 'name': 'Requests Package'},
-        'python-telegram-bot': {'installed': False, 'name': 'Python-Telegram-Bot'},
         'macchanger': {'installed': False, 'name': 'Macchanger Tool'}
     }
     
     print(f"\n{YELLOW}[*] Checking system requirements:{RESET}\n")
     
-    # Check Tor service
-    try:
-        subprocess.check_output(['which', 'tor'], stderr=subprocess.STDOUT)
-        requirements['tor']['installed'] = True
-        print(f"{GREEN}[✓] {requirements['tor']['name']} is installed{RESET}")
-    except:
-        print(f"{RED}[✗] {requirements['tor']['name']} is not installed{RESET}")
-    
-    # Check Python packages
-    try:
-        import stem
-        requirements['stem']['installed'] = True
-        print(f"{GREEN}[✓] {requirements['stem']['name']} is installed{RESET}")
-    except:
-        print(f"{RED}[✗] {requirements['stem']['name']} is not installed{RESET}")
-    
-    try:
-        import requests
-        requirements['requests']['installed'] = True
-        print(f"{GREEN}[✓] {requirements['requests']['name']} is installed{RESET}")
-    except:
-        print(f"{RED}[✗] {requirements['requests']['name']} is not installed{RESET}")
-    
-    try:
-        import telegram
-        requirements['python-telegram-bot']['installed'] = True
-        print(f"{GREEN}[✓] {requirements['python-telegram-bot']['name']} is installed{RESET}")
-    except:
-        print(f"{RED}[✗] {requirements['python-telegram-bot']['name']} is not installed{RESET}")
-    
-    # Check macchanger
-    try:
-        subprocess.check_output(['which', 'macchanger'], stderr=subprocess.STDOUT)
-        requirements['macchanger']['installed'] = True
-        print(f"{GREEN}[✓] {requirements['macchanger']['name']} is installed{RESET}")
-    except:
-        print(f"{RED}[✗] {requirements['macchanger']['name']} is not installed{RESET}")
+    # Binaries are looked up on PATH and packages by import spec, without running or importing them
+    for key, requirement in requirements.items():
+        if key in ('stem', 'requests'):
+            requirement['installed'] = importlib.util.find_spec(key) is not None
+        else:
+            requirement['installed'] = shutil.which(key) is not None
+        if requirement['installed']:
+            print(f"{GREEN}[✓] {requirement['name']} is installed{RESET}")
+        else:
+            print(f"{RED}[✗] {requirement['name']} is not installed{RESET}")
     
     # Install missing requirements
     if not all([req['installed'] for req in requirements.values()]):
@@ -146,25 +376,15 @@ def check_requirements():
                 print(f"{YELLOW}[!] Please install macchanger manually{RESET}")
         
         # Install Python packages
-        missing_packages = []
-        if not requirements['stem']['installed']:
-            missing_packages.append('stem')
-        if not requirements['requests']['installed']:
-            missing_packages.append('requests')
-        if not requirements['python-telegram-bot']['installed']:
-            missing_packages.append('python-telegram-bot')
+        missing_packages = [pkg for pkg in ('stem', 'requests') if not requirements[pkg]['installed']]
         
         if missing_packages:
             print(f"{YELLOW}[*] Installing Python packages: {', '.join(missing_packages)}{RESET}")
             try:
                 subprocess.run(['pip3', 'install'] + missing_packages, check=True)
+                importlib.invalidate_caches()
                 for pkg in missing_packages:
-                    if pkg == 'stem':
-                        requirements['stem']['installed'] = True
-                    elif pkg == 'requests':
-                        requirements['requests']['installed'] = True
-                    elif pkg == 'python-telegram-bot':
-                        requirements['python-telegram-bot']['installed'] = True
+                    requirements[pkg]['installed'] = importlib.util.find_spec(pkg) is not None
                 print(f"{GREEN}[✓] Python packages installed successfully{RESET}")
             except Exception as e:
                 print(f"{RED}[!] Failed to install Python packages: {str(e)}{RESET}")
@@ -173,12 +393,13 @@ def check_requirements():
     # Final check
     if all([req['installed'] for req in requirements.values()]):
         print(f"\n{GREEN}[✓] All requirements are installed!{RESET}")
-        time.sleep(2)
+        save_environment_cache()
+        pause(2)
         return True
     else:
         print(f"\n{RED}[!] Some requirements are still missing{RESET}")
         print(f"{YELLOW}[!] Please install them manually before continuing{RESET}")
-        time.sleep(3)
+        pause(3)
         return False
 
 def detect_tor_ports():
@@ -212,15 +433,46 @@ def detect_tor_ports():
     
     return socks_port, control_port
 
+def detect_tor_control_socket():
+    """Detect a Unix ControlSocket from torrc configuration file"""
+    torrc_paths = [
+        '/etc/tor/torrc',
+        '/usr/local/etc/tor/torrc',
+        '/etc/torrc',
+        os.path.expanduser('~/.torrc')
+    ]
+
+    for path in torrc_paths:
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    for line in f:
+                        line = line.strip()
+                        if line.startswith('ControlSocket') and not line.startswith('#'):
+                            parts = line.split()
+                            if len(parts) >= 2 and parts[1] not in ('0', 'auto'):
+                                socket_path = parts[1].strip('"')
+                                if socket_path.startswith('unix:'):
+                                    socket_path = socket_path[5:]
+                                if os.path.exists(socket_path):
+                                    return socket_path
+            except:
+                continue
+
+    return None
+
 def configure_tor_ports():
     """Allow user to configure Tor ports manually"""
-    global TOR_SOCKS_PROXY, TOR_CONTROL_PORT
+    global TOR_SOCKS_PROXY, TOR_CONTROL_PORT, TOR_CONTROL_SOCKET
     
     socks_port, control_port = detect_tor_ports()
+    control_socket = detect_tor_control_socket()
     
     print(f"\n{YELLOW}[*] Current Tor Port Configuration:{RESET}")
     print(f"{GREEN}[+] SOCKS Proxy Port: {BLUE}{socks_port}{RESET}")
     print(f"{GREEN}[+] Control Port: {BLUE}{control_port}{RESET}")
+    if control_socket:
+        print(f"{GREEN}[+] Control Socket: {BLUE}{control_socket}{RESET}")
     
     while True:
         choice = input(f"\n{YELLOW}[*] Do you want to change these ports? (y/n): {RESET}").strip().lower()
@@ -228,8 +480,9 @@ def configure_tor_ports():
         if choice == 'n':
             TOR_SOCKS_PROXY = f"socks5h://127.0.0.1:{socks_port}"
             TOR_CONTROL_PORT = control_port
+            TOR_CONTROL_SOCKET = control_socket
             print(f"{GREEN}[✓] Using detected ports{RESET}")
-            time.sleep(2)
+            pause(2)
             return
         
         elif choice == 'y':
@@ -244,264 +497,3314 @@ def configure_tor_ports():
                 
                 TOR_SOCKS_PROXY = f"socks5h://127.0.0.1:{socks_port}"
                 TOR_CONTROL_PORT = control_port
+                TOR_CONTROL_SOCKET = None  # Explicit port choice wins over the socket
                 
                 print(f"{GREEN}[✓] Ports updated successfully{RESET}")
                 print(f"{GREEN}[+] New SOCKS Proxy: {BLUE}{TOR_SOCKS_PROXY}{RESET}")
                 print(f"{GREEN}[+] New Control Port: {BLUE}{TOR_CONTROL_PORT}{RESET}")
-                time.sleep(3)
+                pause(3)
                 return
             except ValueError:
                 print(f"{RED}[!] Invalid port number. Please enter a valid integer{RESET}")
         else:
             print(f"{RED}[!] Invalid choice. Please enter 'y' or 'n'{RESET}")
 
-def send_telegram_notification(message):
-    """Send notification to Telegram bot"""
-    if not TELEGRAM_ENABLED:
+class _Timing:
+    """Context manager timing one operation for Metrics; fail() marks it unsuccessful"""
+
+    def __init__(self, metrics, family, labels, phase=None):
+        self.metrics = metrics
+        self.family = family
+        self.labels = labels
+        self.phase = phase
+        self.ok = True
+
+    def fail(self):
+        self.ok = False
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.monotonic() - self.started
+        self.metrics.observe(self.family, elapsed, self.ok and exc_type is None, **self.labels)
+        if self.phase:
+            self.metrics._add_to_breakdown(self.phase, elapsed)
+        return False
+
+class Metrics:
+    """Latency histograms and success/failure counters, rendered for Prometheus
+
+    Each family has a kareem_net_fred_<family>_seconds histogram and a
+    kareem_net_fred_<family>_total counter with a result label. Phases of a
+    rotation also add up in the calling thread's breakdown(), which ends up
+    in the log entry.
+    """
+
+    PREFIX = "kareem_net_fred"
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(buckets or METRICS_BUCKETS)
+        self._histograms = {}  # (family, labels) -> [count per bucket..., count over the last, count, sum]
+        self._counters = {}  # (family, labels) -> count
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def observe(self, family, seconds, ok=True, **labels):
+        """Record one operation of the family"""
+        key = (family, tuple(sorted(labels.items())))
+        counter = (family, key[1] + (('result', 'success' if ok else 'failure'),))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 3)
+            histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+            self._counters[counter] = self._counters.get(counter, 0) + 1
+
+    def timed(self, family, **labels):
+        """Time a block as one operation of the family"""
+        return _Timing(self, family, labels)
+
+    def phase(self, name):
+        """Time a block as a rotation phase, counted in the current breakdown too"""
+        return _Timing(self, 'phase', {'phase': name}, phase=name)
+
+    @contextlib.contextmanager
+    def breakdown(self):
+        """Collect {phase: seconds} for phases timed by this thread inside the block
+
+        Phases of a nested breakdown count towards the enclosing one too.
+        """
+        previous = getattr(self._local, 'timings', None)
+        self._local.timings = timings = {}
+        try:
+            yield timings
+        finally:
+            self._local.timings = previous
+            for phase, seconds in timings.items():
+                self._add_to_breakdown(phase, seconds)
+
+    def _add_to_breakdown(self, phase, seconds):
+        timings = getattr(self._local, 'timings', None)
+        if timings is not None:
+            timings[phase] = round(timings.get(phase, 0) + seconds, 3)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        def format_labels(labels):
+            if not labels:
+                return ""
+            escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+            return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+        with self._lock:
+            histograms = {key: list(value) for key, value in self._histograms.items()}
+            counters = dict(self._counters)
+
+        lines = []
+        for family in sorted({family for family, _ in histograms}):
+            name = f"{self.PREFIX}_{family}_seconds"
+            lines.append(f"# TYPE {name} histogram")
+            for (hist_family, labels), histogram in sorted(histograms.items()):
+                if hist_family != family:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), histogram):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram[-1]:.6f}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram[-2]}")
+        for family in sorted({family for family, _ in counters}):
+            name = f"{self.PREFIX}_{family}_total"
+            lines.append(f"# TYPE {name} counter")
+            for (counter_family, labels), count in sorted(counters.items()):
+                if counter_family == family:
+                    lines.append(f"{name}{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """Atomically replace path with the current metrics"""
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w') as f:
+            f.write(self.render())
+        os.replace(temporary, path)
+
+metrics = Metrics()
+_metrics_server = None
+
+def start_metrics_server(listen=None, port=None):
+    """Serve metrics.render() on /metrics from a background thread"""
+    global _metrics_server
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    if _metrics_server is not None:
+        return _metrics_server
+    listen = listen or METRICS_LISTEN
+    port = port or METRICS_PORT
+    try:
+        _metrics_server = ThreadingHTTPServer((listen, port), MetricsHandler)
+    except OSError as e:
+        print(f"{RED}[!] Could not serve metrics on {listen}:{port}: {str(e)}{RESET}")
+        return None
+    _metrics_server.daemon_threads = True
+    threading.Thread(target=_metrics_server.serve_forever, name="metrics", daemon=True).start()
+    print(f"{GREEN}[+] Metrics on {BLUE}http://{listen}:{port}/metrics{RESET}")
+    return _metrics_server
+
+def export_metrics():
+    """Write the metrics textfile, if one is configured"""
+    if not METRICS_TEXTFILE:
         return
-    
     try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+        metrics.write_textfile(METRICS_TEXTFILE)
+    except OSError as e:
+        print(f"{RED}[!] Could not write metrics to {METRICS_TEXTFILE}: {str(e)}{RESET}")
+
+class TelegramNotifier:
+    """Background delivery queue for Telegram Bot API messages
+
+    Messages are sent from a worker thread over one pooled HTTPS session, so
+    rotation never waits on Telegram. When messages arrive faster than
+    TELEGRAM_MAX_RATE allows they are coalesced into one message, 429
+    responses are honoured via retry_after, and failures back off while
+    the messages wait in a bounded spill buffer.
+    """
+
+    def __init__(self, max_rate=None, buffer_size=None):
+        self.max_rate = max_rate or TELEGRAM_MAX_RATE
+        self.dropped = 0
+        self._pending = deque()
+        self._buffer_size = buffer_size or TELEGRAM_BUFFER_SIZE
+        self._cond = threading.Condition()
+        self._session = requests.Session()
+        self._next_send = 0.0
+        self._backoff = 0
+        self._sending = False
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="telegram-notifier", daemon=True)
+        self._thread.start()
+
+    def send(self, message):
+        """Queue a message without blocking"""
+        with self._cond:
+            if len(self._pending) >= self._buffer_size:
+                self._pending.popleft()  # Spill buffer full: oldest message goes
+                self.dropped += 1
+            self._pending.append(message)
+            self._cond.notify_all()
+
+    def send_now(self, message):
+        """Send a message synchronously, returning True on success"""
+        try:
+            delivered, retry_after = self._post(message)
+            return delivered
+        except Exception as e:
+            print(f"{RED}[!] Telegram notification error: {str(e)}{RESET}")
+            return False
+
+    def _post(self, text):
+        """POST one message; return (delivered, seconds to wait before retrying or None)"""
+        url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
         payload = {
             'chat_id': TELEGRAM_CHAT_ID,
-            'text': message,
+            'text': text,
             'parse_mode': 'HTML'
         }
-        response = requests.post(url, data=payload, timeout=10)
-        if response.status_code != 200:
-            print(f"{RED}[!] Failed to send Telegram notification{RESET}")
-    except Exception as e:
-        print(f"{RED}[!] Telegram notification error: {str(e)}{RESET}")
-
-def get_ip():
-    """Fetch current IP through Tor"""
-    proxies = {"http": TOR_SOCKS_PROXY, "https": TOR_SOCKS_PROXY}
-    urls = [
-        "https://check.torproject.org/api/ip",
-        "https://httpbin.org/ip",
-        "https://api.ipify.org?format=json"
-    ]
-    for url in urls:
-        try:
-            r = requests.get(url, proxies=proxies, timeout=10)
-            data = r.json()
-            if "IP" in data:
-                return data["IP"]
-            if "origin" in data:
-                return data["origin"]
-            if "ip" in data:
-                return data["ip"]
+        started = time.monotonic()
+        try:
+            response = self._session.post(url, data=payload, timeout=10)
         except Exception:
-            continue
-    return None
+            metrics.observe('telegram', time.monotonic() - started, False, status='error')
+            raise
+        metrics.observe('telegram', time.monotonic() - started, response.status_code == 200,
+                        status=str(response.status_code))
+        if response.status_code == 200:
+            return True, None
+        if response.status_code == 429:
+            try:
+                return False, float(response.json()['parameters']['retry_after'])
+            except Exception:
+                return False, float(TELEGRAM_RETRY_BACKOFF[0])
+        if response.status_code >= 500:
+            raise requests.HTTPError(f"HTTP {response.status_code}")
+        # Other 4xx errors (bad token, malformed HTML) will not succeed on retry
+        print(f"{RED}[!] Failed to send Telegram notification: HTTP {response.status_code}{RESET}")
+        return False, None
 
-def get_location_for_ip(ip):
-    """Get country and city for a given IP"""
-    if not ip:
-        return "Not Defined", "Not Defined"
+    @staticmethod
+    def _split(message):
+        """Split a message into a head within Telegram's length limit and the rest
 
-    try:
-        r_country = requests.get(f"https://ipapi.co/{ip}/country_name/", timeout=10)
-        r_city = requests.get(f"https://ipapi.co/{ip}/city/", timeout=10)
-        if r_country.status_code == 200 and r_city.status_code == 200:
-            country = r_country.text.strip()
-            city = r_city.text.strip()
-
-            # Track visited countries
-            if country != "Not Defined":
-                if country not in visited_countries:
-                    visited_countries[country] = {
-                        'first_seen': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        'last_seen': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        'cities': set([city])
-                    }
-                else:
-                    visited_countries[country]['last_seen'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    visited_countries[country]['cities'].add(city)
+        Cuts at the last line break that fits, so the HTML tags on each line
+        stay balanced; a single line that is too long is cut at the limit.
+        """
+        cut = message.rfind('\n', 0, TELEGRAM_MAX_MESSAGE_LENGTH + 1)
+        if cut <= 0:
+            cut = TELEGRAM_MAX_MESSAGE_LENGTH
+        return message[:cut], message[cut:].lstrip('\n')
 
-            return country, city
-    except:
-        pass
+    def _take_batch(self):
+        """Coalesce pending messages into one, within Telegram's length limit
 
-    try:
-        r = requests.get(f"https://ipwhois.app/json/{ip}", timeout=10)
-        if r.status_code == 200:
-            data = r.json()
-            country = data.get("country", "Not Defined")
-            city = data.get("city", "Not Defined")
-
-            # Track visited countries
-            if country != "Not Defined":
-                if country not in visited_countries:
-                    visited_countries[country] = {
-                        'first_seen': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        'last_seen': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        'cities': set([city])
-                    }
+        A message too long on its own is split; its remainder stays at the
+        front of the queue for the next batch.
+        """
+        batch = []
+        size = 0
+        while self._pending:
+            message = self._pending[0]
+            if batch and size + len(message) + len(TELEGRAM_BATCH_SEPARATOR) > TELEGRAM_MAX_MESSAGE_LENGTH:
+                break
+            if len(message) > TELEGRAM_MAX_MESSAGE_LENGTH:
+                head, rest = self._split(message)
+                if rest:
+                    self._pending[0] = rest
                 else:
-                    visited_countries[country]['last_seen'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    visited_countries[country]['cities'].add(city)
+                    self._pending.popleft()
+                batch.append(head)
+                break
+            batch.append(self._pending.popleft())
+            size += len(message) + len(TELEGRAM_BATCH_SEPARATOR)
+        return batch
 
-            return country, city
-    except:
-        pass
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped and not self._pending:
+                    return
+                # Rate limit: let more messages accumulate until the next slot
+                delay = self._next_send - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                batch = self._take_batch()
+                self._sending = True
 
-    return "Not Defined", "Not Defined"
+            retry_after = None
+            try:
+                delivered, retry_after = self._post(TELEGRAM_BATCH_SEPARATOR.join(batch))
+                self._backoff = 0
+            except Exception as e:
+                retry_after = TELEGRAM_RETRY_BACKOFF[min(self._backoff, len(TELEGRAM_RETRY_BACKOFF) - 1)]
+                self._backoff += 1
+                print(f"{RED}[!] Telegram notification error: {str(e)}{RESET}")
 
-def change_tor_ip():
-    """Send NEWNYM signal to Tor to get new IP"""
-    try:
-        with Controller.from_port(port=TOR_CONTROL_PORT) as controller:
-            controller.authenticate()
-            controller.signal(Signal.NEWNYM)
-    except Exception as e:
-        print(f"{RED}[!] Error changing Tor IP: {str(e)}{RESET}")
-        print(f"{YELLOW}[*] Trying to restart Tor service...{RESET}")
-        try:
-            subprocess.run(['sudo', 'systemctl', 'restart', 'tor'], check=True)
-            time.sleep(5)  # Give Tor time to restart
-        except Exception as e:
-            print(f"{RED}[!] Failed to restart Tor: {str(e)}{RESET}")
+            with self._cond:
+                self._sending = False
+                if retry_after is not None:
+                    # Put the batch back in front, still bounded by the spill buffer
+                    self._pending.extendleft(reversed(batch))
+                    while len(self._pending) > self._buffer_size:
+                        self._pending.pop()
+                        self.dropped += 1
+                    self._next_send = time.monotonic() + retry_after
+                else:
+                    self._next_send = time.monotonic() + 60.0 / self.max_rate
+                self._cond.notify_all()
 
-def get_real_ip():
-    """Get real IP (not via Tor)"""
-    try:
-        r = requests.get("https://api.ipify.org?format=json", timeout=10)
-        return r.json()["ip"]
-    except:
-        return "Not Defined"
+    def flush(self, timeout=None):
+        """Wait until pending messages are delivered or timeout expires"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._sending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
 
-def get_current_mac(interface=DEFAULT_INTERFACE):
-    """Get current MAC address of specified interface"""
-    try:
-        result = subprocess.check_output(['ifconfig', interface], stderr=subprocess.STDOUT)
-        result = result.decode('utf-8')
-        mac_match = re.search(r'ether\s+([0-9a-fA-F:]{17})', result)
-        if mac_match:
-            return mac_match.group(1)
-    except Exception as e:
-        print(f"{RED}[!] Error getting MAC address from ifconfig: {str(e)}{RESET}")
-    
-    # Fallback method 1 - ip link
-    try:
-        result = subprocess.check_output(['ip', 'link', 'show', interface], stderr=subprocess.STDOUT)
-        result = result.decode('utf-8')
-        mac_match = re.search(r'link/ether\s+([0-9a-fA-F:]{17})', result)
-        if mac_match:
-            return mac_match.group(1)
-    except Exception as e:
-        print(f"{RED}[!] Error getting MAC address from ip link: {str(e)}{RESET}")
-    
-    # Fallback method 2 - System UUID
-    try:
-        mac = uuid.UUID(int=uuid.getnode()).hex[-12:]
-        return ":".join([mac[e:e+2] for e in range(0, 12, 2)])
-    except:
-        return "Not Defined"
+    def stop(self, timeout=None):
+        """Deliver what can be delivered within timeout, then stop"""
+        self.flush(timeout)
+        with self._cond:
+            self._stopped = True
+            self._pending.clear()
+            self._cond.notify_all()
+        self._thread.join(1)
+        self._session.close()
 
-def generate_random_mac():
-    """Generate a random MAC address"""
-    # The first byte should be even (unicast) and not locally administered
-    first_byte = random.randint(0x00, 0x7F) * 2
-    mac = [first_byte] + [random.randint(0x00, 0xFF) for _ in range(5)]
-    return ":".join(f"{x:02x}" for x in mac)
+_telegram_notifier = None
+_telegram_notifier_lock = threading.Lock()
 
-def change_mac_address(interface=DEFAULT_INTERFACE):
-    """Change MAC address using multiple methods with fallback"""
-    global MAC_CHANGE_METHOD, NEW_MAC
-    
-    original_mac = get_current_mac(interface)
-    if original_mac == "Not Defined":
-        print(f"{RED}[!] Could not determine current MAC address{RESET}")
-        return False
-    
-    print(f"\n{YELLOW}[*] Current MAC: {BLUE}{original_mac}{RESET}")
-    
-    methods = [
-        ('macchanger', ['sudo', 'macchanger', '-r', interface]),
-        ('ifconfig down/up', [
-            'sudo', 'ifconfig', interface, 'down',
-            '&&', 'sudo', 'ifconfig', interface, 'hw', 'ether', generate_random_mac(),
-            '&&', 'sudo', 'ifconfig', interface, 'up'
-        ]),
-        ('ip link set', [
-            'sudo', 'ip', 'link', 'set', interface, 'down',
-            '&&', 'sudo', 'ip', 'link', 'set', interface, 'address', generate_random_mac(),
-            '&&', 'sudo', 'ip', 'link', 'set', interface, 'up'
-        ])
-    ]
-    
-    if MAC_CHANGE_METHOD == 'specific' and NEW_MAC:
-        methods.insert(0, ('specific mac', [
-            'sudo', 'ifconfig', interface, 'down',
-            '&&', 'sudo', 'ifconfig', interface, 'hw', 'ether', NEW_MAC,
-            '&&', 'sudo', 'ifconfig', interface, 'up'
-        ]))
-    
-    success = False
-    for method_name, cmd in methods:
-        try:
-            print(f"{YELLOW}[*] Trying method: {method_name}{RESET} \n")
-            
-            if '&&' in cmd:
-                # Handle multiple commands
-                full_cmd = ' '.join(cmd)
-                subprocess.run(full_cmd, shell=True, check=True)
-            else:
-                subprocess.run(cmd, check=True)
-            
-            time.sleep(2)  # Give interface time to reset
-            
-            new_mac = get_current_mac(interface)
-            if new_mac != original_mac and new_mac != "Not Defined":
-                print(f"\n{GREEN}[✓] MAC changed successfully using {method_name}{RESET}")
-                print(f"{GREEN}[+] New MAC: {BLUE}{new_mac}{RESET}")
-                success = True
-                break
-        except Exception as e:
-            print(f"{RED}[!] Failed with {method_name}: {str(e)}{RESET}")
-            continue
-    
-    if not success:
-        print(f"{RED}[!] All MAC change methods failed{RESET}")
-        return False
-    
-    return True
+def get_telegram_notifier():
+    """Return the shared background Telegram notifier"""
+    global _telegram_notifier
 
-def print_banner():
-    print(rf"""{BLUE}
-     ██╗  ██╗ █████╗ ██████╗ ███████╗███████╗███╗   ███╗    ███╗   ██╗███████╗████████╗
-     ██║ ██╔╝██╔══██╗██╔══██╗██╔════╝██╔════╝████╗ ████║    ████╗  ██║██╔════╝╚══██╔══╝
-     █████╔╝ ███████║██████╔╝█████╗  █████╗  ██╔████╔██║    ██╔██╗ ██║█████╗     ██║   
-     ██╔═██╗ ██╔══██║██╔══██╗██╔══╝  ██╔══╝  ██║╚██╔╝██║    ██║╚██╗██║██╔══╝     ██║   
-     ██║  ██╗██║  ██║██║  ██║███████╗███████╗██║ ╚═╝ ██║    ██║ ╚████║███████╗   ██║   
-     ╚═╝  ╚═╝╚═╝  ╚═╝╚═╝  ╚═╝╚══════╝╚══════╝╚═╝     ╚═╝    ╚═╝  ╚═══╝╚══════╝   ╚═╝   
-     {RESET}
-          {YELLOW}
-          ███████╗██████╗ ███████╗██████╗ 
-          ██╔════╝██╔══██╗██╔════╝██╔══██╗
-          █████╗  ██████╔╝█████╗  ██║  ██║
-          ██╔══╝  ██╔══██╗██╔══╝  ██║  ██║
-          ██║     ██║  ██║███████╗██████╔╝
-          ╚═╝     ╚═╝  ╚═╝╚══════╝╚═════╝  {GREEN} Freedom Through Anonymity{RESET}
+    with _telegram_notifier_lock:
+        if _telegram_notifier is None:
+            _telegram_notifier = TelegramNotifier()
+        return _telegram_notifier
 
-     {YELLOW}[+] IP Changer with Country & City Lookup
-     [+] Coded by: Kareem Abdelmuttalib
-     [+] Freedom Through Anonymity
-     [+] Stay Hidden, Stay Safe{RESET}
-     """)
+def stop_telegram_notifier():
+    """Flush queued notifications on shutdown"""
+    global _telegram_notifier
 
-def print_country_chain():
-    """Display visited countries chain in a box"""
-    if not visited_countries:
+    with _telegram_notifier_lock:
+        if _telegram_notifier is not None:
+            _telegram_notifier.stop(TELEGRAM_FLUSH_TIMEOUT)
+            _telegram_notifier = None
+
+atexit.register(stop_telegram_notifier)
+
+def send_telegram_notification(message):
+    """Send notification to Telegram bot"""
+    if not TELEGRAM_ENABLED:
         return
     
-    countries = list(visited_countries.keys())
-    arrow = f"{MAGENTA}→{RESET}"
-    country_chain = f" {arrow} ".join(countries)
-    
-    print(f"\n{YELLOW}┌─────────────────────────────────────────────────────────────────────────────────────────┐")
-    print(f"{YELLOW}│ {CYAN}{country_chain}{RESET}")
+    get_telegram_notifier().send(message)
+
+_tor_session = None
+_tor_session_proxy = None
+_tor_session_lock = threading.Lock()
+
+def get_tor_session():
+    """Return the pooled keep-alive HTTP session routed through Tor"""
+    global _tor_session, _tor_session_proxy
+
+    with _tor_session_lock:
+        if _tor_session is None or _tor_session_proxy != TOR_SOCKS_PROXY:
+            if _tor_session is not None:
+                _tor_session.close()
+            session = requests.Session()
+            session.proxies = {"http": TOR_SOCKS_PROXY, "https": TOR_SOCKS_PROXY}
+            adapter = requests.adapters.HTTPAdapter(pool_connections=len(IP_CHECK_ENDPOINTS), pool_maxsize=4)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _tor_session = session
+            _tor_session_proxy = TOR_SOCKS_PROXY
+        return _tor_session
+
+def reset_tor_session():
+    """Drop pooled connections, which stay pinned to the circuit they were opened on"""
+    global _tor_session
+
+    with _tor_session_lock:
+        if _tor_session is not None:
+            _tor_session.close()
+            _tor_session = None
+
+class IpCheckStats:
+    """Per-endpoint success/failure counts and smoothed latency"""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, url, ok, latency=None):
+        with self._lock:
+            stats = self._stats.setdefault(url, {'success': 0, 'failure': 0, 'streak': 0, 'latency': None})
+            if ok:
+                stats['success'] += 1
+                stats['streak'] = 0
+                if stats['latency'] is None:
+                    stats['latency'] = latency
+                else:
+                    stats['latency'] = 0.7 * stats['latency'] + 0.3 * latency
+            else:
+                stats['failure'] += 1
+                stats['streak'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {url: dict(stats) for url, stats in self._stats.items()}
+
+    def rank(self, endpoints):
+        """Split endpoints into healthy and demoted, fastest first"""
+        with self._lock:
+            def score(url):
+                stats = self._stats.get(url)
+                if not stats or stats['latency'] is None:
+                    return 0  # Untried endpoints get a fair chance
+                return stats['latency']
+
+            healthy, demoted = [], []
+            for url in sorted(endpoints, key=score):
+                stats = self._stats.get(url)
+                if stats and stats['streak'] >= IP_CHECK_DEMOTE_AFTER:
+                    demoted.append(url)
+                else:
+                    healthy.append(url)
+            return healthy, demoted
+
+_ip_check_stats = IpCheckStats()  # Shared by get_ip callers that bring no stats of their own
+
+def get_ip_check_stats():
+    """Return a snapshot of per-endpoint IP check statistics"""
+    return _ip_check_stats.snapshot()
+
+def _parse_ip_response(data):
+    """Extract and validate the IP from any of the known check endpoints"""
+    for key in ("IP", "origin", "ip"):
+        if key in data:
+            ip = str(data[key]).split(",")[0].strip()
+            ipaddress.ip_address(ip)
+            return ip
+    raise ValueError("no IP in response")
+
+def get_ip(session=None, endpoints=None, stats=None):
+    """Fetch current IP through Tor, racing all check endpoints
+
+    endpoints default to IP_CHECK_ENDPOINTS and stats (an IpCheckStats) to
+    the module-wide one.
+    """
+    with metrics.phase('ip_check') as timing:
+        ip = _race_ip_checks(session, endpoints, stats)
+        if ip is None:
+            timing.fail()
+    return ip
+
+def _race_ip_checks(session=None, endpoints=None, stats=None):
+    stats = stats or _ip_check_stats
+    healthy, demoted = stats.rank(endpoints or IP_CHECK_ENDPOINTS)
+    if not healthy:
+        healthy, demoted = demoted, []
+
+    session = session or get_tor_session()
+    done = threading.Event()
+    escalate = threading.Event()  # Set once every healthy endpoint has failed
+    failures = [0]
+    failures_lock = threading.Lock()
+
+    def check(url, delay):
+        if delay:
+            escalate.wait(delay)
+        if done.is_set():
+            return None
+
+        start = time.monotonic()
+        try:
+            r = session.get(url, timeout=IP_CHECK_TIMEOUT)
+            ip = _parse_ip_response(r.json())
+        except Exception:
+            stats.record(url, False)
+            metrics.observe('ip_check', time.monotonic() - start, False, endpoint=url)
+            if delay == 0:
+                with failures_lock:
+                    failures[0] += 1
+                    if failures[0] == len(healthy):
+                        escalate.set()
+            return None
+
+        stats.record(url, True, time.monotonic() - start)
+        metrics.observe('ip_check', time.monotonic() - start, True, endpoint=url)
+        return ip
+
+    jobs = [(url, 0) for url in healthy]
+    jobs += [(url, IP_CHECK_HEDGE_DELAY * (i + 1)) for i, url in enumerate(demoted)]
+
+    executor = ThreadPoolExecutor(max_workers=len(jobs))
+    try:
+        futures = [executor.submit(check, url, delay) for url, delay in jobs]
+        deadline = IP_CHECK_TIMEOUT + IP_CHECK_HEDGE_DELAY * len(demoted)
+        for future in as_completed(futures, timeout=deadline):
+            ip = future.result()
+            if ip:
+                return ip
+    except FuturesTimeoutError:
+        pass
+    finally:
+        # First answer wins: queued checks are cancelled, stragglers are ignored
+        done.set()
+        escalate.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+    return None
+
+class GeoCache:
+    """Bounded LRU cache of IP locations with TTL, persisted to a JSON file"""
+
+    def __init__(self, path=GEO_CACHE_FILE, max_size=GEO_CACHE_SIZE, ttl=GEO_CACHE_TTL):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # ip -> [country, city, fetched_at]
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._dirty = False
+        self._last_save = 0.0
+
+    def _load(self):
+        self._loaded = True
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            now = time.time()
+            for ip, entry in sorted(data.items(), key=lambda item: item[1][2]):
+                if now - entry[2] < self.ttl:
+                    self._entries[ip] = entry
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        except Exception as e:
+            print(f"{RED}[!] Ignoring unreadable geo cache {self.path}: {str(e)}{RESET}")
+
+    def get(self, ip):
+        """Return (country, city) if cached and fresh, else None"""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            entry = self._entries.get(ip)
+            if entry is None:
+                return None
+            if time.time() - entry[2] >= self.ttl:
+                del self._entries[ip]
+                self._dirty = True
+                return None
+            self._entries.move_to_end(ip)
+            return entry[0], entry[1]
+
+    def put(self, ip, country, city):
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            self._entries[ip] = [country, city, time.time()]
+            self._entries.move_to_end(ip)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._dirty = True
+            if time.monotonic() - self._last_save >= GEO_CACHE_SAVE_INTERVAL:
+                self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+            self._last_save = time.monotonic()
+        except Exception as e:
+            print(f"{RED}[!] Failed to write geo cache: {str(e)}{RESET}")
+
+    def save(self):
+        """Write pending entries to disk"""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+geo_cache = GeoCache()
+atexit.register(geo_cache.save)
+
+# ISO 3166 country codes used by tor's geoip files
+COUNTRY_NAMES = {
+    'AD': 'Andorra', 'AE': 'United Arab Emirates', 'AF': 'Afghanistan', 'AG': 'Antigua and Barbuda', 'AI': 'Anguilla',
+    'AL': 'Albania', 'AM': 'Armenia', 'AO': 'Angola', 'AQ': 'Antarctica', 'AR': 'Argentina', 'AS': 'American Samoa',
+    'AT': 'Austria', 'AU': 'Australia', 'AW': 'Aruba', 'AX': 'Åland Islands', 'AZ': 'Azerbaijan',
+    'BA': 'Bosnia and Herzegovina', 'BB': 'Barbados', 'BD': 'Bangladesh', 'BE': 'Belgium', 'BF': 'Burkina Faso',
+    'BG': 'Bulgaria', 'BH': 'Bahrain', 'BI': 'Burundi', 'BJ': 'Benin', 'BL': 'Saint Barthélemy', 'BM': 'Bermuda',
+    'BN': 'Brunei', 'BO': 'Bolivia', 'BQ': 'Bonaire, Sint Eustatius and Saba', 'BR': 'Brazil', 'BS': 'Bahamas',
+    'BT': 'Bhutan', 'BV': 'Bouvet Island', 'BW': 'Botswana', 'BY': 'Belarus', 'BZ': 'Belize', 'CA': 'Canada',
+    'CC': 'Cocos (Keeling) Islands', 'CD': 'DR Congo', 'CF': 'Central African Republic', 'CG': 'Congo',
+    'CH': 'Switzerland', 'CI': 'Ivory Coast', 'CK': 'Cook Islands', 'CL': 'Chile', 'CM': 'Cameroon', 'CN': 'China',
+    'CO': 'Colombia', 'CR': 'Costa Rica', 'CU': 'Cuba', 'CV': 'Cape Verde', 'CW': 'Curaçao', 'CX': 'Christmas Island',
+    'CY': 'Cyprus', 'CZ': 'Czechia', 'DE': 'Germany', 'DJ': 'Djibouti', 'DK': 'Denmark', 'DM': 'Dominica',
+    'DO': 'Dominican Republic', 'DZ': 'Algeria', 'EC': 'Ecuador', 'EE': 'Estonia', 'EG': 'Egypt',
+    'EH': 'Western Sahara', 'ER': 'Eritrea', 'ES': 'Spain', 'ET': 'Ethiopia', 'FI': 'Finland', 'FJ': 'Fiji',
+    'FK': 'Falkland Islands', 'FM': 'Micronesia', 'FO': 'Faroe Islands', 'FR': 'France', 'GA': 'Gabon',
+    'GB': 'United Kingdom', 'GD': 'Grenada', 'GE': 'Georgia', 'GF': 'French Guiana', 'GG': 'Guernsey', 'GH': 'Ghana',
+    'GI': 'Gibraltar', 'GL': 'Greenland', 'GM': 'Gambia', 'GN': 'Guinea', 'GP': 'Guadeloupe',
+    'GQ': 'Equatorial Guinea', 'GR': 'Greece', 'GS': 'South Georgia and the South Sandwich Islands',
+    'GT': 'Guatemala', 'GU': 'Guam', 'GW': 'Guinea-Bissau', 'GY': 'Guyana', 'HK': 'Hong Kong',
+    'HM': 'Heard Island and McDonald Islands', 'HN': 'Honduras', 'HR': 'Croatia', 'HT': 'Haiti', 'HU': 'Hungary',
+    'ID': 'Indonesia', 'IE': 'Ireland', 'IL': 'Israel', 'IM': 'Isle of Man', 'IN': 'India',
+    'IO': 'British Indian Ocean Territory', 'IQ': 'Iraq', 'IR': 'Iran', 'IS': 'Iceland', 'IT': 'Italy',
+    'JE': 'Jersey', 'JM': 'Jamaica', 'JO': 'Jordan', 'JP': 'Japan', 'KE': 'Kenya', 'KG': 'Kyrgyzstan',
+    'KH': 'Cambodia', 'KI': 'Kiribati', 'KM': 'Comoros', 'KN': 'Saint Kitts and Nevis', 'KP': 'North Korea',
+    'KR': 'South Korea', 'KW': 'Kuwait', 'KY': 'Cayman Islands', 'KZ': 'Kazakhstan', 'LA': 'Laos', 'LB': 'Lebanon',
+    'LC': 'Saint Lucia', 'LI': 'Liechtenstein', 'LK': 'Sri Lanka', 'LR': 'Liberia', 'LS': 'Lesotho',
+    'LT': 'Lithuania', 'LU': 'Luxembourg', 'LV': 'Latvia', 'LY': 'Libya', 'MA': 'Morocco', 'MC': 'Monaco',
+    'MD': 'Moldova', 'ME': 'Montenegro', 'MF': 'Saint Martin', 'MG': 'Madagascar', 'MH': 'Marshall Islands',
+    'MK': 'North Macedonia', 'ML': 'Mali', 'MM': 'Myanmar', 'MN': 'Mongolia', 'MO': 'Macao',
+    'MP': 'Northern Mariana Islands', 'MQ': 'Martinique', 'MR': 'Mauritania', 'MS': 'Montserrat', 'MT': 'Malta',
+    'MU': 'Mauritius', 'MV': 'Maldives', 'MW': 'Malawi', 'MX': 'Mexico', 'MY': 'Malaysia', 'MZ': 'Mozambique',
+    'NA': 'Namibia', 'NC': 'New Caledonia', 'NE': 'Niger', 'NF': 'Norfolk Island', 'NG': 'Nigeria', 'NI': 'Nicaragua',
+    'NL': 'Netherlands', 'NO': 'Norway', 'NP': 'Nepal', 'NR': 'Nauru', 'NU': 'Niue', 'NZ': 'New Zealand',
+    'OM': 'Oman', 'PA': 'Panama', 'PE': 'Peru', 'PF': 'French Polynesia', 'PG': 'Papua New Guinea',
+    'PH': 'Philippines', 'PK': 'Pakistan', 'PL': 'Poland', 'PM': 'Saint Pierre and Miquelon',
+    'PN': 'Pitcairn Islands', 'PR': 'Puerto Rico', 'PS': 'Palestine', 'PT': 'Portugal', 'PW': 'Palau',
+    'PY': 'Paraguay', 'QA': 'Qatar', 'RE': 'Réunion', 'RO': 'Romania', 'RS': 'Serbia', 'RU': 'Russia', 'RW': 'Rwanda',
+    'SA': 'Saudi Arabia', 'SB': 'Solomon Islands', 'SC': 'Seychelles', 'SD': 'Sudan', 'SE': 'Sweden',
+    'SG': 'Singapore', 'SH': 'Saint Helena', 'SI': 'Slovenia', 'SJ': 'Svalbard and Jan Mayen', 'SK': 'Slovakia',
+    'SL': 'Sierra Leone', 'SM': 'San Marino', 'SN': 'Senegal', 'SO': 'Somalia', 'SR': 'Suriname', 'SS': 'South Sudan',
+    'ST': 'Sao Tome and Principe', 'SV': 'El Salvador', 'SX': 'Sint Maarten', 'SY': 'Syria', 'SZ': 'Eswatini',
+    'TC': 'Turks and Caicos Islands', 'TD': 'Chad', 'TF': 'French Southern Territories', 'TG': 'Togo',
+    'TH': 'Thailand', 'TJ': 'Tajikistan', 'TK': 'Tokelau', 'TL': 'Timor-Leste', 'TM': 'Turkmenistan', 'TN': 'Tunisia',
+    'TO': 'Tonga', 'TR': 'Turkey', 'TT': 'Trinidad and Tobago', 'TV': 'Tuvalu', 'TW': 'Taiwan', 'TZ': 'Tanzania',
+    'UA': 'Ukraine', 'UG': 'Uganda', 'UM': 'U.S. Minor Outlying Islands', 'US': 'United States', 'UY': 'Uruguay',
+    'UZ': 'Uzbekistan', 'VA': 'Vatican City', 'VC': 'Saint Vincent and the Grenadines', 'VE': 'Venezuela',
+    'VG': 'British Virgin Islands', 'VI': 'U.S. Virgin Islands', 'VN': 'Vietnam', 'VU': 'Vanuatu',
+    'WF': 'Wallis and Futuna', 'WS': 'Samoa', 'YE': 'Yemen', 'YT': 'Mayotte', 'ZA': 'South Africa', 'ZM': 'Zambia',
+    'ZW': 'Zimbabwe'
+}
+
+class GeoIPIndex:
+    """Offline IP-to-location index over sorted, array-backed address ranges
+
+    Ranges are loaded from tor's geoip/geoip6 files or a CSV database and
+    answered by binary search, so lookups never leave the box.
+    """
+
+    def __init__(self):
+        self._ranges = {4: [], 6: []}  # Unsorted (start, end, location id) while loading
+        self._index = {}  # version -> (starts, ends, location ids)
+        self._locations = []  # (country, city)
+        self._location_ids = {}
+
+    def __len__(self):
+        return sum(len(index[0]) for index in self._index.values())
+
+    def _location_id(self, country, city):
+        if len(country) == 2 and country.isalpha():
+            country = COUNTRY_NAMES.get(country.upper(), country.upper())
+        key = (country, city or None)
+        if key not in self._location_ids:
+            self._location_ids[key] = len(self._locations)
+            self._locations.append(key)
+        return self._location_ids[key]
+
+    def add_range(self, start, end, country, city=None):
+        """Add an inclusive range given as addresses or integers"""
+        if isinstance(start, str):
+            start = ipaddress.ip_address(start.strip())
+            end = ipaddress.ip_address(end.strip())
+            version = start.version
+            start, end = int(start), int(end)
+        else:
+            version = 4 if end <= 0xFFFFFFFF else 6
+        self._ranges[version].append((start, end, self._location_id(country, city)))
+
+    def load_tor_geoip(self, path):
+        """Load a tor geoip (integer IPv4 ranges) or geoip6 (address ranges) file"""
+        count = 0
+        with open(path, 'r') as f:
+            for line in f:
+                if not line.strip() or line.startswith('#'):
+                    continue
+                start, end, country = line.strip().split(',')[:3]
+                if country in ('??', ''):
+                    continue
+                if start.isdigit():
+                    self.add_range(int(start), int(end), country)
+                else:
+                    self.add_range(start, end, country)
+                count += 1
+        return count
+
+    def load_csv(self, path):
+        """Load a CSV database of start,end,country[,city] rows"""
+        count = 0
+        with open(path, 'r', newline='') as f:
+            for row in csv.reader(f):
+                if len(row) < 3 or row[0].startswith('#'):
+                    continue
+                start, end, country = row[0].strip(), row[1].strip(), row[2].strip()
+                city = row[3].strip() if len(row) > 3 else None
+                try:
+                    if start.isdigit():
+                        self.add_range(int(start), int(end), country, city)
+                    else:
+                        self.add_range(start, end, country, city)
+                except ValueError:
+                    continue  # Header or malformed row
+                count += 1
+        return count
+
+    def freeze(self):
+        """Sort loaded ranges into compact arrays ready for lookups"""
+        for version, ranges in self._ranges.items():
+            if version in self._index:
+                starts, ends, ids = self._index[version]
+                ranges.extend(zip(starts, ends, ids))
+            ranges.sort()
+            starts = [r[0] for r in ranges]
+            ends = [r[1] for r in ranges]
+            ids = array('I', (r[2] for r in ranges))
+            if version == 4:
+                # IPv4 fits in 32 bits; IPv6 stays as Python ints
+                starts, ends = array('I', starts), array('I', ends)
+            self._index[version] = (starts, ends, ids)
+        self._ranges = {4: [], 6: []}
+        return self
+
+    def lookup(self, ip):
+        """Return (country, city or None) for an IP, or None if not covered"""
+        try:
+            if ':' in ip:
+                version, value = 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), 'big')
+                if value >> 32 == 0xFFFF:  # IPv4-mapped ::ffff:a.b.c.d
+                    version, value = 4, value & 0xFFFFFFFF
+            else:
+                version, value = 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+        except (OSError, TypeError):
+            return None
+
+        index = self._index.get(version)
+        if not index:
+            return None
+        starts, ends, ids = index
+        i = bisect.bisect_right(starts, value) - 1
+        if i >= 0 and value <= ends[i]:
+            return self._locations[ids[i]]
+        return None
+
+_geoip_index = None
+_geoip_index_lock = threading.Lock()
+
+def get_geoip_index():
+    """Load the offline geolocation index on first use"""
+    global _geoip_index
+
+    with _geoip_index_lock:
+        if _geoip_index is None:
+            index = GeoIPIndex()
+            paths = ([GEO_DATABASE_FILE] if GEO_DATABASE_FILE else []) + TOR_GEOIP_FILES
+            for path in paths:
+                if not os.path.exists(path):
+                    continue
+                try:
+                    if path == GEO_DATABASE_FILE:
+                        index.load_csv(path)
+                    else:
+                        index.load_tor_geoip(path)
+                except Exception as e:
+                    print(f"{RED}[!] Failed to load geo database {path}: {str(e)}{RESET}")
+            _geoip_index = index.freeze()
+            if not len(_geoip_index):
+                print(f"{YELLOW}[!] No offline geo database found, install tor-geoipdb or set GEO_DATABASE_FILE{RESET}")
+        return _geoip_index
+
+def track_country(country, city):
+    """Record a country/city in the visited countries chain"""
+    if country == "Not Defined":
+        return
+
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with visited_countries_lock:
+        if country not in visited_countries:
+            visited_countries[country] = {
+                'first_seen': now,
+                'last_seen': now,
+                'cities': set([city])
+            }
+        else:
+            visited_countries[country]['last_seen'] = now
+            visited_countries[country]['cities'].add(city)
+
+def lookup_location(ip):
+    """Query the remote geolocation APIs for a given IP"""
+    with metrics.timed('geo_lookup', provider='ipapi.co') as timing:
+        try:
+            r = requests.get(f"{GEO_IPAPI_URL}/{ip}/json/", timeout=10)
+            if r.status_code == 200:
+                data = r.json()
+                if not data.get("error") and data.get("country_name"):
+                    return data["country_name"], data.get("city") or "Not Defined"
+        except:
+            pass
+        timing.fail()
+
+    with metrics.timed('geo_lookup', provider='ipwhois.app') as timing:
+        try:
+            r = requests.get(f"{GEO_IPWHOIS_URL}/json/{ip}", timeout=10)
+            if r.status_code == 200:
+                data = r.json()
+                if data.get("country"):
+                    return data["country"], data.get("city") or "Not Defined"
+        except:
+            pass
+        timing.fail()
+
+    return None
+
+def get_location_for_ip(ip, track=True, backend=None):
+    """Get country and city for a given IP, adding it to the visited countries chain if track
+
+    backend overrides GEO_BACKEND for this lookup.
+    """
+    if not ip:
+        return "Not Defined", "Not Defined"
+
+    backend = backend or GEO_BACKEND
+    location = None
+    if backend in ('offline', 'offline+remote'):
+        location = get_geoip_index().lookup(ip)
+
+    if backend == 'offline':
+        if location is None:
+            return "Not Defined", "Not Defined"
+        location = (location[0], location[1] or "Not Defined")
+    elif location is None or not location[1]:
+        # Remote APIs only for what the local database cannot answer (city level)
+        cached = geo_cache.get(ip)
+        if cached is None:
+            cached = lookup_location(ip)
+            if cached is not None:
+                geo_cache.put(ip, *cached)
+        if cached is not None:
+            location = cached
+        elif location is not None:
+            location = (location[0], "Not Defined")
+        else:
+            return "Not Defined", "Not Defined"
+
+    country, city = location
+    if track:
+        track_country(country, city)
+    return country, city
+
+class TorControlSession:
+    """Long-lived, auto-reconnecting connection to the Tor control interface
+
+    One authenticated controller is kept open and shared by everything that
+    talks to tor. If tor drops the connection it is re-established in the
+    background with a short backoff; event listeners registered on the
+    controller survive the reconnect.
+
+    CIRC, STREAM and NOTICE events are followed so callers can block until
+    tor has actually built a fresh circuit after NEWNYM, including the extra
+    delay tor imposes when it rate-limits NEWNYM.
+    """
+
+    def __init__(self, port=TOR_CONTROL_PORT, socket_path=None, password=None, address='127.0.0.1'):
+        self.port = port
+        self.socket_path = socket_path
+        self.password = password
+        self.address = address
+        self._controller = None
+        self._lock = threading.RLock()
+        self._closing = False
+
+        # Circuit state fed by control port events
+        self._circuit_cond = threading.Condition()
+        self._last_built_at = 0.0
+        self._last_built_id = None
+        self._newnym_sent_at = 0.0
+        self._newnym_ready_at = 0.0
+        self._built_circuits = {}  # circuit id -> monotonic time it was built
+        self.last_stream_circuit = None
+
+        # Bootstrap state fed by STATUS_CLIENT events and status/* queries
+        self._status_cond = threading.Condition()
+        self.bootstrap = {'progress': 0, 'tag': None, 'summary': None, 'circuit_established': False}
+
+    def _open(self):
+        """Connect and authenticate a new controller (cookie, password or none)"""
+        if self.socket_path:
+            controller = Controller.from_socket_file(path=self.socket_path)
+        else:
+            controller = Controller.from_port(address=self.address, port=self.port)
+
+        try:
+            controller.authenticate(password=self.password)
+        except Exception:
+            controller.close()
+            raise
+
+        controller.add_status_listener(self._on_status)
+        controller.add_event_listener(self._on_circuit, EventType.CIRC)
+        controller.add_event_listener(self._on_stream, EventType.STREAM)
+        controller.add_event_listener(self._on_notice, EventType.NOTICE)
+        controller.add_event_listener(self._on_status_client, EventType.STATUS_CLIENT)
+        return controller
+
+    def _on_circuit(self, event):
+        """Record every general-purpose exit circuit tor finishes building"""
+        if event.status in (CircStatus.CLOSED, CircStatus.FAILED):
+            with self._circuit_cond:
+                self._built_circuits.pop(event.id, None)
+            return
+        if event.status != CircStatus.BUILT or event.purpose != CircPurpose.GENERAL:
+            return
+        if CircBuildFlag.IS_INTERNAL in event.build_flags or CircBuildFlag.ONEHOP_TUNNEL in event.build_flags:
+            return
+
+        with self._circuit_cond:
+            self._last_built_at = time.monotonic()
+            self._last_built_id = event.id
+            self._built_circuits[event.id] = self._last_built_at
+            self._circuit_cond.notify_all()
+
+    def _on_stream(self, event):
+        if event.status == StreamStatus.SUCCEEDED and event.circ_id:
+            self.last_stream_circuit = event.circ_id
+
+    def _on_notice(self, event):
+        """Track tor's own NEWNYM rate limiting (\"delaying by N second(s)\")"""
+        match = re.search(r'Rate limiting NEWNYM request: delaying by (\d+) second', event.message)
+        if match:
+            with self._circuit_cond:
+                self._newnym_ready_at = max(self._newnym_ready_at, time.monotonic() + int(match.group(1)))
+                self._circuit_cond.notify_all()
+
+    def _on_status_client(self, event):
+        """Follow bootstrap progress and circuit establishment as tor reports them"""
+        with self._status_cond:
+            if event.action == 'BOOTSTRAP':
+                self.bootstrap.update(progress=int(event.arguments.get('PROGRESS', 0)),
+                                      tag=event.arguments.get('TAG'), summary=event.arguments.get('SUMMARY'))
+            elif event.action == 'CIRCUIT_ESTABLISHED':
+                self.bootstrap['circuit_established'] = True
+            elif event.action == 'CIRCUIT_NOT_ESTABLISHED':
+                self.bootstrap['circuit_established'] = False
+            else:
+                return
+            self._status_cond.notify_all()
+
+    def _on_status(self, controller, state, timestamp):
+        """Re-establish the connection as soon as tor closes it"""
+        if state == State.CLOSED:
+            with self._status_cond:
+                # Whatever tor comes back (if any) bootstraps from scratch
+                self.bootstrap.update(progress=0, tag=None, summary=None, circuit_established=False)
+        if state == State.CLOSED and not self._closing:
+            self._reconnect_with_backoff()  # Status listeners already run in their own thread
+
+    def _reconnect_with_backoff(self):
+        for delay in TOR_RECONNECT_DELAYS:
+            if self._closing:
+                return
+            time.sleep(delay)
+            with self._lock:
+                if self._closing:
+                    return
+                try:
+                    self.reconnect()
+                    return
+                except Exception:
+                    continue
+
+    def reconnect(self):
+        """Reconnect the existing controller, keeping its listeners"""
+        with self._lock:
+            if self._controller is None:
+                self._controller = self._open()
+            elif not self._controller.is_alive():
+                self._controller.reconnect(password=self.password)
+            return self._controller
+
+    def get(self):
+        """Return a live, authenticated controller"""
+        with self._lock:
+            self._closing = False
+            if self._controller is None or not self._controller.is_alive():
+                return self.reconnect()
+            return self._controller
+
+    def call(self, func, *args, **kwargs):
+        """Run func(controller, ...) retrying once over a fresh connection"""
+        try:
+            return func(self.get(), *args, **kwargs)
+        except (stem.SocketClosed, stem.SocketError):
+            return func(self.reconnect(), *args, **kwargs)
+
+    def signal(self, sig):
+        """Send a signal in a single control round trip"""
+        return self.call(lambda controller: controller.signal(sig))
+
+    def newnym(self):
+        """Request a new identity, remembering when tor will honour it"""
+        controller = self.get()
+        with self._circuit_cond:
+            self._newnym_sent_at = time.monotonic()
+            # stem knows when it last sent NEWNYM; tor may still delay it further
+            self._newnym_ready_at = self._newnym_sent_at + controller.get_newnym_wait()
+        self.signal(Signal.NEWNYM)
+
+    def wait_for_new_circuit(self, timeout=NEWNYM_WAIT_TIMEOUT):
+        """Block until a circuit built after the last NEWNYM took effect
+
+        Returns the circuit id, or None if none was built within timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self._circuit_cond:
+            while True:
+                if self._last_built_at > max(self._newnym_sent_at, self._newnym_ready_at):
+                    return self._last_built_id
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._circuit_cond.wait(remaining)
+
+    def bootstrap_status(self):
+        """Query status/bootstrap-phase and status/circuit-established"""
+        info = self.call(lambda controller: controller.get_info(['status/bootstrap-phase', 'status/circuit-established']))
+        phase = info.get('status/bootstrap-phase', '')
+        progress = re.search(r'PROGRESS=(\d+)', phase)
+        tag = re.search(r'TAG=(\S+)', phase)
+        summary = re.search(r'SUMMARY="([^"]*)"', phase)
+        with self._status_cond:
+            self.bootstrap.update(progress=int(progress.group(1)) if progress else 0,
+                                  tag=tag.group(1) if tag else None,
+                                  summary=summary.group(1) if summary else None,
+                                  circuit_established=info.get('status/circuit-established') == '1')
+            return dict(self.bootstrap)
+
+    def wait_until_ready(self, timeout=None, on_progress=None, abort=None):
+        """Block until tor has bootstrapped to 100% and established a circuit
+
+        Connects as soon as the control port is up, then wakes on bootstrap
+        events, re-checking every TOR_READY_POLL_INTERVAL in case one is
+        missed. on_progress(status) is called whenever the status changes;
+        abort() can end the wait early. Returns False at the deadline.
+        """
+        deadline = time.monotonic() + (TOR_READY_TIMEOUT if timeout is None else timeout)
+        last = None
+        while True:
+            try:
+                status = self.bootstrap_status()
+            except (stem.SocketError, stem.SocketClosed):
+                status = None  # tor not listening yet, or restarting
+            except Exception:
+                with self._status_cond:
+                    status = dict(self.bootstrap)  # Connected but the query failed: go by events
+            if status is not None:
+                if on_progress and status != last:
+                    on_progress(status)
+                last = status
+                if status['progress'] >= 100 and status['circuit_established']:
+                    return True
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (abort and abort()):
+                return False
+            with self._status_cond:
+                self._status_cond.wait(min(remaining, TOR_READY_POLL_INTERVAL))
+
+    def current_circuit(self):
+        """Return the general-purpose circuit new streams are using
+
+        Prefers the circuit of the last successful stream when it was built
+        after the latest NEWNYM, then the most recently built exit circuit.
+        """
+        circuits = {}
+        for circ in self.call(lambda controller: controller.get_circuits()):
+            if circ.status != CircStatus.BUILT or circ.purpose != CircPurpose.GENERAL or not circ.path:
+                continue
+            if CircBuildFlag.IS_INTERNAL in circ.build_flags or CircBuildFlag.ONEHOP_TUNNEL in circ.build_flags:
+                continue
+            circuits[circ.id] = circ
+        if not circuits:
+            return None
+
+        with self._circuit_cond:
+            newnym_at = max(self._newnym_sent_at, self._newnym_ready_at)
+            built = {cid: at for cid, at in self._built_circuits.items() if cid in circuits}
+        stream_circ = self.last_stream_circuit
+        if stream_circ in built and built[stream_circ] > newnym_at:
+            return circuits[stream_circ]
+        if built:
+            return circuits[max(built, key=built.get)]
+        # Circuits built before we connected: fall back to tor's creation time
+        return max(circuits.values(), key=lambda circ: (circ.created or datetime.min, int(circ.id)))
+
+    def get_exit(self):
+        """Describe the exit relay of the current circuit, or None"""
+        circ = self.current_circuit()
+        if circ is None:
+            return None
+
+        fingerprint, nickname = circ.path[-1]
+        status = self.call(lambda controller: controller.get_network_status(fingerprint, None))
+        if status is None:
+            return None
+        return {
+            'circuit_id': circ.id,
+            'fingerprint': fingerprint,
+            'nickname': nickname,
+            'address': status.address,
+            'country_code': self.get_country_code(status.address)
+        }
+
+    def get_country_code(self, ip):
+        """Ask tor's own geoip database for the country of an address"""
+        code = self.call(lambda controller: controller.get_info(f'ip-to-country/{ip}', None))
+        if not code or code == '??':
+            return None
+        return code.upper()
+
+    def close_current_circuit(self):
+        """Close the circuit new streams are using, so tor moves them to another"""
+        circ = self.current_circuit()
+        if circ is None:
+            return False
+        self.call(lambda controller: controller.close_circuit(circ.id))
+        with self._circuit_cond:
+            self._built_circuits.pop(circ.id, None)
+            if self.last_stream_circuit == circ.id:
+                self.last_stream_circuit = None
+        return True
+
+    def matches(self, port, socket_path, password):
+        return (self.port, self.socket_path, self.password) == (port, socket_path, password)
+
+    def close(self):
+        # Flag first: a reconnect in progress holds the lock, and closing the
+        # controller joins the status listener thread that runs it
+        self._closing = True
+        with self._lock:
+            controller, self._controller = self._controller, None
+        if controller is not None:
+            try:
+                controller.close()
+            except Exception:
+                pass
+
+_tor_control = None
+_tor_control_lock = threading.Lock()
+
+def get_tor_control():
+    """Return the shared Tor control session for the configured endpoint"""
+    global _tor_control
+
+    pool = _tor_pool
+    if pool is not None and pool.active is not None:
+        return pool.active.control
+
+    with _tor_control_lock:
+        if _tor_control is None or not _tor_control.matches(TOR_CONTROL_PORT, TOR_CONTROL_SOCKET, TOR_CONTROL_PASSWORD):
+            if _tor_control is not None:
+                _tor_control.close()
+            _tor_control = TorControlSession(
+                port=TOR_CONTROL_PORT,
+                socket_path=TOR_CONTROL_SOCKET,
+                password=TOR_CONTROL_PASSWORD
+            )
+        return _tor_control
+
+def close_tor_control():
+    """Close the shared Tor control session"""
+    global _tor_control
+
+    with _tor_control_lock:
+        if _tor_control is not None:
+            _tor_control.close()
+            _tor_control = None
+
+atexit.register(close_tor_control)
+
+def wait_for_new_circuit(timeout=NEWNYM_WAIT_TIMEOUT):
+    """Wait until tor reports a freshly BUILT circuit after NEWNYM"""
+    try:
+        with metrics.phase('circuit_wait') as timing:
+            circuit = get_tor_control().wait_for_new_circuit(timeout)
+            if circuit is None:
+                timing.fail()
+        return circuit
+    except Exception as e:
+        print(f"{RED}[!] Error waiting for new circuit: {str(e)}{RESET}")
+        return None
+
+class TorInstance:
+    """One tor process supervised by the pool, with its own DataDirectory and ports"""
+
+    def __init__(self, index, socks_port, control_port, data_dir):
+        self.index = index
+        self.socks_port = socks_port
+        self.control_port = control_port
+        self.data_dir = data_dir
+        self.proxy = f"socks5h://127.0.0.1:{socks_port}"
+        self.control = TorControlSession(port=control_port)
+        self.process = None
+        self.state = 'stopped'  # 'starting', 'refreshing', 'ready', 'active', 'failed' or 'stopped'
+        self.exit_ip = None
+        self.exit_country_code = None
+        self.exit_nodes = None  # ExitNodes pinned by target_exit_country, lifted on the next refresh
+        self.ready_at = 0.0
+
+    def _write_torrc(self):
+        torrc = os.path.join(self.data_dir, 'torrc')
+        with open(torrc, 'w') as f:
+            f.write(f"SocksPort {self.socks_port}\n")
+            f.write(f"ControlPort {self.control_port}\n")
+            f.write(f"DataDirectory {os.path.abspath(self.data_dir)}\n")
+            f.write("CookieAuthentication 1\n")
+            f.write("AvoidDiskWrites 1\n")
+            f.write(f"Log notice file {os.path.abspath(os.path.join(self.data_dir, 'notice.log'))}\n")
+            # tor exits on its own if we die without stopping it
+            f.write(f"__OwningControllerProcess {os.getpid()}\n")
+        return torrc
+
+    def start(self):
+        """Launch the tor process; its state stays 'starting' until refresh() succeeds"""
+        os.makedirs(self.data_dir, mode=0o700, exist_ok=True)
+        os.chmod(self.data_dir, 0o700)  # tor refuses group/world readable data directories
+        torrc = self._write_torrc()
+        self.control.close()
+        self.state = 'starting'
+        self.exit_ip = self.exit_country_code = self.exit_nodes = None
+        # Own session, so Ctrl+C in the terminal doesn't take the pool down with the loop
+        self.process = subprocess.Popen([TOR_BINARY, '-f', torrc], stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.DEVNULL, start_new_session=True)
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def wait_until_bootstrapped(self, timeout=TOR_POOL_START_TIMEOUT):
+        """Block until the control port answers and tor has established a circuit"""
+        return self.control.wait_until_ready(timeout, abort=lambda: not self.alive())
+
+    def refresh(self, exit_nodes=None):
+        """Build a fresh circuit and record the exit it uses
+
+        exit_nodes pins the circuit to those relays; without it an earlier
+        pin is lifted. Returns True once the instance is a verified standby.
+        """
+        if exit_nodes:
+            self.control.call(lambda controller: controller.set_conf('ExitNodes', exit_nodes))
+        elif self.exit_nodes:
+            self.control.call(lambda controller: controller.reset_conf('ExitNodes'))
+        self.exit_nodes = exit_nodes
+        self.control.newnym()
+        if self.control.wait_for_new_circuit() is None:
+            return False
+
+        ip, code = None, None
+        exit_relay = self.control.get_exit()
+        if exit_relay:
+            ip, code = exit_relay['address'], exit_relay['country_code']
+
+        if TOR_POOL_VERIFY == 'http':
+            # Also primes the circuit, so the first stream after a switch doesn't wait for it
+            session = requests.Session()
+            session.proxies = {"http": self.proxy, "https": self.proxy}
+            try:
+                checked_ip = get_ip(session)
+            finally:
+                session.close()
+            if not checked_ip:
+                return False
+            if checked_ip != ip:
+                ip, code = checked_ip, self.control.get_country_code(checked_ip)
+
+        if not ip:
+            return False
+        self.exit_ip, self.exit_country_code = ip, code
+        self.ready_at = time.monotonic()
+        return True
+
+    def stop(self):
+        self.state = 'stopped'
+        self.control.close()
+        if self.alive():
+            self.process.terminate()
+            try:
+                self.process.wait(5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+def _port_in_use(port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        return sock.connect_ex(('127.0.0.1', port)) == 0
+
+class TorPool:
+    """Several tor instances kept warm so an identity change is an instant switch
+
+    One instance is active: TOR_SOCKS_PROXY and the shared control session
+    point at it. The others are standbys with a pre-built circuit whose exit
+    has already been verified. Rotating makes the freshest standby active
+    and sends the retired instance off to build a new circuit in the
+    background, so the loop never waits for tor. A supervisor thread
+    restarts instances whose tor process died and refreshes standbys that
+    sat unused for longer than TOR_POOL_MAX_STANDBY_AGE.
+    """
+
+    def __init__(self, size, socks_port, control_port, directory=None):
+        self.directory = directory or TOR_POOL_DIR
+        self.instances = []
+        self.active = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="tor-pool")
+        self._supervisor = None
+        self.base_settings = None  # Endpoint settings from before the pool took over, restored on stop
+
+        # Ports follow the detected ones, shifted past anything already listening
+        offset = TOR_POOL_PORT_OFFSET
+        for index in range(size):
+            while _port_in_use(socks_port + offset) or _port_in_use(control_port + offset):
+                offset += 2
+            data_dir = os.path.join(self.directory, f"tor{index}")
+            self.instances.append(TorInstance(index, socks_port + offset, control_port + offset, data_dir))
+            offset += 2
+
+    def start(self, timeout=TOR_POOL_START_TIMEOUT):
+        """Launch every instance; returns once the first one is ready to be active"""
+        self.base_settings = (TOR_SOCKS_PROXY, TOR_CONTROL_PORT, TOR_CONTROL_SOCKET, TOR_CONTROL_PASSWORD)
+        for instance in self.instances:
+            instance.start()
+        futures = [self._executor.submit(self._prepare, instance) for instance in self.instances]
+
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                if future.result() and self.active is not None:
+                    break
+        except FuturesTimeoutError:
+            pass
+
+        self._supervisor = threading.Thread(target=self._supervise, name="tor-pool-supervisor", daemon=True)
+        self._supervisor.start()
+        return self.active is not None
+
+    def _prepare(self, instance):
+        """Bring a freshly started instance up to a verified standby (or active)"""
+        try:
+            ok = instance.wait_until_bootstrapped() and instance.refresh()
+        except Exception:
+            ok = False
+
+        with self._lock:
+            if self._stopping.is_set():
+                return False
+            if not ok:
+                instance.state = 'failed'
+                return False
+            instance.state = 'ready'
+            if self.active is None:
+                self._activate(instance)
+        return True
+
+    def _refresh(self, instance):
+        try:
+            ok = instance.refresh()
+        except Exception:
+            ok = False
+
+        with self._lock:
+            if instance.state == 'refreshing':
+                instance.state = 'ready' if ok else 'failed'
+
+    def _activate(self, instance):
+        global TOR_SOCKS_PROXY, TOR_CONTROL_PORT, TOR_CONTROL_SOCKET, TOR_CONTROL_PASSWORD
+
+        instance.state = 'active'
+        self.active = instance
+        TOR_SOCKS_PROXY = instance.proxy
+        TOR_CONTROL_PORT = instance.control_port
+        TOR_CONTROL_SOCKET = None
+        TOR_CONTROL_PASSWORD = None  # Pool instances use cookie authentication
+
+    def switch(self):
+        """Make the freshest standby active and refresh the retired instance
+
+        Returns False when no standby is ready; the active instance then
+        keeps serving and its recorded exit is invalidated, since the
+        caller will fall back to NEWNYM on it.
+        """
+        with self._lock:
+            standbys = [instance for instance in self.instances if instance.state == 'ready']
+            if not standbys:
+                if self.active is not None:
+                    self.active.exit_ip = self.active.exit_country_code = None
+                return False
+
+            retired = self.active
+            self._activate(max(standbys, key=lambda instance: instance.ready_at))
+            if retired is not None and retired.state == 'active':
+                retired.state = 'refreshing'
+                self._executor.submit(self._refresh, retired)
+        return True
+
+    def switch_to_exits(self, exit_nodes):
+        """Pin the freshest standby to exit_nodes, then make it active
+
+        Blocks while the standby builds a circuit through them. Returns
+        False when no standby is ready or it could not build one; the
+        active instance is left as it was.
+        """
+        with self._lock:
+            standbys = [instance for instance in self.instances if instance.state == 'ready']
+            if not standbys:
+                return False
+            instance = max(standbys, key=lambda instance: instance.ready_at)
+            instance.state = 'refreshing'  # Claimed, so neither switch() nor the supervisor takes it
+
+        try:
+            ok = instance.refresh(exit_nodes)
+        except Exception:
+            ok = False
+
+        with self._lock:
+            if instance.state != 'refreshing':
+                return False  # Stopped meanwhile
+            if not ok:
+                instance.state = 'failed'
+                return False
+            retired = self.active
+            self._activate(instance)
+            if retired is not None and retired.state == 'active':
+                retired.state = 'refreshing'
+                self._executor.submit(self._refresh, retired)
+        return True
+
+    def identity(self):
+        """Return the verified (exit IP, country code) of the active instance, or None"""
+        instance = self.active
+        if instance is None or not instance.exit_ip:
+            return None
+        return instance.exit_ip, instance.exit_country_code
+
+    def status(self):
+        """Count instances per state"""
+        counts = {}
+        with self._lock:
+            for instance in self.instances:
+                counts[instance.state] = counts.get(instance.state, 0) + 1
+        return counts
+
+    def _supervise(self):
+        while not self._stopping.wait(TOR_POOL_CHECK_INTERVAL):
+            now = time.monotonic()
+            dead = []
+            with self._lock:
+                for instance in self.instances:
+                    if instance.state in ('starting', 'refreshing', 'stopped'):
+                        continue
+                    if instance.state == 'failed' and instance.alive():
+                        # tor is fine, only the circuit build failed: retry it
+                        instance.state = 'refreshing'
+                        self._executor.submit(self._refresh, instance)
+                    elif not instance.alive():
+                        if instance is self.active:
+                            self.active = None
+                            standbys = [other for other in self.instances if other.state == 'ready']
+                            if standbys:
+                                self._activate(max(standbys, key=lambda other: other.ready_at))
+                        instance.state = 'starting'  # Claimed, so the next check leaves it alone
+                        dead.append(instance)
+                    elif instance.state == 'ready' and now - instance.ready_at > TOR_POOL_MAX_STANDBY_AGE:
+                        instance.state = 'refreshing'
+                        self._executor.submit(self._refresh, instance)
+
+            # Launching tor takes a while; switching and get_tor_control() must not wait on it
+            for instance in dead:
+                try:
+                    instance.start()
+                except Exception:
+                    instance.state = 'failed'
+                    continue
+                with self._lock:
+                    if self._stopping.is_set():
+                        # stop() already went through the instances, so this one is ours to stop
+                        instance.stop()
+                        return
+                    self._executor.submit(self._prepare, instance)
+
+    def stop(self):
+        """Stop every instance and point the tool back at the configured tor"""
+        global TOR_SOCKS_PROXY, TOR_CONTROL_PORT, TOR_CONTROL_SOCKET, TOR_CONTROL_PASSWORD
+
+        self._stopping.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            for instance in self.instances:
+                instance.stop()
+            self.active = None
+        if self.base_settings:
+            TOR_SOCKS_PROXY, TOR_CONTROL_PORT, TOR_CONTROL_SOCKET, TOR_CONTROL_PASSWORD = self.base_settings
+
+_tor_pool = None
+
+def start_tor_pool(size=None):
+    """Launch the tor instance pool on ports derived from the configured ones"""
+    global _tor_pool
+
+    size = size or TOR_POOL_SIZE
+    if TOR_BINARY is None or not shutil.which(TOR_BINARY):
+        print(f"{RED}[!] tor binary not found, the instance pool needs it{RESET}")
+        return False
+
+    socks_port = int(TOR_SOCKS_PROXY.rsplit(':', 1)[1])
+    print(f"\n{YELLOW}[*] Starting a pool of {BLUE}{size}{YELLOW} Tor instances...{RESET}")
+    pool = TorPool(size, socks_port, TOR_CONTROL_PORT)
+    if not pool.start():
+        print(f"{RED}[!] No Tor instance bootstrapped within {TOR_POOL_START_TIMEOUT} seconds{RESET}")
+        pool.stop()
+        return False
+
+    _tor_pool = pool
+    print(f"{GREEN}[✓] Tor pool ready, active SOCKS proxy: {BLUE}{TOR_SOCKS_PROXY}{RESET}")
+    return True
+
+def stop_tor_pool():
+    """Stop the tor instance pool, if one is running"""
+    global _tor_pool
+
+    if _tor_pool is not None:
+        _tor_pool.stop()
+        _tor_pool = None
+
+atexit.register(stop_tor_pool)
+
+def format_tor_status():
+    """Describe tor's readiness for the menu, from the last known bootstrap state"""
+    try:
+        status = get_tor_control().bootstrap_status()
+    except Exception:
+        return f"{RED}Not reachable"
+    if status['progress'] >= 100 and status['circuit_established']:
+        return f"{BLUE}Ready"
+    return f"{YELLOW}Bootstrapping {BLUE}{status['progress']}%{YELLOW} ({status['summary'] or status['tag']})"
+
+def wait_for_tor_ready(timeout=None):
+    """Block until tor has bootstrapped, showing progress; returns readiness"""
+    timeout = TOR_READY_TIMEOUT if timeout is None else timeout
+    started = time.monotonic()
+    shown = []
+
+    def show(status):
+        if status['progress'] < 100 or shown:
+            print(f"\r{YELLOW}[*] Bootstrapping Tor: {BLUE}{status['progress']:3d}%{YELLOW} "
+                  f"({status['summary'] or status['tag']}){RESET}\033[K", end="", flush=True)
+            shown.append(status)
+
+    tor_control = get_tor_control()
+    try:
+        ready = tor_control.wait_until_ready(timeout, show)
+    except Exception:
+        ready = False
+    if shown:
+        print()
+
+    elapsed = time.monotonic() - started
+    status = dict(tor_control.bootstrap)
+    if ready:
+        if shown:
+            print(f"{GREEN}[✓] Tor is ready after {BLUE}{elapsed:.1f}{GREEN} seconds{RESET}")
+    else:
+        print(f"{RED}[!] Tor not ready after {timeout} seconds "
+              f"(bootstrap {status['progress']}%: {status['summary'] or status['tag'] or 'no control connection'}){RESET}")
+    log_tor_status(ready, status, elapsed)
+    return ready
+
+def change_tor_ip():
+    """Send NEWNYM signal to Tor to get new IP"""
+    try:
+        # With a pool, switch to a standby whose circuit is already built
+        if _tor_pool is not None:
+            with metrics.phase('pool_switch') as timing:
+                switched = _tor_pool.switch()
+                if not switched:
+                    timing.fail()
+            if switched:
+                reset_tor_session()
+                return True
+        with metrics.phase('newnym'):
+            get_tor_control().newnym()
+        reset_tor_session()
+        return True
+    except Exception as e:
+        # The control session already tried to reconnect and will again on the
+        # next call; restarting tor is left to its service manager (or, with a
+        # pool, to the supervisor, which restarts dead instances)
+        print(f"{RED}[!] Error changing Tor IP: {str(e)}{RESET}")
+        return False
+
+def resolve_exit_ip():
+    """Resolve the current exit IP, plus its country code when Tor knows it"""
+    if _tor_pool is not None:
+        # Standbys are verified before they go active
+        identity = _tor_pool.identity()
+        if identity:
+            return identity
+
+    if IP_RESOLVE_MODE == 'controller':
+        try:
+            tor_control = get_tor_control()
+            with metrics.phase('exit_lookup'):
+                exit_relay = tor_control.get_exit()
+        except Exception as e:
+            print(f"{RED}[!] Could not read exit relay from Tor: {str(e)}{RESET}")
+            exit_relay = None
+
+        if exit_relay:
+            ip, code = exit_relay['address'], exit_relay['country_code']
+            if IP_RESOLVE_VERIFY:
+                # Multi-homed exits can leave from a different address than their ORPort
+                checked_ip = get_ip()
+                if checked_ip and checked_ip != ip:
+                    ip = checked_ip
+                    try:
+                        code = tor_control.get_country_code(ip)
+                    except Exception:
+                        code = None
+            return ip, code
+
+        print(f"{YELLOW}[!] Falling back to HTTP IP check{RESET}")
+
+    return get_ip(), None
+
+def locate_identity(ip, country_code=None):
+    """Get country and city for an exit IP, preferring Tor's own country"""
+    if not country_code:
+        return get_location_for_ip(ip)
+
+    location = get_geoip_index().lookup(ip) if GEO_BACKEND != 'remote' else None
+    country = COUNTRY_NAMES.get(country_code, country_code)
+    city = location[1] if location and location[1] and location[0] == country else "Not Defined"
+    track_country(country, city)
+    return country, city
+
+def get_identity():
+    """Resolve the current exit IP, country and city"""
+    ip, country_code = resolve_exit_ip()
+    country, city = locate_identity(ip, country_code)
+    return ip, country, city
+
+def probe_circuit(session=None, url=None):
+    """Measure time-to-first-byte and throughput of a small download over the current circuit
+
+    Returns {'ttfb', 'throughput', 'bytes'} (seconds, bytes per second,
+    bytes read) or None if the probe target could not be fetched or none
+    is configured.
+    """
+    url = url or PROBE_URL
+    if not url:
+        return None
+    session = session or get_tor_session()
+    start = time.monotonic()
+    try:
+        with session.get(url, stream=True, timeout=PROBE_TIMEOUT,
+                         headers={"Cache-Control": "no-cache"}) as r:
+            r.raise_for_status()
+            first_byte_at = None
+            first_chunk = received = 0
+            for chunk in r.iter_content(16384):
+                if first_byte_at is None:
+                    first_byte_at = time.monotonic()
+                    first_chunk = len(chunk)
+                received += len(chunk)
+                if received >= PROBE_BYTES or time.monotonic() - start > PROBE_TIMEOUT:
+                    break
+    except Exception:
+        return None
+    if first_byte_at is None:
+        return None
+
+    end = time.monotonic()
+    # Throughput over the transfer itself, so a slow first byte isn't counted twice
+    if received > first_chunk and end > first_byte_at:
+        throughput = (received - first_chunk) / (end - first_byte_at)
+    else:
+        throughput = received / max(end - start, 1e-6)
+    return {'ttfb': round(first_byte_at - start, 3), 'throughput': int(throughput), 'bytes': received}
+
+def probe_passed(probe):
+    """Check a probe result against PROBE_MAX_TTFB and PROBE_MIN_THROUGHPUT"""
+    if probe is None:
+        return False
+    if PROBE_MAX_TTFB and probe['ttfb'] > PROBE_MAX_TTFB:
+        return False
+    if PROBE_MIN_THROUGHPUT and probe['throughput'] < PROBE_MIN_THROUGHPUT:
+        return False
+    return True
+
+def format_probe(probe):
+    if probe is None:
+        return "probe failed"
+    return f"TTFB {probe['ttfb']:.2f} s — {probe['throughput'] / 1024:.0f} KB/s"
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing: k positions from the two halves of one digest
+        h1, h2 = struct.unpack('<QQ', hashlib.blake2b(key.encode(), digest_size=16).digest())
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class SeenExitIndex:
+    """Bounded memory of recent exit IPs and countries
+
+    The 'lru' backend keeps the last EXIT_HISTORY_SIZE exits exactly. The
+    'bloom' backend fits week-long runs in a few kilobytes: two Bloom
+    filters take turns, the older one being dropped every
+    EXIT_HISTORY_TTL / 2, so exits age out of it.
+    """
+
+    def __init__(self, backend=None, size=None, ttl=None, recent_countries=None):
+        self.backend = backend or EXIT_HISTORY_BACKEND
+        self.size = size or EXIT_HISTORY_SIZE
+        self.ttl = EXIT_HISTORY_TTL if ttl is None else ttl
+        self.countries = deque(maxlen=EXIT_AVOID_RECENT_COUNTRIES if recent_countries is None else recent_countries)
+        self._lock = threading.Lock()
+        self._exits = OrderedDict()  # ip -> last seen, for the 'lru' backend
+        self._current = self._previous = None
+        self._generation_started = time.monotonic()
+        if self.backend == 'bloom':
+            self._current = BloomFilter(self.size)
+            self._previous = BloomFilter(self.size)
+
+        # Outcome counters for the repeat rate
+        self.rotations = 0
+        self.repeats = 0
+        self.avoided = 0
+
+    def _expire(self):
+        now = time.monotonic()
+        if self.backend == 'bloom':
+            if (self.ttl and now - self._generation_started > self.ttl / 2) or self._current.count >= self.size:
+                self._previous, self._current = self._current, BloomFilter(self.size)
+                self._generation_started = now
+        elif self.ttl:
+            while self._exits and now - next(iter(self._exits.values())) > self.ttl:
+                self._exits.popitem(last=False)
+
+    def is_repeat(self, ip, country_code=None):
+        """True if the exit IP, or its country among the recent ones, was seen before"""
+        if not ip:
+            return False
+        with self._lock:
+            self._expire()
+            if country_code and country_code in self.countries:
+                return True
+            if self.backend == 'bloom':
+                return ip in self._current or ip in self._previous
+            return ip in self._exits
+
+    def add(self, ip, country_code=None):
+        if not ip:
+            return
+        with self._lock:
+            self._expire()
+            if country_code:
+                self.countries.append(country_code)
+            if self.backend == 'bloom':
+                self._current.add(ip)
+                return
+            self._exits[ip] = time.monotonic()
+            self._exits.move_to_end(ip)
+            while len(self._exits) > self.size:
+                self._exits.popitem(last=False)
+
+    def record(self, ip, country_code, repeated, avoided):
+        """Count the outcome of one rotation and remember its exit"""
+        with self._lock:
+            self.rotations += 1
+            self.repeats += bool(repeated)
+            self.avoided += avoided
+        self.add(ip, country_code)
+
+    def repeat_rate(self):
+        with self._lock:
+            return self.repeats / self.rotations if self.rotations else 0.0
+
+exit_index = SeenExitIndex()
+
+def exit_country_code(ip, country_code=None):
+    """Country code of an exit for the seen-exit index
+
+    Only the 'controller' resolver reports one, so when recent countries
+    are avoided the others are looked up: tor's geoip first, then the
+    geolocation backend.
+    """
+    if country_code or not ip or not EXIT_AVOID_RECENT_COUNTRIES:
+        return country_code
+    try:
+        code = get_tor_control().get_country_code(ip)
+        if code:
+            return code
+    except Exception:
+        pass
+    country, _ = get_location_for_ip(ip, track=False)
+    return next((code for code, name in COUNTRY_NAMES.items() if name == country), None)
+
+def reroll_circuit():
+    """Move to a different exit without waiting out NEWNYM's rate limit
+
+    Closing the circuit in use makes tor put new streams on another one;
+    with a pool, switching to the next standby is quicker still.
+    """
+    if _tor_pool is None:
+        try:
+            if get_tor_control().close_current_circuit():
+                reset_tor_session()
+                return True
+        except Exception:
+            pass
+
+    if change_tor_ip():
+        if wait_for_new_circuit() is None:
+            print(f"{YELLOW}[!] No new circuit reported within {NEWNYM_WAIT_TIMEOUT} seconds{RESET}")
+        return True
+    return False
+
+class ConsensusExitIndex:
+    """Exit relays by country, built from the consensus tor is using
+
+    Countries come from tor's own geoip (GETINFO ip-to-country), so they
+    agree with what ExitNodes would select. A NEWCONSENSUS listener keeps
+    the index current; only relays that are new or changed address are
+    looked up again.
+    """
+
+    def __init__(self):
+        self._relays = {}  # fingerprint -> (address, country code)
+        self._by_country = {}
+        self._lock = threading.Lock()
+        self._control = None
+
+    def __len__(self):
+        return len(self._relays)
+
+    def _usable(self, entry):
+        if 'Exit' not in entry.flags or 'BadExit' in entry.flags:
+            return False
+        policy = getattr(entry, 'exit_policy', None)
+        return policy is None or policy.can_exit_to(port=443)
+
+    def _update(self, entries):
+        exits = {entry.fingerprint: entry.address for entry in entries if self._usable(entry)}
+        with self._lock:
+            known = dict(self._relays)
+
+        lookup = sorted({address for fingerprint, address in exits.items()
+                         if fingerprint not in known or known[fingerprint][0] != address})
+        codes = {}
+        for i in range(0, len(lookup), 500):
+            # One control round trip per 500 addresses
+            keys = [f'ip-to-country/{address}' for address in lookup[i:i + 500]]
+            replies = self._control.call(lambda controller: controller.get_info(keys, {}))
+            codes.update({key.split('/', 1)[1]: value for key, value in replies.items()})
+
+        relays, by_country = {}, {}
+        for fingerprint, address in exits.items():
+            if address in codes:
+                code = codes[address].upper() if codes[address] not in ('', '??') else None
+            else:
+                code = known[fingerprint][1]
+            relays[fingerprint] = (address, code)
+            if code:
+                by_country.setdefault(code, []).append((fingerprint, address))
+
+        with self._lock:
+            self._relays, self._by_country = relays, by_country
+        return len(lookup)
+
+    def _on_consensus(self, event):
+        if event.desc:
+            # Lookups go through the controller, so not on stem's event thread
+            threading.Thread(target=self._update, args=(event.desc,), daemon=True).start()
+
+    def refresh(self, control=None):
+        """Index the current consensus and follow future ones"""
+        control = control or get_tor_control()
+        if control is not self._control:
+            control.call(lambda controller: controller.add_event_listener(self._on_consensus, EventType.NEWCONSENSUS))
+            self._control = control
+        return self._update(control.call(lambda controller: list(controller.get_network_statuses())))
+
+    def countries(self):
+        """Return {country code: number of exits}"""
+        with self._lock:
+            return {code: len(exits) for code, exits in self._by_country.items()}
+
+    def exits(self, country_code):
+        with self._lock:
+            return list(self._by_country.get(country_code.upper(), []))
+
+class CountrySchedule:
+    """Decides which country each rotation should exit from
+
+    'round_robin' cycles through the listed countries, 'no_repeat' picks at
+    random (from the list, or from every country with exits) but never the
+    previous one twice in a row, and 'weighted' draws from {country: weight}.
+    Countries without exits in the consensus are skipped.
+    """
+
+    def __init__(self, mode, countries):
+        self.mode = mode
+        if isinstance(countries, dict):
+            self.weights = {code.upper(): float(weight) for code, weight in countries.items()}
+        else:
+            self.weights = {code.upper(): 1.0 for code in countries}
+        self.countries = list(self.weights)
+        self.last = None
+        self._position = 0
+
+    def next(self, index):
+        available = index.countries()
+        candidates = [code for code in self.countries if code in available]
+        if not candidates and self.mode == 'no_repeat' and not self.countries:
+            candidates = list(available)
+        if not candidates:
+            return None
+
+        if self.mode == 'round_robin':
+            while self.countries[self._position % len(self.countries)] not in available:
+                self._position += 1
+            choice = self.countries[self._position % len(self.countries)]
+            self._position += 1
+        elif self.mode == 'weighted':
+            choice = random.choices(candidates, weights=[self.weights[code] for code in candidates])[0]
+        else:
+            choice = random.choice([code for code in candidates if code != self.last] or candidates)
+
+        self.last = choice
+        return choice
+
+def parse_country_list(text):
+    """Parse 'de,nl,se' into a list or 'de:3,nl:1' into weights"""
+    items = [item.strip() for item in text.split(',') if item.strip()]
+    if any(':' in item for item in items):
+        return {code.strip(): float(weight or 1) for code, _, weight in (item.partition(':') for item in items)}
+    return items
+
+exit_country_index = ConsensusExitIndex()
+_exit_target_set = False  # ExitNodes pinned on a single tor, which keeps it until reset or restarted
+
+def target_exit_country(country_code):
+    """Point ExitNodes at the country's exits, skipping ones used recently, and NEWNYM
+
+    With a pool a standby is pinned to them and switched to instead, so the
+    active instance keeps serving while the circuit is built. Returns True
+    once a circuit through one of them has been built.
+    """
+    global _exit_target_set
+
+    exits = exit_country_index.exits(country_code)
+    fresh = [fingerprint for fingerprint, address in exits if not exit_index.is_repeat(address)]
+    fingerprints = fresh or [fingerprint for fingerprint, address in exits]
+    if not fingerprints:
+        return False
+    exit_nodes = ','.join(f'${fp}' for fp in fingerprints)
+
+    pool = _tor_pool
+    if pool is None:
+        _exit_target_set = True
+    else:
+        if pool.switch_to_exits(exit_nodes):
+            reset_tor_session()
+            return True
+        # No standby to spare: pin the active instance like a single tor
+        active = pool.active
+        if active is not None:
+            active.exit_nodes = exit_nodes
+            active.exit_ip = active.exit_country_code = None  # About to NEWNYM away from it
+
+    tor_control = get_tor_control()
+    tor_control.call(lambda controller: controller.set_conf('ExitNodes', exit_nodes))
+    tor_control.newnym()
+    reset_tor_session()
+    if tor_control.wait_for_new_circuit() is None:
+        print(f"{YELLOW}[!] No new circuit reported within {NEWNYM_WAIT_TIMEOUT} seconds{RESET}")
+    return True
+
+def clear_exit_target():
+    """Give exit selection back to tor, on every pool instance that was pinned
+
+    Also runs at exit, so a schedule cut short does not leave tor pinned.
+    """
+    global _exit_target_set
+
+    pool = _tor_pool
+    if pool is None:
+        if not _exit_target_set:
+            return
+        _exit_target_set = False
+        controls = [get_tor_control()]
+    else:
+        controls = [instance.control for instance in pool.instances if instance.exit_nodes]
+        for instance in pool.instances:
+            instance.exit_nodes = None
+    for tor_control in controls:
+        try:
+            tor_control.call(lambda controller: controller.reset_conf('ExitNodes'))
+        except Exception:
+            pass
+
+atexit.register(clear_exit_target)
+
+def start_country_schedule():
+    """Index exits by country and return the configured schedule, or None"""
+    if not COUNTRY_SCHEDULE_MODE:
+        return None
+    try:
+        exit_country_index.refresh()
+    except Exception as e:
+        print(f"{RED}[!] Could not index exits from the consensus: {str(e)}{RESET}")
+        return None
+
+    countries = exit_country_index.countries()
+    print(f"{GREEN}[+] Indexed {BLUE}{len(exit_country_index)}{GREEN} exits in {BLUE}{len(countries)}{GREEN} countries{RESET}")
+    missing = [code for code in COUNTRY_SCHEDULE if code.upper() not in countries]
+    if missing:
+        print(f"{YELLOW}[*] No exits in {', '.join(missing)}, skipping them{RESET}")
+    return CountrySchedule(COUNTRY_SCHEDULE_MODE, COUNTRY_SCHEDULE)
+
+def rotate_identity(target_country=None):
+    """Change identity and settle on a fresh, acceptable exit
+
+    With a target_country, ExitNodes is pointed at that country's exits
+    first so the new circuit lands there on the first try.
+
+    Returns (new_ip, new_country_code, probe, rerolls, repeated). Exits
+    already in the seen-exit index are re-rolled until an unseen one turns
+    up or EXIT_REPEAT_BUDGET seconds have passed. With probing enabled,
+    circuits that fail the quality thresholds are re-rolled up to
+    PROBE_MAX_RETRIES times. Either way the last exit is kept regardless.
+    """
+    started = time.monotonic()
+    rerolls = slow_rerolls = avoided = 0
+
+    targeted = False
+    if target_country:
+        try:
+            with metrics.phase('exit_target'):
+                targeted = target_exit_country(target_country)
+        except Exception as e:
+            print(f"{RED}[!] Could not target {target_country}: {str(e)}{RESET}")
+
+    # Change IP and continue as soon as tor has built a fresh circuit
+    if not targeted and change_tor_ip():
+        if wait_for_new_circuit() is None:
+            print(f"{YELLOW}[!] No new circuit reported within {NEWNYM_WAIT_TIMEOUT} seconds{RESET}")
+
+    while True:
+        new_ip, new_country_code = resolve_exit_ip()
+        index_code = exit_country_code(new_ip, new_country_code)
+        # A targeted country is meant to repeat, so only the exit itself counts then
+        repeated = EXIT_AVOID_REPEATS and exit_index.is_repeat(new_ip, None if targeted else index_code)
+        if repeated and time.monotonic() - started < EXIT_REPEAT_BUDGET:
+            print(f"{YELLOW}[*] Exit {BLUE}{new_ip}{YELLOW} was used recently, re-rolling...{RESET}")
+            avoided += 1
+        else:
+            probe = None
+            if PROBE_ENABLED:
+                with metrics.phase('probe') as timing:
+                    probe = probe_circuit()
+                    if not probe_passed(probe):
+                        timing.fail()
+            if not PROBE_ENABLED or probe_passed(probe) or slow_rerolls >= PROBE_MAX_RETRIES:
+                break
+            slow_rerolls += 1
+            print(f"{YELLOW}[*] Slow exit {BLUE}{new_ip}{YELLOW} ({format_probe(probe)}), "
+                  f"re-rolling ({slow_rerolls}/{PROBE_MAX_RETRIES})...{RESET}")
+
+        rerolls += 1
+        with metrics.phase('reroll'):
+            if targeted and _tor_pool is not None:
+                # A plain switch would land on a standby that is not pinned to the country
+                target_exit_country(target_country)
+            else:
+                reroll_circuit()
+
+    exit_index.record(new_ip, index_code, repeated, avoided)
+    return new_ip, new_country_code, probe, rerolls, bool(repeated)
+
+class IsolatedIdentity:
+    """One of several concurrent identities sharing a single tor
+
+    tor isolates streams by SOCKS credentials (IsolateSOCKSAuth is on by
+    default for every SocksPort), so each identity gets a random
+    username/password pair and therefore circuits of its own. Rotating an
+    identity only swaps its credentials: tor builds a new circuit for it
+    while the others keep theirs, with no NEWNYM involved.
+    """
+
+    def __init__(self, name, socks_proxy=None):
+        self.name = name
+        self.socks_proxy = socks_proxy or TOR_SOCKS_PROXY
+        self.session = None
+        self.ip = None
+        self.country = self.city = "Not Defined"
+        self.rotations = 0
+        self._lock = threading.Lock()
+        self._new_credentials()
+
+    def _new_credentials(self):
+        scheme, address = self.socks_proxy.split("://", 1)
+        self.username = f"{self.name}-{uuid.uuid4().hex[:16]}"
+        proxy = f"{scheme}://{self.username}:{uuid.uuid4().hex}@{address.rsplit('@', 1)[-1]}"
+
+        session = requests.Session()
+        session.proxies = {"http": proxy, "https": proxy}
+        adapter = requests.adapters.HTTPAdapter(pool_connections=len(IP_CHECK_ENDPOINTS), pool_maxsize=4)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        old_session, self.session = self.session, session
+        if old_session is not None:
+            old_session.close()  # Its connections are pinned to the old circuit
+
+    def resolve(self):
+        """Look up this identity's exit IP and location through its own session"""
+        with self._lock:
+            self.ip = get_ip(self.session)
+            if self.ip:
+                self.country, self.city = locate_identity(self.ip)
+            else:
+                self.country, self.city = "Not Defined", "Not Defined"
+            return self.ip, self.country, self.city
+
+    def rotate(self):
+        """Switch to fresh credentials, and with them a fresh circuit"""
+        with self._lock:
+            self._new_credentials()
+            self.rotations += 1
+        return self.resolve()
+
+    def close(self):
+        with self._lock:
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+
+class IsolatedIdentities:
+    """K concurrent identities over one tor, each with its own session and exit"""
+
+    def __init__(self, count, socks_proxy=None):
+        self.identities = [IsolatedIdentity(f"id{i + 1}", socks_proxy) for i in range(count)]
+        self._executor = ThreadPoolExecutor(max_workers=max(1, count), thread_name_prefix="identity")
+
+    def __len__(self):
+        return len(self.identities)
+
+    def __getitem__(self, index):
+        return self.identities[index]
+
+    def __iter__(self):
+        return iter(self.identities)
+
+    def _each(self, method, identities=None):
+        identities = list(identities or self.identities)
+        futures = {self._executor.submit(getattr(identity, method)): identity for identity in identities}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"{RED}[!] {futures[future].name}: {str(e)}{RESET}")
+        return identities
+
+    def resolve_all(self):
+        """Resolve every identity's exit concurrently"""
+        return self._each('resolve')
+
+    def rotate(self, index):
+        """Rotate a single identity, leaving the others untouched"""
+        return self.identities[index].rotate()
+
+    def rotate_all(self):
+        """Rotate every identity concurrently"""
+        return self._each('rotate')
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        for identity in self.identities:
+            identity.close()
+
+def print_identities(identities):
+    """Print one line per isolated identity"""
+    for identity in identities:
+        print(f"{GREEN}[+]{RESET} {identity.name}: {BLUE}{identity.ip or 'Not Defined'}{RESET}"
+              f" — Country: {BLUE}{identity.country}{RESET} — City: {BLUE}{identity.city}{RESET}")
+    ips = [identity.ip for identity in identities if identity.ip]
+    if len(set(ips)) < len(ips):
+        print(f"{YELLOW}[*] Some identities share an exit relay{RESET}")
+
+def run_identities(count, interval=None):
+    """Identities subcommand: hold count isolated identities, optionally rotating them"""
+    if count < 1:
+        print(f"{RED}[!] At least one identity is needed{RESET}")
+        return 1
+
+    identities = IsolatedIdentities(count)
+    try:
+        print(f"{YELLOW}[*] Resolving {BLUE}{count}{YELLOW} isolated identities via {BLUE}{TOR_SOCKS_PROXY}{RESET}")
+        identities.resolve_all()
+        print_identities(identities)
+        while interval:
+            print(f"\n{YELLOW}[*] Next change in {interval} seconds (Ctrl+C to stop){RESET}")
+            time.sleep(interval)
+            identities.rotate_all()
+            print()
+            print_identities(identities)
+    except KeyboardInterrupt:
+        print(f"\n{RED}[!] Stopping identities...{RESET}")
+    finally:
+        identities.close()
+    return 0
+
+class TorConfig:
+    """Where an IdentityRotator reaches tor; unset values follow the module configuration
+
+    With isolate (the default) a rotation switches SOCKS credentials
+    instead of sending a tor-wide NEWNYM. A rotation that comes back with
+    the same exit IP is re-rolled for up to repeat_budget seconds.
+    check_endpoints and geo_backend say how the identity behind tor is
+    resolved (IP_CHECK_ENDPOINTS and GEO_BACKEND by default).
+    """
+
+    def __init__(self, socks_proxy=None, control_port=None, control_socket=None, control_password=None,
+                 isolate=True, circuit_timeout=NEWNYM_WAIT_TIMEOUT, repeat_budget=EXIT_REPEAT_BUDGET,
+                 check_endpoints=None, geo_backend=None):
+        self.socks_proxy = socks_proxy or TOR_SOCKS_PROXY
+        self.control_port = control_port or TOR_CONTROL_PORT
+        self.control_socket = control_socket if control_socket is not None or control_port else TOR_CONTROL_SOCKET
+        self.control_password = control_password if control_password is not None else TOR_CONTROL_PASSWORD
+        self.isolate = isolate
+        self.circuit_timeout = circuit_timeout
+        self.repeat_budget = repeat_budget
+        self.check_endpoints = list(check_endpoints or IP_CHECK_ENDPOINTS)
+        self.geo_backend = geo_backend or GEO_BACKEND
+
+class MacConfig:
+    """Whether and how an IdentityRotator changes MAC addresses
+
+    address is a specific MAC for the first interface (None uses random
+    ones, whatever NEW_MAC says); interfaces are names or patterns like
+    'wlan*'. Like TorConfig, unset values are taken from the module
+    configuration once, here, and passed down explicitly from then on.
+    """
+
+    def __init__(self, enabled=False, address=None, interfaces=None, backend=None, exclude=None, rollback=None):
+        self.enabled = enabled
+        self.address = address
+        self.interfaces = list(interfaces or MAC_INTERFACES or [DEFAULT_INTERFACE])
+        self.backend = backend or MAC_BACKEND
+        self.exclude = list(MAC_EXCLUDE_INTERFACES if exclude is None else exclude)
+        self.rollback = MAC_ROLLBACK_ON_FAILURE if rollback is None else rollback
+
+class LogConfig:
+    """Where an IdentityRotator logs its rotations (None disables logging)"""
+
+    def __init__(self, path=None):
+        self.path = path
+
+# Snapshot of an IdentityRotator's identity
+Identity = namedtuple('Identity', ['ip', 'country', 'city', 'mac', 'generation', 'changed_at'])
+
+class IdentityRotator:
+    """Rotates one identity with its own tor settings, log and callbacks
+
+    Unlike change_ip_loop, a rotator keeps all of its state on the instance,
+    so several of them can run in one process and any thread may call it.
+    Rotations are serialized by a lock. Callbacks registered with on() get
+    'rotate' (old, new) after each rotation and 'error' (exception) when one
+    fails. Sessions from session() always use the current identity: every
+    rotation points them at the new one and drops their pooled connections.
+
+    With TorConfig.isolate (the default) a rotation switches to new SOCKS
+    credentials, which tor isolates onto a fresh circuit without disturbing
+    anyone else using it. Otherwise a NEWNYM is sent over the rotator's own
+    control connection.
+
+    IP check endpoint health is tracked per rotator. Some state is shared
+    with the rest of the process on purpose: the geolocation cache and
+    offline database (an IP's location does not depend on who asks) and
+    the metrics registry, so every rotator shows up in one export.
+    """
+
+    def __init__(self, tor=None, mac=None, log=None, name=None):
+        self.tor = tor or TorConfig()
+        self.mac = mac or MacConfig()
+        self.log = log or LogConfig()
+        self.name = name or f"rotator-{uuid.uuid4().hex[:8]}"
+        self.history = deque(maxlen=100)
+        self._lock = threading.RLock()
+        self._callbacks = {'rotate': [], 'error': []}
+        self._sessions = weakref.WeakSet()
+        self._control = None
+        self._log_writer = None
+        self._identity = None
+        self._generation = 0
+        self._ip_check_stats = IpCheckStats()
+        self._proxy = self._new_proxy()
+        self._check_session = self.session()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def on(self, event, callback):
+        """Register a callback for 'rotate' or 'error'; returns it, so it works as a decorator"""
+        if event not in self._callbacks:
+            raise ValueError(f"unknown event {event!r}, expected one of {', '.join(self._callbacks)}")
+        with self._lock:
+            self._callbacks[event].append(callback)
+        return callback
+
+    def _emit(self, event, *args):
+        with self._lock:
+            callbacks = list(self._callbacks[event])
+        for callback in callbacks:
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"{RED}[!] {self.name}: {event} callback failed: {str(e)}{RESET}")
+
+    def _new_proxy(self):
+        if not self.tor.isolate:
+            return self.tor.socks_proxy
+        scheme, address = self.tor.socks_proxy.split("://", 1)
+        return f"{scheme}://{self.name}-{uuid.uuid4().hex[:16]}:{uuid.uuid4().hex}@{address.rsplit('@', 1)[-1]}"
+
+    def session(self):
+        """Return a new requests.Session that goes through the current identity"""
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=len(self.tor.check_endpoints), pool_maxsize=4)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        with self._lock:
+            session.proxies = {"http": self._proxy, "https": self._proxy}
+            self._sessions.add(session)
+        return session
+
+    def _rebind_sessions(self):
+        for session in list(self._sessions):
+            session.proxies = {"http": self._proxy, "https": self._proxy}
+            session.close()  # Its pooled connections are pinned to the old circuit
+
+    def _get_control(self):
+        if self._control is None:
+            self._control = TorControlSession(port=self.tor.control_port, socket_path=self.tor.control_socket,
+                                              password=self.tor.control_password)
+        return self._control
+
+    def ip_check_stats(self):
+        """Return a snapshot of this rotator's per-endpoint IP check statistics"""
+        return self._ip_check_stats.snapshot()
+
+    def _resolve(self, mac=None):
+        ip = get_ip(self._check_session, self.tor.check_endpoints, self._ip_check_stats)
+        with metrics.phase('geo'):
+            if ip:
+                country, city = get_location_for_ip(ip, track=False, backend=self.tor.geo_backend)
+            else:
+                country, city = "Not Defined", "Not Defined"
+        self._identity = Identity(ip, country, city, mac, self._generation,
+                                  datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        return self._identity
+
+    def current_identity(self, refresh=False):
+        """Return the current Identity, resolving it first if unknown (or if refresh)"""
+        with self._lock:
+            if self._identity is None or refresh:
+                mac = self._identity.mac if self._identity else None
+                return self._resolve(mac)
+            return self._identity
+
+    def _switch_circuit(self, reroll=False):
+        if self.tor.isolate:
+            self._proxy = self._new_proxy()
+        else:
+            control = self._get_control()
+            # Closing the circuit in use moves new streams without waiting out NEWNYM's rate limit
+            if not (reroll and control.close_current_circuit()):
+                with metrics.phase('newnym'):
+                    control.newnym()
+                with metrics.phase('circuit_wait'):
+                    circuit = control.wait_for_new_circuit(self.tor.circuit_timeout)
+                if circuit is None:
+                    print(f"{YELLOW}[!] {self.name}: no new circuit within {self.tor.circuit_timeout} seconds{RESET}")
+        self._rebind_sessions()
+
+    def rotate(self):
+        """Change identity and return the new Identity; errors are re-raised after the 'error' callbacks
+
+        If the exit IP comes back unchanged the circuit is re-rolled for up
+        to TorConfig.repeat_budget seconds; after that the repeated IP is
+        returned (and reported to the callbacks) as it is.
+        """
+        try:
+            with self._lock, metrics.breakdown() as timings:
+                old = self._identity or self._resolve()
+                new_mac, mac_results = old.mac, None
+                if self.mac.enabled:
+                    with metrics.phase('mac'):
+                        mac_results = rotate_mac_addresses(
+                            discover_interfaces(self.mac.interfaces, self.mac.exclude), new_mac=self.mac.address,
+                            specific=self.mac.address is not None, backend=self.mac.backend, rollback=self.mac.rollback)
+                    if mac_results:
+                        primary = mac_results[next(iter(mac_results))]
+                        new_mac = primary['new_mac'] or primary['old_mac']
+                        if old.mac is None:  # First rotation: the identity was resolved without a MAC
+                            old = old._replace(mac=primary['old_mac'])
+
+                started = time.monotonic()
+                self._switch_circuit()
+                self._generation += 1
+                new = self._resolve(new_mac)
+                while new.ip and new.ip == old.ip and time.monotonic() - started < self.tor.repeat_budget:
+                    print(f"{YELLOW}[*] {self.name}: exit {BLUE}{new.ip}{YELLOW} did not change, re-rolling...{RESET}")
+                    with metrics.phase('reroll'):
+                        self._switch_circuit(reroll=True)
+                    new = self._resolve(new_mac)
+                if new.ip and new.ip == old.ip:
+                    print(f"{YELLOW}[!] {self.name}: still on {BLUE}{new.ip}{YELLOW} after "
+                          f"{self.tor.repeat_budget} seconds of re-rolling{RESET}")
+                self.history.append(new)
+
+                if self.log.path:
+                    if self._log_writer is None:
+                        self._log_writer = LogWriter(self.log.path)
+                    mac_changed = all(result['ok'] for result in mac_results.values()) if mac_results else None
+                    log_ip_change(old.ip, old.country, old.city, new.ip, new.country, new.city,
+                                  old.mac if mac_results else None, new.mac if mac_results else None, mac_changed,
+                                  mac_results if mac_results and len(mac_results) > 1 else None,
+                                  writer=self._log_writer, timings=timings)
+        except Exception as e:
+            self._emit('error', e)
+            raise
+        finally:
+            export_metrics()
+        self._emit('rotate', old, new)
+        return new
+
+    async def rotate_async(self):
+        """rotate() for asyncio code, run in the default executor"""
+        return await asyncio.get_running_loop().run_in_executor(None, self.rotate)
+
+    async def current_identity_async(self, refresh=False):
+        """current_identity() for asyncio code, run in the default executor"""
+        return await asyncio.get_running_loop().run_in_executor(None, self.current_identity, refresh)
+
+    def close(self):
+        """Close the sessions, the control connection and the log"""
+        with self._lock:
+            for session in list(self._sessions):
+                session.close()
+            if self._control is not None:
+                self._control.close()
+                self._control = None
+            if self._log_writer is not None:
+                self._log_writer.close(LOG_CLOSE_TIMEOUT)
+                self._log_writer = None
+
+class ProxyError(Exception):
+    """Upstream failure, carrying the SOCKS5 reply code to pass on to the client"""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+class ProxyIdentity:
+    """One identity of the rotating proxy: a SOCKS credential token and its usage"""
+
+    def __init__(self):
+        self.token = uuid.uuid4().hex[:16]
+        self.started = time.monotonic()
+        self.requests = 0
+        self.bytes = 0
+        self.active = 0
+        self.writers = set()  # Both ends of every open tunnel, closed when the identity is retired
+        self._idle = None
+
+    @property
+    def idle(self):
+        """Set while no connection uses the identity
+
+        Created on first use, from the proxy's loop: the first identity is
+        made before asyncio.run() starts it, and before Python 3.10 an Event
+        binds to the loop current at creation.
+        """
+        if self._idle is None:
+            self._idle = asyncio.Event()
+            if not self.active:
+                self._idle.set()
+        return self._idle
+
+class RotatingProxy:
+    """Local SOCKS5 and HTTP proxy in front of tor that rotates on usage
+
+    Every client connection is tunnelled through tor's SOCKS port with
+    credentials derived from the current identity (and, with client
+    isolation, the client's address), so IsolateSOCKSAuth gives each
+    identity and client their own circuits. The identity rotates after a
+    number of connections, bytes or seconds: from the next connection on,
+    clients get the new identity, while connections still open on the old
+    one drain on their own circuits. Whatever is left after
+    PROXY_DRAIN_TIMEOUT is closed and the old identity is retired.
+    Everything runs on one asyncio loop.
+    """
+
+    def __init__(self, listen=None, port=None, socks_proxy=None, rotate_requests=None, rotate_bytes=None,
+                 rotate_interval=None, isolation=None):
+        self.listen = listen or PROXY_LISTEN
+        self.port = port or PROXY_PORT
+        address = (socks_proxy or TOR_SOCKS_PROXY).split("://", 1)[-1].rsplit("@", 1)[-1]
+        self.socks_host, socks_port = address.rsplit(":", 1)
+        self.socks_port = int(socks_port)
+        self.rotate_requests = PROXY_ROTATE_REQUESTS if rotate_requests is None else rotate_requests
+        self.rotate_bytes = PROXY_ROTATE_BYTES if rotate_bytes is None else rotate_bytes
+        self.rotate_interval = PROXY_ROTATE_INTERVAL if rotate_interval is None else rotate_interval
+        self.isolation = isolation or PROXY_ISOLATION
+        self.identity = ProxyIdentity()
+        self.rotations = 0
+        self.connections = 0
+        self._draining = set()
+        self._server = None
+
+    def _rotation_due(self, identity):
+        if self.rotate_requests and identity.requests >= self.rotate_requests:
+            return f"{identity.requests} requests"
+        if self.rotate_bytes and identity.bytes >= self.rotate_bytes:
+            return f"{identity.bytes} bytes"
+        if self.rotate_interval and time.monotonic() - identity.started >= self.rotate_interval:
+            return f"{int(time.monotonic() - identity.started)} seconds"
+        return None
+
+    async def _retire(self, identity):
+        """Let the old identity's connections finish, then close the stragglers"""
+        try:
+            await asyncio.wait_for(identity.idle.wait(), PROXY_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"{YELLOW}[*] Closing {identity.active} connections left on the old identity{RESET}")
+            for writer in list(identity.writers):
+                writer.close()
+
+    def _acquire(self):
+        """Return the identity for a new connection, rotating first if it is due"""
+        identity = self.identity
+        reason = self._rotation_due(identity)
+        if reason:
+            self.identity = ProxyIdentity()
+            self.rotations += 1
+            print(f"{GREEN}[+] Proxy identity rotated after {BLUE}{reason}{GREEN} "
+                  f"({identity.active} connections draining){RESET}")
+            if identity.active:
+                task = asyncio.ensure_future(self._retire(identity))
+                self._draining.add(task)
+                task.add_done_callback(self._draining.discard)
+            identity = self.identity
+
+        identity.requests += 1
+        identity.active += 1
+        identity.idle.clear()
+        return identity
+
+    def _release(self, identity):
+        identity.active -= 1
+        if not identity.active:
+            identity.idle.set()
+
+    def _credentials(self, identity, client_key):
+        username = identity.token
+        if self.isolation == 'client':
+            username += f"-{client_key}"
+        return username.encode()[:255], identity.token.encode()
+
+    async def _open_upstream(self, host, port, identity, client_key):
+        """Connect to host:port through tor's SOCKS port with the identity's credentials"""
+        reader, writer = await asyncio.open_connection(self.socks_host, self.socks_port)
+        try:
+            username, password = self._credentials(identity, client_key)
+            writer.write(b"\x05\x01\x02")
+            if await reader.readexactly(2) != b"\x05\x02":
+                raise ProxyError(0x01, "tor refused username/password authentication")
+            writer.write(bytes([1, len(username)]) + username + bytes([len(password)]) + password)
+            if (await reader.readexactly(2))[1] != 0:
+                raise ProxyError(0x01, "tor rejected the credentials")
+
+            try:
+                packed = ipaddress.ip_address(host).packed
+                address = (b"\x01" if len(packed) == 4 else b"\x04") + packed
+            except ValueError:
+                encoded = host.encode("idna")
+                address = b"\x03" + bytes([len(encoded)]) + encoded
+            writer.write(b"\x05\x01\x00" + address + struct.pack("!H", port))
+
+            reply = await reader.readexactly(4)
+            if reply[1] != 0:
+                raise ProxyError(reply[1], f"tor could not connect to {host}:{port} (SOCKS error {reply[1]})")
+            if reply[3] == 3:
+                await reader.readexactly((await reader.readexactly(1))[0] + 2)
+            else:
+                await reader.readexactly((16 if reply[3] == 4 else 4) + 2)
+            return reader, writer
+        except Exception:
+            writer.close()
+            raise
+
+    async def _pipe(self, reader, writer, identity):
+        try:
+            while True:
+                data = await reader.read(PROXY_BUFFER_SIZE)
+                if not data:
+                    break
+                identity.bytes += len(data)
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            try:
+                if writer.can_write_eof():
+                    writer.write_eof()
+            except (ConnectionError, OSError):
+                pass
+
+    async def _tunnel(self, client_reader, client_writer, host, port, client_key, on_connected, on_error):
+        """Open the upstream for one client connection and relay until both sides close"""
+        identity = self._acquire()
+        try:
+            try:
+                upstream_reader, upstream_writer = await asyncio.wait_for(
+                    self._open_upstream(host, port, identity, client_key), PROXY_CONNECT_TIMEOUT)
+            except ProxyError as e:
+                await on_error(e.code)
+                return
+            except (asyncio.TimeoutError, OSError, asyncio.IncompleteReadError):
+                await on_error(0x04)  # Host unreachable
+                return
+
+            identity.writers.update((client_writer, upstream_writer))
+            try:
+                await on_connected()
+                await asyncio.gather(self._pipe(client_reader, upstream_writer, identity),
+                                     self._pipe(upstream_reader, client_writer, identity))
+            finally:
+                identity.writers.difference_update((client_writer, upstream_writer))
+                upstream_writer.close()
+        finally:
+            self._release(identity)
+
+    async def _handle_socks(self, reader, writer, client_key):
+        methods = await reader.readexactly((await reader.readexactly(1))[0])
+        if 2 in methods:
+            # Client credentials become part of the isolation key
+            writer.write(b"\x05\x02")
+            await reader.readexactly(1)
+            username = await reader.readexactly((await reader.readexactly(1))[0])
+            await reader.readexactly((await reader.readexactly(1))[0])
+            writer.write(b"\x01\x00")
+            client_key += f"-{username.decode(errors='replace')}"
+        elif 0 in methods:
+            writer.write(b"\x05\x00")
+        else:
+            writer.write(b"\x05\xff")
+            return
+
+        _, command, _, address_type = await reader.readexactly(4)
+        if address_type == 1:
+            host = socket.inet_ntop(socket.AF_INET, await reader.readexactly(4))
+        elif address_type == 4:
+            host = socket.inet_ntop(socket.AF_INET6, await reader.readexactly(16))
+        elif address_type == 3:
+            host = (await reader.readexactly((await reader.readexactly(1))[0])).decode("idna")
+        else:
+            writer.write(b"\x05\x08\x00\x01" + b"\x00" * 6)
+            return
+        port = struct.unpack("!H", await reader.readexactly(2))[0]
+        if command != 1:
+            writer.write(b"\x05\x07\x00\x01" + b"\x00" * 6)  # Only CONNECT is supported
+            return
+
+        async def connected():
+            writer.write(b"\x05\x00\x00\x01" + b"\x00" * 6)
+            await writer.drain()
+
+        async def failed(code):
+            writer.write(bytes([5, code, 0, 1]) + b"\x00" * 6)
+            await writer.drain()
+
+        await self._tunnel(reader, writer, host, port, client_key, connected, failed)
+
+    async def _handle_http(self, reader, writer, client_key, first_byte):
+        head = first_byte + await reader.readuntil(b"\r\n\r\n")
+        request_line, _, headers = head.decode("latin-1").partition("\r\n")
+        try:
+            method, target, version = request_line.split(" ", 2)
+        except ValueError:
+            writer.write(b"HTTP/1.1 400 Bad Request\r\nConnection: close\r\n\r\n")
+            return
+
+        if method.upper() == "CONNECT":
+            host, _, port = target.rpartition(":")
+            forward = None
+        else:
+            url = urlsplit(target)
+            if url.scheme != "http" or not url.hostname:
+                writer.write(b"HTTP/1.1 400 Bad Request\r\nConnection: close\r\n\r\n")
+                return
+            host, port = url.hostname, url.port or 80
+            path = url.path or "/"
+            if url.query:
+                path += "?" + url.query
+            # One upstream per client connection, so keep-alive can't switch hosts on us
+            kept = [line for line in headers.split("\r\n")
+                    if line and not line.lower().startswith(("proxy-connection:", "connection:", "proxy-authorization:"))]
+            forward = f"{method} {path} {version}\r\n" + "\r\n".join(kept) + "\r\nConnection: close\r\n\r\n"
+        try:
+            host, port = host.strip("[]"), int(port)
+        except ValueError:
+            writer.write(b"HTTP/1.1 400 Bad Request\r\nConnection: close\r\n\r\n")
+            return
+
+        async def connected():
+            if forward is None:
+                writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+                await writer.drain()
+
+        async def failed(code):
+            status = b"504 Gateway Timeout" if code == 0x06 else b"502 Bad Gateway"
+            writer.write(b"HTTP/1.1 " + status + b"\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+
+        if forward is not None:
+            # Replay the rewritten request ahead of whatever body follows it
+            body_reader = asyncio.StreamReader()
+            body_reader.feed_data(forward.encode("latin-1"))
+
+            async def feed():
+                try:
+                    while True:
+                        data = await reader.read(PROXY_BUFFER_SIZE)
+                        if not data:
+                            break
+                        body_reader.feed_data(data)
+                except (ConnectionError, OSError):
+                    pass
+                body_reader.feed_eof()
+
+            feeder = asyncio.ensure_future(feed())
+            try:
+                await self._tunnel(body_reader, writer, host, port, client_key, connected, failed)
+            finally:
+                feeder.cancel()
+        else:
+            await self._tunnel(reader, writer, host, port, client_key, connected, failed)
+
+    async def _handle_client(self, reader, writer):
+        self.connections += 1
+        peer = writer.get_extra_info("peername")
+        client_key = peer[0] if peer else "local"
+        try:
+            first_byte = await reader.readexactly(1)
+            if first_byte == b"\x05":
+                await self._handle_socks(reader, writer, client_key)
+            else:
+                await self._handle_http(reader, writer, client_key, first_byte)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_client, self.listen, self.port,
+                                                  backlog=PROXY_BACKLOG, reuse_address=True)
+        return self._server
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+def _raise_open_file_limit():
+    """Thousands of client connections need twice as many file descriptors"""
+    if resource is None:
+        return
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY or hard > soft:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard if hard != resource.RLIM_INFINITY else 65536, hard))
+    except (ValueError, OSError):
+        pass
+
+def run_proxy(listen=None, port=None, rotate_requests=None, rotate_bytes=None, rotate_interval=None, isolation=None):
+    """Proxy subcommand: serve the rotating SOCKS5/HTTP proxy until Ctrl+C"""
+    _raise_open_file_limit()
+    proxy = RotatingProxy(listen, port, TOR_SOCKS_PROXY, rotate_requests, rotate_bytes, rotate_interval, isolation)
+
+    rules = []
+    if proxy.rotate_requests:
+        rules.append(f"{proxy.rotate_requests} requests")
+    if proxy.rotate_bytes:
+        rules.append(f"{proxy.rotate_bytes} bytes")
+    if proxy.rotate_interval:
+        rules.append(f"{proxy.rotate_interval} seconds")
+    print(f"{GREEN}[+] Rotating proxy listening on {BLUE}{proxy.listen}:{proxy.port}{GREEN} (SOCKS5 and HTTP){RESET}")
+    print(f"{GREEN}[+] Upstream Tor SOCKS: {BLUE}{proxy.socks_host}:{proxy.socks_port}{RESET}")
+    print(f"{GREEN}[+] Rotate every: {BLUE}{', '.join(rules) or 'never'}{GREEN}, isolation: {BLUE}{proxy.isolation}{RESET}")
+
+    try:
+        asyncio.run(proxy.serve_forever())
+    except KeyboardInterrupt:
+        print(f"\n{RED}[!] Stopping proxy...{RESET}")
+    except OSError as e:
+        print(f"{RED}[!] Proxy failed: {str(e)}{RESET}")
+        return 1
+    return 0
+
+class ProbeTargetHandler:
+    """Serves PROBE_BYTES (or ?bytes=N) of uncacheable filler for circuit probes
+
+    Mixed into BaseHTTPRequestHandler by run_probe_server, so http.server is
+    only imported when the probe server actually runs.
+    """
+
+    def do_GET(self):
+        try:
+            size = int(parse_qs(urlsplit(self.path).query).get('bytes', [PROBE_BYTES])[0])
+        except ValueError:
+            size = PROBE_BYTES
+        size = max(0, min(size, 64 * 1024 * 1024))
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        block = b"\0" * 65536
+        while size > 0:
+            self.wfile.write(block[:size])
+            size -= len(block)
+
+    def log_message(self, format, *args):
+        pass
+
+def run_probe_server(listen="0.0.0.0", port=8000):
+    """Probe-server subcommand: host a probe target, e.g. on a VPS, for PROBE_URL"""
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    handler = type('ProbeTargetHandler', (ProbeTargetHandler, BaseHTTPRequestHandler), {})
+    server = ThreadingHTTPServer((listen, port), handler)
+    print(f"{GREEN}[+] Serving probe target on {BLUE}http://{listen}:{port}/{RESET}")
+    print(f"{YELLOW}[*] Pass this address as seen from the internet to --probe-url (or set PROBE_URL){RESET}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n{RED}[!] Stopping probe server...{RESET}")
+    finally:
+        server.server_close()
+    return 0
+
+def get_real_ip():
+    """Get real IP (not via Tor)"""
+    try:
+        r = requests.get("https://api.ipify.org?format=json", timeout=10)
+        return r.json()["ip"]
+    except:
+        return "Not Defined"
+
+def get_current_mac(interface=DEFAULT_INTERFACE, backend=None):
+    """Get current MAC address of specified interface (backend overrides MAC_BACKEND)"""
+    backend = backend or MAC_BACKEND
+    if backend != 'subprocess' and native_mac_available():
+        try:
+            return native_get_mac(interface)
+        except Exception as e:
+            if backend == 'native':
+                print(f"{RED}[!] Error getting MAC address: {str(e)}{RESET}")
+                return "Not Defined"
+    
+    try:
+        result = subprocess.check_output(['ifconfig', interface], stderr=subprocess.STDOUT)
+        result = result.decode('utf-8')
+        mac_match = re.search(r'ether\s+([0-9a-fA-F:]{17})', result)
+        if mac_match:
+            return mac_match.group(1)
+    except Exception as e:
+        print(f"{RED}[!] Error getting MAC address from ifconfig: {str(e)}{RESET}")
+    
+    # Fallback method 1 - ip link
+    try:
+        result = subprocess.check_output(['ip', 'link', 'show', interface], stderr=subprocess.STDOUT)
+        result = result.decode('utf-8')
+        mac_match = re.search(r'link/ether\s+([0-9a-fA-F:]{17})', result)
+        if mac_match:
+            return mac_match.group(1)
+    except Exception as e:
+        print(f"{RED}[!] Error getting MAC address from ip link: {str(e)}{RESET}")
+    
+    # Fallback method 2 - System UUID
+    try:
+        mac = uuid.UUID(int=uuid.getnode()).hex[-12:]
+        return ":".join([mac[e:e+2] for e in range(0, 12, 2)])
+    except:
+        return "Not Defined"
+
+def generate_random_mac():
+    """Generate a random MAC address"""
+    # The first byte should be even (unicast) and not locally administered
+    first_byte = random.randint(0x00, 0x7F) * 2
+    mac = [first_byte] + [random.randint(0x00, 0xFF) for _ in range(5)]
+    return ":".join(f"{x:02x}" for x in mac)
+
+# Linux ioctl/netlink constants for the native MAC backend
+SIOCGIFFLAGS = 0x8913
+SIOCSIFFLAGS = 0x8914
+SIOCSIFHWADDR = 0x8924
+SIOCGIFHWADDR = 0x8927
+IFF_UP = 0x1
+ARPHRD_ETHER = 1
+RTMGRP_LINK = 0x1
+RTM_NEWLINK = 16
+IFLA_OPERSTATE = 16
+IF_OPER_UNKNOWN, IF_OPER_UP = 0, 6
+
+def native_mac_available():
+    """Return True if MACs can be handled with ioctls instead of subprocesses"""
+    return fcntl is not None and sys.platform.startswith('linux')
+
+def _ifreq(interface, payload=b''):
+    """Build a struct ifreq: 16-byte interface name followed by the request union"""
+    return struct.pack('16s', interface.encode()[:15]) + payload.ljust(24, b'\0')
+
+def native_get_mac(interface=DEFAULT_INTERFACE):
+    """Read the hardware address from sysfs, or with SIOCGIFHWADDR"""
+    try:
+        with open(f'/sys/class/net/{interface}/address', 'r') as f:
+            mac = f.read().strip()
+        if re.match(r'^([0-9a-f]{2}:){5}[0-9a-f]{2}$', mac):
+            return mac
+    except OSError:
+        pass
+
+    socket.if_nametoindex(interface)  # Raises OSError for unknown interfaces
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        result = fcntl.ioctl(sock.fileno(), SIOCGIFHWADDR, _ifreq(interface))
+    return ":".join(f"{b:02x}" for b in result[18:24])
+
+def _set_link_up(sock, interface, up):
+    flags = struct.unpack('H', fcntl.ioctl(sock.fileno(), SIOCGIFFLAGS, _ifreq(interface))[16:18])[0]
+    flags = flags | IFF_UP if up else flags & ~IFF_UP
+    fcntl.ioctl(sock.fileno(), SIOCSIFFLAGS, _ifreq(interface, struct.pack('H', flags)))
+
+def _read_operstate(interface):
+    try:
+        with open(f'/sys/class/net/{interface}/operstate', 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def _open_link_monitor():
+    """Subscribe to rtnetlink link notifications"""
+    monitor = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+    monitor.bind((0, RTMGRP_LINK))
+    return monitor
+
+def _wait_for_link_up(monitor, interface, timeout):
+    """Block on RTM_NEWLINK notifications until the interface is operationally up"""
+    index = socket.if_nametoindex(interface)
+    deadline = time.monotonic() + timeout
+    if _read_operstate(interface) in ('up', 'unknown'):
+        return True
+
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        ready, _, _ = select.select([monitor], [], [], remaining)
+        if not ready:
+            return False
+
+        data = monitor.recv(65536)
+        offset = 0
+        while offset + 16 <= len(data):
+            msg_len, msg_type = struct.unpack_from('IH', data, offset)
+            if msg_len < 16:
+                break
+            if msg_type == RTM_NEWLINK and offset + 32 <= len(data):
+                if_index = struct.unpack_from('i', data, offset + 20)[0]
+                attr = offset + 32
+                while if_index == index and attr + 4 <= offset + msg_len:
+                    attr_len, attr_type = struct.unpack_from('HH', data, attr)
+                    if attr_len < 4:
+                        break
+                    if attr_type == IFLA_OPERSTATE and data[attr + 4] in (IF_OPER_UP, IF_OPER_UNKNOWN):
+                        return True
+                    attr += (attr_len + 3) & ~3
+            offset += (msg_len + 3) & ~3
+
+def native_set_mac(interface, mac):
+    """Set the hardware address with SIOCSIFHWADDR
+
+    The address is first set live; drivers that refuse (EBUSY) get the link
+    taken down and brought back up, waiting for operstate over netlink.
+    """
+    hwaddr = struct.pack('H6s', ARPHRD_ETHER, bytes.fromhex(mac.replace(':', '').replace('-', '')))
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            fcntl.ioctl(sock.fileno(), SIOCSIFHWADDR, _ifreq(interface, hwaddr))
+            return True
+        except OSError as e:
+            if e.errno != errno.EBUSY:
+                raise
+
+        with _open_link_monitor() as monitor:
+            _set_link_up(sock, interface, False)
+            try:
+                fcntl.ioctl(sock.fileno(), SIOCSIFHWADDR, _ifreq(interface, hwaddr))
+            finally:
+                _set_link_up(sock, interface, True)
+            if not _wait_for_link_up(monitor, interface, LINK_WAIT_TIMEOUT):
+                print(f"{YELLOW}[!] {interface} did not report link up within {LINK_WAIT_TIMEOUT} seconds{RESET}")
+    return True
+
+def change_mac_address(interface=DEFAULT_INTERFACE, specific=True, new_mac=None, backend=None):
+    """Change MAC address using multiple methods with fallback
+
+    new_mac sets a specific address; otherwise NEW_MAC is used when
+    specific and the configured method is 'specific', else a random one.
+    backend overrides MAC_BACKEND.
+    """
+    if new_mac is None and specific and MAC_CHANGE_METHOD == 'specific':
+        new_mac = NEW_MAC
+    backend = backend or MAC_BACKEND
+    
+    original_mac = get_current_mac(interface, backend)
+    if original_mac == "Not Defined":
+        print(f"{RED}[!] Could not determine current MAC address{RESET}")
+        return False
+    
+    print(f"\n{YELLOW}[*] Current MAC: {BLUE}{original_mac}{RESET}")
+    
+    if backend != 'subprocess' and native_mac_available():
+        target_mac = new_mac or generate_random_mac()
+        with metrics.timed('mac_change', method='ioctl') as timing:
+            try:
+                native_set_mac(interface, target_mac)
+                current_mac = get_current_mac(interface, backend)
+                if current_mac != original_mac and current_mac != "Not Defined":
+                    print(f"\n{GREEN}[✓] MAC changed successfully using ioctl{RESET}")
+                    print(f"{GREEN}[+] New MAC: {BLUE}{current_mac}{RESET}")
+                    return True
+            except Exception as e:
+                print(f"{RED}[!] Failed with ioctl: {str(e)}{RESET}")
+            timing.fail()
+        if backend == 'native':
+            print(f"{RED}[!] All MAC change methods failed{RESET}")
+            return False
+    
+    methods = [
+        ('macchanger', ['sudo', 'macchanger', '-r', interface]),
+        ('ifconfig down/up', [
+            'sudo', 'ifconfig', interface, 'down',
+            '&&', 'sudo', 'ifconfig', interface, 'hw', 'ether', generate_random_mac(),
+            '&&', 'sudo', 'ifconfig', interface, 'up'
+        ]),
+        ('ip link set', [
+            'sudo', 'ip', 'link', 'set', interface, 'down',
+            '&&', 'sudo', 'ip', 'link', 'set', interface, 'address', generate_random_mac(),
+            '&&', 'sudo', 'ip', 'link', 'set', interface, 'up'
+        ])
+    ]
+    
+    if new_mac:
+        methods.insert(0, ('specific mac', [
+            'sudo', 'ifconfig', interface, 'down',
+            '&&', 'sudo', 'ifconfig', interface, 'hw', 'ether', new_mac,
+            '&&', 'sudo', 'ifconfig', interface, 'up'
+        ]))
+    
+    success = False
+    for method_name, cmd in methods:
+        timing = metrics.timed('mac_change', method=method_name)
+        try:
+            with timing:
+                print(f"{YELLOW}[*] Trying method: {method_name}{RESET} \n")
+                
+                if '&&' in cmd:
+                    # Handle multiple commands
+                    full_cmd = ' '.join(cmd)
+                    subprocess.run(full_cmd, shell=True, check=True)
+                else:
+                    subprocess.run(cmd, check=True)
+                
+                time.sleep(2)  # Give interface time to reset
+                
+                current_mac = get_current_mac(interface, backend)
+                success = current_mac != original_mac and current_mac != "Not Defined"
+                if not success:
+                    timing.fail()
+            if success:
+                print(f"\n{GREEN}[✓] MAC changed successfully using {method_name}{RESET}")
+                print(f"{GREEN}[+] New MAC: {BLUE}{current_mac}{RESET}")
+                break
+        except Exception as e:
+            print(f"{RED}[!] Failed with {method_name}: {str(e)}{RESET}")
+            continue
+    
+    if not success:
+        print(f"{RED}[!] All MAC change methods failed{RESET}")
+        return False
+    
+    return True
+
+def discover_interfaces(patterns=None, exclude=None):
+    """Resolve the interfaces to rotate from names and patterns
+
+    patterns replaces MAC_INTERFACES as the list of names or patterns to
+    use; without either only DEFAULT_INTERFACE is rotated. Patterns such
+    as 'wlan*' or '*' match Ethernet-type interfaces (NICs, wlan, VLANs)
+    only. A pattern matching nothing is reported and contributes nothing,
+    so the result may be empty. exclude replaces MAC_EXCLUDE_INTERFACES.
+    """
+    exclude = MAC_EXCLUDE_INTERFACES if exclude is None else exclude
+    candidates = MAC_INTERFACES if patterns is None else patterns
+    if not candidates:
+        return [DEFAULT_INTERFACE]
+
+    try:
+        available = sorted(os.listdir('/sys/class/net'))
+    except OSError:
+        available = []
+    expanded = []
+    for pattern in candidates:
+        if any(c in pattern for c in '*?['):
+            matches = [name for name in fnmatch.filter(available, pattern) if _is_ethernet_interface(name)]
+            if not matches:
+                print(f"{YELLOW}[!] No interface matches {BLUE}{pattern}{RESET}")
+        else:
+            matches = [pattern]
+        expanded.extend(name for name in matches if name not in expanded)
+
+    return [
+        name for name in expanded
+        if not any(fnmatch.fnmatch(name, pattern) for pattern in exclude)
+    ]
+
+def _is_ethernet_interface(name):
+    try:
+        with open(f'/sys/class/net/{name}/type', 'r') as f:
+            return int(f.read().strip()) == ARPHRD_ETHER
+    except (OSError, ValueError):
+        return False
+
+def restore_mac_address(interface, mac, backend=None):
+    """Put an interface back on a previous MAC address"""
+    backend = backend or MAC_BACKEND
+    if backend != 'subprocess' and native_mac_available():
+        try:
+            return native_set_mac(interface, mac)
+        except Exception:
+            if backend == 'native':
+                return False
+
+    try:
+        subprocess.run(['sudo', 'ip', 'link', 'set', interface, 'down'], check=True)
+        subprocess.run(['sudo', 'ip', 'link', 'set', interface, 'address', mac], check=True)
+        subprocess.run(['sudo', 'ip', 'link', 'set', interface, 'up'], check=True)
+        return True
+    except Exception:
+        return False
+
+def rotate_mac_addresses(interfaces=None, new_mac=None, specific=True, backend=None, rollback=None):
+    """Change the MAC of several interfaces concurrently
+
+    Returns {interface: {'ok', 'old_mac', 'new_mac'}}. The links are down
+    for as long as the slowest interface takes, not the sum of all of them.
+    A specific MAC (new_mac, or NEW_MAC unless specific is False) is only
+    applied to the first interface, the others get random ones. Interfaces
+    whose current MAC cannot be read are skipped and left out of the
+    result. If any interface fails and rollback (default
+    MAC_ROLLBACK_ON_FAILURE) is set, the ones that did change are restored
+    to their original address. backend overrides MAC_BACKEND.
+    """
+    rollback = MAC_ROLLBACK_ON_FAILURE if rollback is None else rollback
+    if interfaces is None:
+        interfaces = discover_interfaces()
+    results = {}
+    for name in interfaces:
+        old_mac = get_current_mac(name, backend)
+        if old_mac == "Not Defined":
+            print(f"{YELLOW}[!] Skipping {BLUE}{name}{YELLOW}: its current MAC address cannot be read{RESET}")
+            continue
+        results[name] = {'ok': False, 'old_mac': old_mac, 'new_mac': None}
+    interfaces = list(results)
+    if not interfaces:
+        return results
+
+    def rotate(name, first):
+        return change_mac_address(name, specific=specific and first, new_mac=new_mac if first else None,
+                                  backend=backend)
+
+    with ThreadPoolExecutor(max_workers=len(interfaces)) as executor:
+        futures = {executor.submit(rotate, name, i == 0): name for i, name in enumerate(interfaces)}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name]['ok'] = bool(future.result())
+            except Exception as e:
+                print(f"{RED}[!] MAC rotation failed on {name}: {str(e)}{RESET}")
+            if results[name]['ok']:
+                results[name]['new_mac'] = get_current_mac(name, backend)
+
+    changed = [name for name, result in results.items() if result['ok']]
+    if rollback and changed and len(changed) < len(interfaces):
+        print(f"{YELLOW}[*] Rolling back MAC changes on {', '.join(changed)}{RESET}")
+        with ThreadPoolExecutor(max_workers=len(changed)) as executor:
+            restored = executor.map(lambda name: restore_mac_address(name, results[name]['old_mac'], backend), changed)
+            for name, ok in zip(changed, restored):
+                results[name].update({'ok': False, 'new_mac': None, 'rolled_back': ok})
+                if not ok:
+                    print(f"{RED}[!] Could not restore original MAC on {name}{RESET}")
+
+    return results
+
+def print_banner():
+    print(rf"""{BLUE}
+     ██╗  ██╗ █████╗ ██████╗ ███████╗███████╗███╗   ███╗    ███╗   ██╗███████╗████████╗
+     ██║ ██╔╝██╔══██╗██╔══██╗██╔════╝██╔════╝████╗ ████║    ████╗  ██║██╔════╝╚══██╔══╝
+     █████╔╝ ███████║██████╔╝█████╗  █████╗  ██╔████╔██║    ██╔██╗ ██║█████╗     ██║   
+     ██╔═██╗ ██╔══██║██╔══██╗██╔══╝  ██╔══╝  ██║╚██╔╝██║    ██║╚██╗██║██╔══╝     ██║   
+     ██║  ██╗██║  ██║██║  ██║███████╗███████╗██║ ╚═╝ ██║    ██║ ╚████║███████╗   ██║   
+     ╚═╝  ╚═╝╚═╝  ╚═╝╚═╝  ╚═╝╚══════╝╚══════╝╚═╝     ╚═╝    ╚═╝  ╚═══╝╚══════╝   ╚═╝   
+     {RESET}
+          {YELLOW}
+          ███████╗██████╗ ███████╗██████╗ 
+          ██╔════╝██╔══██╗██╔════╝██╔══██╗
+          █████╗  ██████╔╝█████╗  ██║  ██║
+          ██╔══╝  ██╔══██╗██╔══╝  ██║  ██║
+          ██║     ██║  ██║███████╗██████╔╝
+          ╚═╝     ╚═╝  ╚═╝╚══════╝╚═════╝  {GREEN} Freedom Through Anonymity{RESET}
+
+     {YELLOW}[+] IP Changer with Country & City Lookup
+     [+] Coded by: Kareem Abdelmuttalib
+     [+] Freedom Through Anonymity
+     [+] Stay Hidden, Stay Safe{RESET}
+     """)
+
+def print_country_chain():
+    """Display visited countries chain in a box"""
+    if not visited_countries:
+        return
+    
+    with visited_countries_lock:
+        countries = list(visited_countries.keys())
+    arrow = f"{MAGENTA}→{RESET}"
+    country_chain = f" {arrow} ".join(countries)
+    
+    print(f"\n{YELLOW}┌─────────────────────────────────────────────────────────────────────────────────────────┐")
+    print(f"{YELLOW}│ {CYAN}{country_chain}{RESET}")
     print(f"{YELLOW}└─────────────────────────────────────────────────────────────────────────────────────────┘{RESET}")
 
 def setup_telegram():
@@ -530,11 +3833,12 @@ def setup_telegram():
             # Test the connection
             print(f"{YELLOW}[*] Testing Telegram connection...{RESET}")
             test_message = "🔔 <b> IP Changer Notification Test</b>\nThis is a test message to verify Telegram notifications are working."
-            send_telegram_notification(test_message)
+            if not get_telegram_notifier().send_now(test_message):
+                print(f"{YELLOW}[!] Test message was not delivered, check the token and chat ID{RESET}")
             
             TELEGRAM_ENABLED = True
             print(f"{GREEN}[✓] Telegram notifications enabled{RESET}")
-            time.sleep(2)
+            pause(2)
             return
         except Exception as e:
             print(f"{RED}[!] Telegram setup failed: {str(e)}{RESET}")
@@ -550,7 +3854,7 @@ def setup_logging():
         if enable == 'n':
             LOG_ENABLED = False
             print(f"{YELLOW}[*] Logging disabled{RESET}")
-            time.sleep(2)
+            pause(2)
             return
         elif enable == 'y':
             LOG_ENABLED = True
@@ -558,30 +3862,32 @@ def setup_logging():
             if custom_name:
                 LOG_FILE = custom_name
             print(f"{GREEN}[✓] Logging enabled to file: {BLUE}{LOG_FILE}{RESET}")
-            time.sleep(2)
+            pause(2)
             return
         else:
             print(f"{RED}[!] Invalid choice. Please enter 'y' or 'n'{RESET}")
 
 def setup_mac_changer():
     """Configure MAC address changing options"""
-    global MAC_CHANGE_ENABLED, MAC_CHANGE_METHOD, NEW_MAC
+    global MAC_CHANGE_ENABLED, MAC_CHANGE_METHOD, NEW_MAC, MAC_INTERFACES
     
     while True:
         print(f"\n{YELLOW}[*] MAC Address Changing Options:{RESET}")
         print(f"{GREEN}[1]{RESET} Enable random MAC changing")
         print(f"{GREEN}[2]{RESET} Set specific MAC address       {YELLOW}( {RED}Advanced {YELLOW}){RESET}")
         print(f"{GREEN}[3]{RESET} Disable MAC changing")
-        print(f"{GREEN}[4]{RESET} Back to main menu")
+        interfaces = ', '.join(discover_interfaces())
+        print(f"{GREEN}[4]{RESET} Select interfaces              {YELLOW}( {BLUE}{interfaces} {YELLOW}){RESET}")
+        print(f"{GREEN}[5]{RESET} Back to main menu")
         
-        choice = input(f"\n{YELLOW}Enter your choice (1-4): {RESET}").strip()
+        choice = input(f"\n{YELLOW}Enter your choice (1-5): {RESET}").strip()
         
         if choice == "1":
             MAC_CHANGE_ENABLED = True
             MAC_CHANGE_METHOD = 'random'
             NEW_MAC = None
             print(f"{GREEN}[✓] Random MAC changing enabled{RESET}")
-            time.sleep(2)
+            pause(2)
             return
         elif choice == "2":
             MAC_CHANGE_ENABLED = True
@@ -590,7 +3896,7 @@ def setup_mac_changer():
                 NEW_MAC = input(f"{YELLOW}Enter MAC address (format XX:XX:XX:XX:XX:XX): {RESET}").strip()
                 if re.match(r'^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$', NEW_MAC):
                     print(f"{GREEN}[✓] Specific MAC address set: {BLUE}{NEW_MAC}{RESET}")
-                    time.sleep(2)
+                    pause(2)
                     return
                 else:
                     print(f"{RED}[!] Invalid MAC address format{RESET}")
@@ -599,17 +3905,192 @@ def setup_mac_changer():
             MAC_CHANGE_METHOD = None
             NEW_MAC = None
             print(f"{YELLOW}[*] MAC changing disabled{RESET}")
-            time.sleep(2)
+            pause(2)
             return
         elif choice == "4":
+            names = input(f"{YELLOW}Enter interfaces separated by spaces, patterns like wlan* or * allowed "
+                          f"(empty for {DEFAULT_INTERFACE} only): {RESET}")
+            MAC_INTERFACES = names.split() or None
+            print(f"{GREEN}[✓] Rotating: {BLUE}{', '.join(discover_interfaces())}{RESET}")
+            pause(2)
+        elif choice == "5":
             return 'back'
         else:
             print(f"{RED}[!] Invalid choice{RESET}")
-            time.sleep(1)
+            pause(1)
+
+_LOG_STOP = object()
+
+class LogWriter:
+    """Buffered background writer for the JSON lines log with rotation
+
+    The file stays open and entries are written from a worker thread, then
+    flushed (and optionally fsynced) per LOG_FSYNC. The file is rotated by
+    size or age; rotated segments are optionally gzipped and pruned to
+    LOG_BACKUP_COUNT.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.Queue()
+        self._file = None
+        self._opened_at = 0.0
+        self._last_flush = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, entry):
+        """Queue one log entry (dict) for writing"""
+        self._queue.put(json.dumps(entry) + "\n")
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far is written and flushed"""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=None):
+        """Flush remaining entries and close the file"""
+        self._queue.put(_LOG_STOP)
+        self._thread.join(timeout)
+
+    def _open(self):
+        self._file = open(self.path, 'a', buffering=64 * 1024)
+        # Appending to an existing file: its age carries over, so LOG_ROTATE_INTERVAL holds across restarts
+        self._opened_at = self._started_at() if self._file.tell() else time.time()
+
+    def _started_at(self):
+        """When the existing file was started: its first entry's timestamp, else its modification time"""
+        try:
+            with open(self.path) as f:
+                first = json.loads(f.readline())
+            return datetime.strptime(first['timestamp'], "%Y-%m-%d %H:%M:%S").timestamp()
+        except (ValueError, KeyError, TypeError):
+            return os.path.getmtime(self.path)
+
+    def _flush(self, fsync):
+        if self._file is None:
+            return
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+        self._last_flush = time.monotonic()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=LOG_FLUSH_INTERVAL)
+            except queue.Empty:
+                item = None
+
+            try:
+                if item is _LOG_STOP:
+                    self._flush(LOG_FSYNC != 'never')
+                    if self._file is not None:
+                        self._file.close()
+                        self._file = None
+                    return
+                if isinstance(item, threading.Event):
+                    self._flush(LOG_FSYNC != 'never')
+                    item.set()
+                    continue
+                if item is not None:
+                    if self._file is None:
+                        self._open()
+                    self._file.write(item)
+                    if LOG_FSYNC == 'always':
+                        self._flush(True)
+                    self._maybe_rotate()
+                if time.monotonic() - self._last_flush >= LOG_FLUSH_INTERVAL:
+                    self._flush(LOG_FSYNC == 'interval')
+            except Exception as e:
+                print(f"{RED}[!] Failed to write to log file: {str(e)}{RESET}")
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def _maybe_rotate(self):
+        too_big = LOG_ROTATE_BYTES and self._file.tell() >= LOG_ROTATE_BYTES
+        too_old = LOG_ROTATE_INTERVAL and time.time() - self._opened_at >= LOG_ROTATE_INTERVAL
+        if too_big or too_old:
+            self.rotate()
+
+    def rotate(self):
+        """Close the current file and move it aside as a timestamped segment"""
+        self._flush(LOG_FSYNC != 'never')
+        self._file.close()
+        self._file = None
+
+        segment = f"{self.path}.{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        suffix = 1
+        while os.path.exists(segment) or os.path.exists(segment + '.gz'):
+            segment = f"{self.path}.{datetime.now().strftime('%Y%m%d-%H%M%S')}-{suffix}"
+            suffix += 1
+        os.replace(self.path, segment)
+
+        if LOG_ROTATE_COMPRESS:
+            # Compress off the writer thread so logging is not held up
+            threading.Thread(target=self._compress, args=(segment,), daemon=False).start()
+        else:
+            self._prune()
+
+    def _compress(self, segment):
+        try:
+            with open(segment, 'rb') as src, gzip.open(segment + '.gz.tmp', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(segment + '.gz.tmp', segment + '.gz')
+            os.remove(segment)
+        except Exception as e:
+            print(f"{RED}[!] Failed to compress log segment {segment}: {str(e)}{RESET}")
+        self._prune()
 
-def log_ip_change(old_ip, old_country, old_city, new_ip, new_country, new_city, old_mac=None, new_mac=None):
-    """Log IP change to file"""
-    if not LOG_ENABLED:
+    def _prune(self):
+        if not LOG_BACKUP_COUNT:
+            return
+        segments = [path for path in glob.glob(glob.escape(self.path) + '.[0-9]*') if not path.endswith('.tmp')]
+        segments.sort(key=os.path.getmtime)
+        for path in segments[:-LOG_BACKUP_COUNT]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+_log_writer = None
+_log_writer_lock = threading.Lock()
+
+def get_log_writer():
+    """Return the background writer for the current LOG_FILE"""
+    global _log_writer
+
+    with _log_writer_lock:
+        if _log_writer is None or _log_writer.path != LOG_FILE:
+            if _log_writer is not None:
+                _log_writer.close()
+            _log_writer = LogWriter(LOG_FILE)
+        return _log_writer
+
+def flush_log(timeout=LOG_CLOSE_TIMEOUT):
+    """Make sure buffered log entries have reached the file"""
+    with _log_writer_lock:
+        writer = _log_writer
+    if writer is not None:
+        writer.flush(timeout)
+
+def close_log_writer():
+    """Flush and close the log file on shutdown"""
+    global _log_writer
+
+    with _log_writer_lock:
+        if _log_writer is not None:
+            _log_writer.close(LOG_CLOSE_TIMEOUT)
+            _log_writer = None
+
+atexit.register(close_log_writer)
+
+def log_ip_change(old_ip, old_country, old_city, new_ip, new_country, new_city, old_mac=None, new_mac=None,
+                  mac_changed=None, interfaces=None, probe=None, rerolls=0, repeated=None, target_country=None,
+                  schedule=None, writer=None, timings=None):
+    """Log IP change to file, or to writer (a LogWriter) regardless of LOG_ENABLED"""
+    if writer is None and not LOG_ENABLED:
         return
     
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -629,63 +4110,227 @@ def log_ip_change(old_ip, old_country, old_city, new_ip, new_country, new_city,
             "new_mac": new_mac
         })
     
-    try:
-        with open(LOG_FILE, 'a') as f:
-            f.write(json.dumps(log_entry) + "\n")
-    except Exception as e:
-        print(f"{RED}[!] Failed to write to log file: {str(e)}{RESET}")
+    if mac_changed is not None:
+        log_entry["mac_changed"] = mac_changed
+    
+    if interfaces:
+        log_entry["interfaces"] = interfaces
+    
+    if probe:
+        log_entry["probe"] = dict(probe, rerolls=rerolls)
+    
+    if repeated is not None:
+        log_entry["repeated_exit"] = repeated
+    
+    if target_country:
+        log_entry["target_country"] = target_country
+    
+    if schedule and 'late' in schedule:
+        log_entry["schedule_late"] = schedule['late']
+    
+    if timings:
+        log_entry["timings"] = timings
+    
+    (writer or get_log_writer()).write(log_entry)
 
-def change_ip_loop():
-    """Main loop for changing IP addresses"""
-    try:
-        interval = input(f"{YELLOW}[*] Enter interval in seconds (default {GREEN}30{YELLOW}, 'b' to go back): {RESET}").strip()
-        if interval.lower() == 'b':
-            return 'back'
-        interval = int(interval) if interval else 30
-    except:
-        interval = 30
+def log_tor_status(ready, status, elapsed):
+    """Log the outcome of waiting for tor to bootstrap"""
+    if not LOG_ENABLED:
+        return
+    
+    get_log_writer().write({
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "event": "tor_ready" if ready else "tor_not_ready",
+        "bootstrap_progress": status['progress'],
+        "bootstrap_summary": status['summary'],
+        "circuit_established": status['circuit_established'],
+        "elapsed": round(elapsed, 3)
+    })
 
-    print(f"\n{GREEN}[+] Starting with interval: {YELLOW}{interval} seconds{RESET}\n")
+_STAGE_STOP = object()
 
-    while True:
-        # Get current state
-        old_ip = get_ip()
-        old_country, old_city = get_location_for_ip(old_ip)
-        old_mac = get_current_mac() if MAC_CHANGE_ENABLED else None
-        
-        # Change IP
-        change_tor_ip()
-        time.sleep(10)  # Wait for IP to change
-        
-        # Change MAC if enabled
-        new_mac = None
-        if MAC_CHANGE_ENABLED:
-            if change_mac_address():
-                new_mac = get_current_mac()
-            else:
-                print(f"{RED}[!] MAC address change failed, continuing with IP change only{RESET}")
-        
-        # Get new state
-        new_ip = get_ip()
-        new_country, new_city = get_location_for_ip(new_ip)
-        
-        # Log the change
-        log_ip_change(old_ip, old_country, old_city, new_ip, new_country, new_city, old_mac, new_mac)
+class PipelineStage:
+    """Worker thread running one downstream step of the rotation pipeline
 
-        # Prepare messages
-        screen_msg = f"""
-{GREEN}[+] {GREEN}Identity Changed Successfully!{RESET}
-{GREEN}[+]{RESET} Old IP: {BLUE}{old_ip}{RESET} — Country: {BLUE}{old_country}{RESET} — City: {BLUE}{old_city}{RESET}
-{GREEN}[+]{RESET} New IP: {BLUE}{new_ip}{RESET} — Country: {BLUE}{new_country}{RESET} — City: {BLUE}{new_city}{RESET}
-"""
+    Events wait in a bounded queue. When the stage falls behind, the overflow
+    policy either blocks the producer or drops events. The handler runs on
+    one daemon thread per stage; if it overruns its timeout that thread is
+    abandoned (it exits once the call returns) and a fresh one takes over,
+    so the stage keeps moving and never holds up exit.
+    """
 
-        if MAC_CHANGE_ENABLED and old_mac and new_mac:
-            screen_msg += f"""
-{GREEN}[+]{RESET} Old MAC: {BLUE}{old_mac}{RESET}
-{GREEN}[+]{RESET} New MAC: {BLUE}{new_mac}{RESET}
-"""
+    def __init__(self, name, handler, timeout=None, queue_size=None, overflow=None):
+        self.name = name
+        self.handler = handler
+        self.timeout = timeout
+        self.overflow = overflow or PIPELINE_OVERFLOW
+        self.downstream = []
+        self.dropped = 0
+        self.timed_out = 0
+        self._queue = queue.Queue(maxsize=queue_size or PIPELINE_QUEUE_SIZE)
+        self._thread = None
+        self._handler = None  # (thread, inbox, outbox) running self.handler
+
+    def then(self, *stages):
+        """Feed this stage's results to the given stages"""
+        self.downstream.extend(stages)
+        return self
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"pipeline-{self.name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, event):
+        """Queue an event, applying the overflow policy if the stage is full"""
+        if self.overflow == 'block':
+            self._queue.put(event)
+            return
+
+        while True:
+            try:
+                self._queue.put_nowait(event)
+                return
+            except queue.Full:
+                self.dropped += 1
+                if self.overflow == 'drop_newest':
+                    return
+                try:
+                    self._queue.get_nowait()  # drop_oldest
+                except queue.Empty:
+                    pass
+
+    def _run(self):
+        while True:
+            event = self._queue.get()
+            if event is _STAGE_STOP:
+                return
+            result = self._process(event)
+            for stage in self.downstream:
+                stage.submit(result)
+
+    def _start_handler(self):
+        inbox, outbox = queue.Queue(), queue.Queue()
+
+        def serve():
+            while True:
+                event = inbox.get()
+                if event is _STAGE_STOP:
+                    return
+                try:
+                    outbox.put(('result', self.handler(event)))
+                except Exception as e:
+                    outbox.put(('error', e))
+
+        thread = threading.Thread(target=serve, name=f"pipeline-{self.name}-handler", daemon=True)
+        thread.start()
+        self._handler = (thread, inbox, outbox)
+
+    def _stop_handler(self):
+        if self._handler is not None:
+            self._handler[1].put(_STAGE_STOP)
+            self._handler = None
+
+    def _process(self, event):
+        """Run the handler on a copy; on failure pass the event on unchanged"""
+        if self._handler is None:
+            self._start_handler()
+        _, inbox, outbox = self._handler
+        inbox.put(dict(event))
+        try:
+            kind, value = outbox.get(timeout=self.timeout)
+        except queue.Empty:
+            # Leave the hung call behind; its thread exits once it returns
+            self._stop_handler()
+            self.timed_out += 1
+            print(f"{RED}[!] Pipeline stage '{self.name}' timed out after {self.timeout} seconds{RESET}")
+            return event
+        if kind == 'error':
+            print(f"{RED}[!] Pipeline stage '{self.name}' failed: {str(value)}{RESET}")
+        elif value is not None:
+            return value
+        return event
+
+    def stop(self, timeout=None):
+        """Finish queued events, then stop the worker"""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(_STAGE_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+        self._stop_handler()
+
+class RotationPipeline:
+    """Downstream stages fed by change_ip_loop after every rotation
+
+    enrich (geolocation) fans out to log, notify and display, so none of
+    them can delay the next NEWNYM. The MAC change is not a stage: it runs
+    in the rotation loop, so dropped or timed out events never skip or
+    overlap one.
+    """
+
+    def __init__(self, display=True):
+        timeouts = PIPELINE_STAGE_TIMEOUTS
+        self.enrich = PipelineStage('enrich', enrich_rotation, timeouts.get('enrich'))
+        sinks = [
+            PipelineStage('log', record_rotation, timeouts.get('log')),
+            PipelineStage('notify', notify_rotation, timeouts.get('notify'))
+        ]
+        if display:
+            sinks.append(PipelineStage('display', display_rotation, timeouts.get('display')))
+        self.enrich.then(*sinks)
+        self.stages = [self.enrich] + sinks
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+        return self
+
+    def submit(self, event):
+        self.enrich.submit(event)
+
+    def stop(self, timeout=PIPELINE_DRAIN_TIMEOUT):
+        """Drain every stage in order: enrich first, then the sinks it feeds"""
+        for stage in self.stages:
+            stage.stop(timeout)
 
-        telegram_msg = f"""
+def change_rotation_mac():
+    """Change MAC addresses for a rotation; returns (old_mac, new_mac, mac_changed, interfaces)"""
+    results = rotate_mac_addresses()
+    if not results:
+        return None, None, None, None
+    primary = results[next(iter(results))]
+    changed = all(result['ok'] for result in results.values())
+    if not changed:
+        print(f"{RED}[!] MAC address change failed, continuing with IP change only{RESET}")
+    return primary['old_mac'], primary['new_mac'], changed, results if len(results) > 1 else None
+
+def enrich_rotation(event):
+    """Pipeline stage: geolocate both IPs"""
+    with metrics.breakdown() as timings:
+        with metrics.phase('geo'):
+            event['old_country'], event['old_city'] = locate_identity(event['old_ip'], event['old_country_code'])
+            event['new_country'], event['new_city'] = locate_identity(event['new_ip'], event['new_country_code'])
+    event['timings'] = dict(event.get('timings') or {}, **timings)
+    return event
+
+def record_rotation(event):
+    """Pipeline stage: write the rotation to the log file"""
+    log_ip_change(event['old_ip'], event['old_country'], event['old_city'],
+                  event['new_ip'], event['new_country'], event['new_city'],
+                  event['old_mac'], event['new_mac'], event['mac_changed'], event['interfaces'],
+                  event['probe'], event['rerolls'], event['repeated'], event['target_country'],
+                  event['schedule'], timings=event.get('timings'))
+
+def notify_rotation(event):
+    """Pipeline stage: send the rotation to Telegram"""
+    old_ip, old_country, old_city = event['old_ip'], event['old_country'], event['old_city']
+    new_ip, new_country, new_city = event['new_ip'], event['new_country'], event['new_city']
+    old_mac, new_mac = event['old_mac'], event['new_mac']
+
+    telegram_msg = f"""
 🔔 <b>YOUR IDENTITY CHANGED SUCCESSFULLY!</b>
 
 <b>Old IP:</b> <code>{old_ip}</code>
@@ -697,37 +4342,325 @@ def change_ip_loop():
 <b>City:</b> {new_city}
 """
 
-        if MAC_CHANGE_ENABLED and old_mac and new_mac:
-            telegram_msg += f"""
+    if event['mac_enabled'] and old_mac and new_mac:
+        telegram_msg += f"""
 <b>Old MAC:</b> <code>{old_mac}</code>
 <b>New MAC:</b> <code>{new_mac}</code>
 """
 
-        telegram_msg += f"""
-<i>Next change in {interval} seconds...</i>
+    telegram_msg += f"""
+<i>Next change in {event['interval']} seconds...</i>
 """
 
-        # Display on screen
-        clear_screen()
-        print_banner()
-        
-        # Display country chain in box
-        print_country_chain()
-        
-        # Display IP details
-        print("\n" + screen_msg)
-        
-        print(f"\n{YELLOW}[*] Next change in {interval} seconds (Ctrl+C to stop){RESET}")
-        
-        # Send to Telegram
-        send_telegram_notification(telegram_msg)
-        
-        try:
-            time.sleep(interval)
-        except KeyboardInterrupt:
-            print(f"\n{RED}[!] Stopping IP changer...{RESET}")
-            time.sleep(2)
+    send_telegram_notification(telegram_msg)
+
+def display_rotation(event):
+    """Pipeline stage: redraw the loop screen"""
+    old_ip, old_country, old_city = event['old_ip'], event['old_country'], event['old_city']
+    new_ip, new_country, new_city = event['new_ip'], event['new_country'], event['new_city']
+    old_mac, new_mac = event['old_mac'], event['new_mac']
+
+    screen_msg = f"""
+{GREEN}[+] {GREEN}Identity Changed Successfully!{RESET}
+{GREEN}[+]{RESET} Old IP: {BLUE}{old_ip}{RESET} — Country: {BLUE}{old_country}{RESET} — City: {BLUE}{old_city}{RESET}
+{GREEN}[+]{RESET} New IP: {BLUE}{new_ip}{RESET} — Country: {BLUE}{new_country}{RESET} — City: {BLUE}{new_city}{RESET}
+"""
+
+    if PROBE_ENABLED:
+        rerolls = f" — re-rolled {event['rerolls']}x" if event['rerolls'] else ""
+        color = GREEN if probe_passed(event['probe']) else RED
+        screen_msg += f"{GREEN}[+]{RESET} Circuit: {color}{format_probe(event['probe'])}{RESET}{rerolls}\n"
+
+    if event['target_country']:
+        target = event['target_country']
+        hit = event['new_country_code'] == target or event['new_country'] == COUNTRY_NAMES.get(target, target)
+        color = GREEN if hit else RED
+        screen_msg += f"{GREEN}[+]{RESET} Target country: {color}{event['target_country']}{RESET}\n"
+
+    if EXIT_AVOID_REPEATS:
+        color = RED if event['repeated'] else GREEN
+        screen_msg += (f"{GREEN}[+]{RESET} Exit repeat rate: {color}{exit_index.repeat_rate():.1%}{RESET}"
+                       f" — {BLUE}{exit_index.avoided}{RESET} repeats re-rolled\n")
+
+    schedule = event['schedule']
+    if schedule.get('rotations', 0) > 1:
+        skipped = f" — {schedule['skipped']} skipped" if schedule['skipped'] else ""
+        screen_msg += (f"{GREEN}[+]{RESET} Schedule: started {BLUE}{schedule['late']:+.2f} s{RESET} vs plan"
+                       f" (avg {schedule['late_avg']:+.2f}, p95 {schedule['late_p95']:+.2f}, "
+                       f"max {schedule['late_max']:+.2f}){skipped}\n")
+
+    if event['mac_enabled'] and old_mac and new_mac:
+        screen_msg += f"""
+{GREEN}[+]{RESET} Old MAC: {BLUE}{old_mac}{RESET}
+{GREEN}[+]{RESET} New MAC: {BLUE}{new_mac}{RESET}
+"""
+
+    # Display on screen
+    clear_screen()
+    print_banner()
+    
+    # Display country chain in box
+    print_country_chain()
+    
+    # Display IP details
+    print("\n" + screen_msg)
+    
+    print(f"\n{YELLOW}[*] Next change in {event['interval']} seconds (Ctrl+C to stop){RESET}")
+
+class CronSchedule:
+    """Minimal five-field cron expression: minute hour day-of-month month day-of-week
+
+    Fields take '*', numbers, ranges ('1-5'), steps ('*/15', '0-30/10') and
+    comma separated lists of those. Day-of-week is 0-6 with Sunday as 0 (7
+    also works); when both day fields are restricted either one matching is
+    enough, as in cron.
+    """
+
+    RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"expected 5 cron fields, got {len(fields)}: {expression!r}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse(field, low, high) for field, (low, high) in zip(fields, self.RANGES))
+        if 7 in self.weekdays:
+            self.weekdays.add(0)
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    @staticmethod
+    def _parse(field, low, high):
+        values = set()
+        for part in field.split(','):
+            spec, _, step = part.partition('/')
+            if spec == '*':
+                start, end = low, high
+            elif '-' in spec:
+                start, end = (int(value) for value in spec.split('-', 1))
+            else:
+                start = int(spec)
+                end = high if step else start
+            if not low <= start <= end <= high:
+                raise ValueError(f"cron field {field!r} out of range {low}-{high}")
+            values.update(range(start, end + 1, int(step) if step else 1))
+        return values
+
+    def _day_matches(self, moment):
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, moment):
+        """Return the first matching minute strictly after moment"""
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 5)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError(f"cron expression {self.expression!r} never matches")
+
+class RotationScheduler:
+    """Plans rotations against fixed deadlines on the monotonic clock
+
+    Slots sit on a grid (start + n * interval, or the cron schedule), so
+    the time a rotation takes never pushes the next one back. Jitter moves
+    each rotation around its slot without shifting the grid. When a
+    rotation overruns its next slot, 'catch_up' runs the missed slots back
+    to back (at most ROTATION_MAX_CATCH_UP of them) and 'skip' drops them;
+    cron slots missed by an overrun are always skipped.
+    With adaptive scheduling every rotation whose circuit still failed the
+    quality probe shortens the next interval by ROTATION_ADAPTIVE_FACTOR,
+    down to ROTATION_MIN_INTERVAL; a good circuit restores it.
+    """
+
+    def __init__(self, interval, jitter=None, overrun=None, cron=None, adaptive=None):
+        self.interval = interval
+        self.jitter = ROTATION_JITTER if jitter is None else jitter
+        self.overrun = overrun or ROTATION_OVERRUN
+        self.cron = CronSchedule(cron) if cron else None
+        self.adaptive = ROTATION_ADAPTIVE if adaptive is None else adaptive
+        self.degraded = 0
+        self.rotations = 0
+        self.skipped = 0
+        self.lateness = deque(maxlen=1000)
+        self.last_late = 0.0
+        self._slot = self._planned = time.monotonic()
+
+    def current_interval(self):
+        if self.adaptive and self.degraded:
+            return max(ROTATION_MIN_INTERVAL, self.interval * ROTATION_ADAPTIVE_FACTOR ** self.degraded)
+        return self.interval
+
+    def begin(self):
+        """Mark the start of a rotation and record how late it is against its plan"""
+        self.last_late = time.monotonic() - self._planned
+        self.lateness.append(self.last_late)
+        self.rotations += 1
+
+    def feedback(self, probe):
+        """Adapt to the quality of the circuit the rotation ended up with"""
+        if probe is None and not PROBE_ENABLED:
             return
+        self.degraded = 0 if probe_passed(probe) else self.degraded + 1
+
+    def _next_cron_slot(self, now):
+        # Cron slots are wall clock times; the wait until the next one is measured monotonically
+        wall = datetime.now()
+        return now + (self.cron.next_after(wall) - wall).total_seconds()
+
+    def plan(self):
+        """Fix the next deadline; returns the seconds until it"""
+        now = time.monotonic()
+        if self.cron:
+            slot = self._next_cron_slot(now)
+            spacing = slot - now
+        else:
+            spacing = self.current_interval()
+            slot = self._slot + spacing
+            if slot < now:
+                missed = int((now - slot) // spacing) + 1
+                if self.overrun == 'skip' or missed > ROTATION_MAX_CATCH_UP:
+                    slot += missed * spacing
+                    self.skipped += missed
+        self._slot = slot
+
+        jitter = random.uniform(-1, 1) * min(self.jitter, spacing / 2) if self.jitter else 0.0
+        self._planned = slot + jitter
+        return max(0.0, self._planned - now)
+
+    def wait(self, stop=None):
+        """Sleep until the planned deadline, or until stop is set; returns whether it was"""
+        remaining = self._planned - time.monotonic()
+        if stop is not None:
+            return stop.wait(max(0.0, remaining))
+        if remaining > 0:
+            time.sleep(remaining)
+        return False
+
+    def stats(self):
+        """Actual versus planned start times, in seconds"""
+        lateness = sorted(self.lateness)
+        if not lateness:
+            return {'rotations': 0, 'skipped': self.skipped}
+        return {
+            'rotations': self.rotations,
+            'skipped': self.skipped,
+            'late': round(self.last_late, 3),
+            'late_avg': round(sum(lateness) / len(lateness), 3),
+            'late_p95': round(lateness[int(0.95 * (len(lateness) - 1))], 3),
+            'late_max': round(lateness[-1], 3)
+        }
+
+def change_ip_loop():
+    """Main loop for changing IP addresses"""
+    try:
+        interval = input(f"{YELLOW}[*] Enter interval in seconds (default {GREEN}30{YELLOW}, 'b' to go back): {RESET}").strip()
+        if interval.lower() == 'b':
+            return 'back'
+        interval = int(interval) if interval else 30
+    except:
+        interval = 30
+
+    try:
+        scheduler = RotationScheduler(interval, cron=ROTATION_CRON)
+    except ValueError as e:
+        print(f"{RED}[!] Invalid schedule: {str(e)}{RESET}")
+        return 'back'
+
+    if scheduler.cron:
+        print(f"\n{GREEN}[+] Starting with schedule: {YELLOW}{scheduler.cron.expression}{RESET}\n")
+    else:
+        print(f"\n{GREEN}[+] Starting with interval: {YELLOW}{interval} seconds{RESET}\n")
+
+    # Geo, logging, Telegram and the screen run as pipeline stages; the loop
+    # itself only signals tor, confirms the new circuit and changes the MAC
+    pipeline = RotationPipeline().start()
+
+    try:
+        run_rotations(scheduler, pipeline)
+    except KeyboardInterrupt:
+        print(f"\n{RED}[!] Stopping IP changer...{RESET}")
+        pause(2)
+        return
+    finally:
+        # Runs on Ctrl+C and on any error: drain the stages, then flush the log
+        pipeline.stop()
+        flush_log()
+
+def run_rotations(scheduler, pipeline, stop=None, on_rotation=None):
+    """Rotate on the scheduler's deadlines, feeding each rotation to the pipeline
+
+    Runs until stop (a threading.Event) is set, or forever without one.
+    on_rotation is called with each event once it is submitted.
+    """
+    schedule = start_country_schedule()
+
+    try:
+        # Get current state; afterwards the old identity is the previous new one
+        old_ip, old_country_code = resolve_exit_ip()
+        exit_index.add(old_ip, exit_country_code(old_ip, old_country_code))
+
+        while stop is None or not stop.is_set():
+            # Change IP, in the scheduled country if there is a schedule
+            scheduler.begin()
+            target_country = schedule.next(exit_country_index) if schedule else None
+            with metrics.breakdown() as timings:
+                with metrics.phase('rotation'):
+                    new_ip, new_country_code, probe, rerolls, repeated = rotate_identity(target_country)
+                # In the loop rather than a stage: dropped or timed out events must not skip or overlap a change
+                old_mac = new_mac = mac_changed = interfaces = None
+                if MAC_CHANGE_ENABLED:
+                    with metrics.phase('mac'):
+                        old_mac, new_mac, mac_changed, interfaces = change_rotation_mac()
+            scheduler.feedback(probe)
+            next_in = scheduler.plan()
+
+            event = {
+                'old_ip': old_ip,
+                'old_country_code': old_country_code,
+                'new_ip': new_ip,
+                'new_country_code': new_country_code,
+                # Filled in by enrich; kept if it fails or times out
+                'old_country': "Not Defined",
+                'old_city': "Not Defined",
+                'new_country': "Not Defined",
+                'new_city': "Not Defined",
+                'probe': probe,
+                'rerolls': rerolls,
+                'repeated': repeated,
+                'target_country': target_country,
+                'mac_enabled': MAC_CHANGE_ENABLED,
+                'old_mac': old_mac,
+                'new_mac': new_mac,
+                'mac_changed': mac_changed,
+                'interfaces': interfaces,
+                'interval': round(next_in),
+                'schedule': scheduler.stats(),
+                'timings': timings
+            }
+            pipeline.submit(event)
+            export_metrics()  # Here rather than in a stage, which may be dropped or time out
+            if on_rotation:
+                on_rotation(event)
+            old_ip, old_country_code = new_ip, new_country_code
+
+            if scheduler.wait(stop):
+                break
+    finally:
+        if schedule:
+            clear_exit_target()
 
 def show_darkweb_links():
     """Display dark web links"""
@@ -737,6 +4670,515 @@ def show_darkweb_links():
     print(f"\n{YELLOW}Note: You need to be connected to Tor network to access these links.{RESET}")
     input(f"\n{YELLOW}Press Enter to return to main menu...{RESET}")
 
+# Upper bounds (seconds) of the rotation interval histogram buckets
+ANALYTICS_INTERVAL_BUCKETS = (1, 2, 5, 10, 15, 30, 60, 120, 300, 600, 1800, 3600, 21600, 86400, float('inf'))
+ANALYTICS_CHUNK_BYTES = 64 * 1024 * 1024  # Plain logs larger than this are split across workers
+
+def find_log_segments(path):
+    """Return a log file and its rotated segments, oldest first"""
+    segments = [p for p in glob.glob(glob.escape(path) + '.[0-9]*') if not p.endswith('.tmp')]
+    segments.sort(key=os.path.getmtime)
+    if os.path.exists(path):
+        segments.append(path)
+    return segments
+
+def _empty_log_stats():
+    return {
+        'entries': 0,
+        'invalid': 0,
+        'countries': {},
+        'repeat_ip': 0,
+        'mac_attempts': 0,
+        'mac_changed': 0,
+        'intervals': [0] * len(ANALYTICS_INTERVAL_BUCKETS),
+        'interval_count': 0,
+        'interval_sum': 0.0,
+        'interval_min': None,
+        'interval_max': None,
+        'first': None,
+        'last': None
+    }
+
+def _add_interval(stats, seconds):
+    stats['intervals'][bisect.bisect_left(ANALYTICS_INTERVAL_BUCKETS, seconds)] += 1
+    stats['interval_count'] += 1
+    stats['interval_sum'] += seconds
+    if stats['interval_min'] is None or seconds < stats['interval_min']:
+        stats['interval_min'] = seconds
+    if stats['interval_max'] is None or seconds > stats['interval_max']:
+        stats['interval_max'] = seconds
+
+def _iter_log_lines(path, start=0, end=None):
+    """Yield raw lines of a segment, memory-mapping plain files"""
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            yield from f
+        return
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if start:
+                # Chunks start on the line following their offset
+                mm.seek(start - 1)
+                mm.readline()
+            end = len(mm) if end is None else end
+            while mm.tell() < end:
+                line = mm.readline()
+                if not line:
+                    break
+                yield line
+
+def analyze_log_segment(path, start=0, end=None):
+    """Aggregate one log segment (or byte range of it) in a single pass"""
+    stats = _empty_log_stats()
+    previous = None
+
+    for line in _iter_log_lines(path, start, end):
+        try:
+            entry = json.loads(line)
+            timestamp = datetime.fromisoformat(entry['timestamp'])
+        except Exception:
+            stats['invalid'] += 1
+            continue
+        if 'event' in entry:
+            continue  # Tor status records, not rotations
+
+        stats['entries'] += 1
+        country = entry.get('new_country') or "Not Defined"
+        stats['countries'][country] = stats['countries'].get(country, 0) + 1
+        if entry.get('new_ip') and entry.get('new_ip') == entry.get('old_ip'):
+            stats['repeat_ip'] += 1
+
+        if 'mac_changed' in entry:
+            stats['mac_attempts'] += 1
+            stats['mac_changed'] += bool(entry['mac_changed'])
+        elif entry.get('new_mac'):
+            # Older logs only recorded successful MAC changes
+            stats['mac_attempts'] += 1
+            stats['mac_changed'] += entry['new_mac'] != entry.get('old_mac')
+
+        if previous is not None:
+            _add_interval(stats, (timestamp - previous).total_seconds())
+        if stats['first'] is None:
+            stats['first'] = entry['timestamp']
+        stats['last'] = entry['timestamp']
+        previous = timestamp
+
+    return stats
+
+def merge_log_stats(parts):
+    """Combine per-segment aggregates, stitching intervals across segment borders"""
+    total = _empty_log_stats()
+    parts = sorted((p for p in parts if p['entries'] or p['invalid']), key=lambda p: p['first'] or '')
+
+    for part in parts:
+        if part['first'] is not None:
+            if total['last'] is not None:
+                gap = datetime.fromisoformat(part['first']) - datetime.fromisoformat(total['last'])
+                _add_interval(total, gap.total_seconds())
+            if total['first'] is None:
+                total['first'] = part['first']
+            total['last'] = part['last']
+
+        for key in ('entries', 'invalid', 'repeat_ip', 'mac_attempts', 'mac_changed', 'interval_count', 'interval_sum'):
+            total[key] += part[key]
+        for country, count in part['countries'].items():
+            total['countries'][country] = total['countries'].get(country, 0) + count
+        total['intervals'] = [a + b for a, b in zip(total['intervals'], part['intervals'])]
+        for key, pick in (('interval_min', min), ('interval_max', max)):
+            if part[key] is not None:
+                total[key] = part[key] if total[key] is None else pick(total[key], part[key])
+
+    return total
+
+def analyze_logs(paths, workers=None):
+    """Aggregate log segments, in parallel across segments and large chunks"""
+    jobs = []
+    for path in paths:
+        size = os.path.getsize(path)
+        if path.endswith('.gz') or size <= ANALYTICS_CHUNK_BYTES:
+            jobs.append((path, 0, None))
+        else:
+            for start in range(0, size, ANALYTICS_CHUNK_BYTES):
+                jobs.append((path, start, min(start + ANALYTICS_CHUNK_BYTES, size)))
+
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        parts = [analyze_log_segment(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(analyze_log_segment, *zip(*jobs)))
+
+    stats = merge_log_stats(parts)
+    stats['segments'] = len(paths)
+    return stats
+
+def _interval_percentile(stats, fraction):
+    """Approximate a percentile as the upper bound of its histogram bucket"""
+    target = fraction * stats['interval_count']
+    seen = 0
+    for bound, count in zip(ANALYTICS_INTERVAL_BUCKETS, stats['intervals']):
+        seen += count
+        if seen >= target and count:
+            return min(bound, stats['interval_max'])
+    return stats['interval_max']
+
+def print_log_analytics(stats):
+    """Display aggregated log statistics"""
+    entries = stats['entries']
+    print(f"\n{GREEN}[+] Entries: {BLUE}{entries}{RESET} across {BLUE}{stats['segments']}{RESET} segment(s)", end="")
+    print(f" ({RED}{stats['invalid']} invalid{RESET})" if stats['invalid'] else "")
+    if not entries:
+        return
+    print(f"{GREEN}[+] Period: {BLUE}{stats['first']}{RESET} → {BLUE}{stats['last']}{RESET}")
+    repeat_rate = 100.0 * stats['repeat_ip'] / entries
+    print(f"{GREEN}[+] Repeat IP rate: {BLUE}{repeat_rate:.2f}%{RESET} ({stats['repeat_ip']} rotations kept the same IP)")
+    if stats['mac_attempts']:
+        rate = 100.0 * stats['mac_changed'] / stats['mac_attempts']
+        print(f"{GREEN}[+] MAC change success rate: {BLUE}{rate:.2f}%{RESET} ({stats['mac_changed']}/{stats['mac_attempts']})")
+
+    print(f"\n{YELLOW}[*] Exit countries:{RESET}")
+    for country, count in sorted(stats['countries'].items(), key=lambda item: -item[1]):
+        print(f"    {CYAN}{country:<32}{RESET} {count:>10}  {100.0 * count / entries:6.2f}%")
+
+    if stats['interval_count']:
+        average = stats['interval_sum'] / stats['interval_count']
+        print(f"\n{YELLOW}[*] Rotation interval / identity lifetime (seconds):{RESET}")
+        print(f"    min {stats['interval_min']:.0f}  avg {average:.1f}  max {stats['interval_max']:.0f}  "
+              f"p50 ≤{_interval_percentile(stats, 0.5):.0f}  p90 ≤{_interval_percentile(stats, 0.9):.0f}  "
+              f"p99 ≤{_interval_percentile(stats, 0.99):.0f}")
+        widest = max(stats['intervals'])
+        for bound, count in zip(ANALYTICS_INTERVAL_BUCKETS, stats['intervals']):
+            if count:
+                label = "> 86400" if bound == float('inf') else f"≤ {bound}"
+                print(f"    {label:>8} {MAGENTA}{'█' * max(1, round(40 * count / widest))}{RESET} {count}")
+
+def run_analytics(paths=None, workers=None, as_json=False):
+    """Analytics subcommand: summarise the JSON lines identity log"""
+    if not paths:
+        paths = find_log_segments(LOG_FILE)
+    else:
+        paths = [segment for path in paths for segment in (find_log_segments(path) or [path])]
+    paths = [path for path in paths if os.path.exists(path)]
+    if not paths:
+        print(f"{RED}[!] No log files found{RESET}")
+        return 1
+
+    stats = analyze_logs(paths, workers)
+    if as_json:
+        print(json.dumps(stats, indent=2))
+    else:
+        print_log_analytics(stats)
+    return 0
+
+DAEMON_SETTINGS = (
+    'socks_port', 'control_port', 'control_socket', 'control_password', 'pool',
+    'interval', 'cron', 'jitter', 'overrun', 'adaptive', 'probe', 'countries', 'country_mode',
+    'mac', 'mac_address', 'mac_interfaces', 'log_file', 'telegram_token', 'telegram_chat_id',
+    'metrics_port', 'metrics_textfile', 'probe_url'
+)
+
+def load_daemon_settings(config_path=None, overrides=None):
+    """Merge the JSON settings file with command line overrides (None values are ignored)"""
+    settings = {}
+    if config_path:
+        with open(config_path, 'r') as f:
+            loaded = json.load(f)
+        if not isinstance(loaded, dict):
+            raise ValueError(f"{config_path} must hold a JSON object")
+        settings = {key.replace('-', '_'): value for key, value in loaded.items()}
+    settings.update((key, value) for key, value in (overrides or {}).items() if value is not None)
+
+    unknown = sorted(set(settings) - set(DAEMON_SETTINGS))
+    if unknown:
+        raise ValueError(f"unknown setting(s): {', '.join(unknown)}")
+    return settings
+
+def apply_daemon_settings(settings, reload=False):
+    """Validate settings, then apply them to the configuration; returns the interval
+
+    Nothing is changed if a setting is invalid, so a bad reload keeps the
+    running configuration. On reload, settings that only take effect at
+    start-up (the pool size, the metrics port, and the tor endpoints while a
+    pool owns them) keep their running values and are reported as needing a restart.
+    """
+    global TOR_SOCKS_PROXY, TOR_CONTROL_PORT, TOR_CONTROL_SOCKET, TOR_CONTROL_PASSWORD, TOR_POOL_SIZE
+    global ROTATION_CRON, ROTATION_JITTER, ROTATION_OVERRUN, ROTATION_ADAPTIVE, PROBE_ENABLED
+    global COUNTRY_SCHEDULE, COUNTRY_SCHEDULE_MODE
+    global MAC_CHANGE_ENABLED, MAC_CHANGE_METHOD, NEW_MAC, MAC_INTERFACES
+    global LOG_ENABLED, LOG_FILE, TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID, TELEGRAM_ENABLED
+    global METRICS_PORT, METRICS_TEXTFILE, PROBE_URL
+
+    socks_port, control_port = detect_tor_ports()
+    socks_port = int(settings.get('socks_port') or socks_port)
+    control_port = int(settings.get('control_port') or control_port)
+    control_socket = settings.get('control_socket')
+    if control_socket is None and not settings.get('control_port'):
+        control_socket = detect_tor_control_socket()
+
+    pool = int(settings.get('pool') or 0)
+    metrics_port = int(settings.get('metrics_port') or 0)
+    jitter = float(settings.get('jitter') or 0)
+    interval = int(settings.get('interval') or DAEMON_INTERVAL)
+    if interval <= 0:
+        raise ValueError("interval must be positive")
+    cron = settings.get('cron') or None
+    if cron:
+        CronSchedule(cron)
+    overrun = settings.get('overrun') or 'catch_up'
+    if overrun not in ('catch_up', 'skip'):
+        raise ValueError("overrun must be 'catch_up' or 'skip'")
+    probe_url = settings.get('probe_url') or PROBE_URL
+    if (settings.get('probe') or settings.get('adaptive')) and not probe_url:
+        raise ValueError("probe and adaptive need a probe_url, e.g. a probe-server you host")
+
+    countries = settings.get('countries') or None
+    if isinstance(countries, str):
+        countries = parse_country_list(countries)
+    country_mode = settings.get('country_mode') or ('weighted' if isinstance(countries, dict) else 'round_robin')
+    if country_mode not in ('round_robin', 'no_repeat', 'weighted'):
+        raise ValueError("country_mode must be 'round_robin', 'no_repeat' or 'weighted'")
+
+    mac = settings.get('mac') or 'off'
+    mac_address = settings.get('mac_address')
+    if mac not in ('off', 'random', 'specific'):
+        raise ValueError("mac must be 'off', 'random' or 'specific'")
+    if mac == 'specific' and not re.match(r'^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$', mac_address or ''):
+        raise ValueError("mac 'specific' needs a mac_address like 00:11:22:33:44:55")
+    mac_interfaces = settings.get('mac_interfaces') or None
+    if isinstance(mac_interfaces, str):
+        mac_interfaces = mac_interfaces.replace(',', ' ').split()
+
+    endpoints = {
+        'socks_port': f"socks5h://127.0.0.1:{socks_port}",
+        'control_port': control_port,
+        'control_socket': control_socket,
+        'control_password': settings.get('control_password')
+    }
+    restart = ['pool'] if reload and pool != TOR_POOL_SIZE else []
+    pool_settings = _tor_pool.base_settings if reload and _tor_pool is not None else None
+    if pool_settings is not None:
+        # The pool's instances were derived from these, and one of them is active
+        restart += [name for name, value in zip(endpoints, pool_settings) if endpoints[name] != value]
+    else:
+        TOR_SOCKS_PROXY, TOR_CONTROL_PORT, TOR_CONTROL_SOCKET, TOR_CONTROL_PASSWORD = endpoints.values()
+    if 'pool' not in restart:
+        TOR_POOL_SIZE = pool
+    if reload and metrics_port != METRICS_PORT:
+        restart.append('metrics_port')  # The server is bound once, at start-up
+        metrics_port = METRICS_PORT
+    if restart:
+        print(f"{YELLOW}[!] Restart the daemon to apply: {BLUE}{', '.join(restart)}{RESET}", flush=True)
+    ROTATION_CRON = cron
+    ROTATION_JITTER = jitter
+    ROTATION_OVERRUN = overrun
+    ROTATION_ADAPTIVE = bool(settings.get('adaptive'))
+    PROBE_ENABLED = bool(settings.get('probe')) or ROTATION_ADAPTIVE
+    PROBE_URL = probe_url
+    COUNTRY_SCHEDULE = countries or []
+    COUNTRY_SCHEDULE_MODE = country_mode if countries else None
+    MAC_CHANGE_ENABLED = mac != 'off'
+    MAC_CHANGE_METHOD = None if mac == 'off' else mac
+    NEW_MAC = mac_address if mac == 'specific' else None
+    MAC_INTERFACES = mac_interfaces
+    LOG_ENABLED = bool(settings.get('log_file'))
+    if LOG_ENABLED:
+        LOG_FILE = settings['log_file']
+    TELEGRAM_BOT_TOKEN = settings.get('telegram_token')
+    TELEGRAM_CHAT_ID = settings.get('telegram_chat_id')
+    TELEGRAM_ENABLED = bool(TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID)
+    METRICS_PORT = metrics_port
+    METRICS_TEXTFILE = settings.get('metrics_textfile') or None
+    return interval
+
+_pid_file_fd = None  # Open, locked PID file of the running daemon
+
+def acquire_pid_file(path):
+    """Lock path and write our PID to it; returns False if another daemon holds it
+
+    The flock lasts as long as the file stays open, so two daemons started
+    together cannot both get it and one that died leaves no stale lock.
+    Without fcntl the file is created exclusively, taking over stale ones.
+    """
+    global _pid_file_fd
+
+    for _ in range(3):
+        try:
+            if fcntl is None:
+                fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+            else:
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        except FileExistsError:
+            if _pid_file_alive(path):
+                return False
+            with contextlib.suppress(OSError):
+                os.remove(path)  # Stale: its daemon is gone
+            continue
+        except OSError:
+            return False
+
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+            try:
+                same_file = os.fstat(fd).st_ino == os.stat(path).st_ino
+            except OSError:
+                same_file = False
+            if not same_file:
+                os.close(fd)  # Locked a file the previous daemon removed on exit; lock the new one
+                continue
+
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        _pid_file_fd = fd
+        return True
+    return False
+
+def _pid_file_alive(path):
+    try:
+        with open(path, 'r') as f:
+            os.kill(int(f.read().strip()), 0)
+        return True
+    except PermissionError:
+        return True  # The process exists but belongs to another user
+    except (OSError, ValueError):
+        return False
+
+def release_pid_file(path):
+    """Remove the PID file and drop its lock, if it is ours"""
+    global _pid_file_fd
+
+    if _pid_file_fd is None:
+        return
+    with contextlib.suppress(OSError):
+        os.remove(path)
+    os.close(_pid_file_fd)
+    _pid_file_fd = None
+
+class DaemonStatus:
+    """Status file for the daemon, replaced atomically on every update"""
+
+    def __init__(self, path, config_path=None):
+        self.path = path
+        self.state = {
+            'pid': os.getpid(),
+            'state': 'starting',
+            'started': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'config': os.path.abspath(config_path) if config_path else None,
+            'rotations': 0,
+            'errors': 0,
+            'last_rotation': None,
+            'last_error': None
+        }
+
+    def update(self, **changes):
+        self.state.update(changes)
+        self.state['updated'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if not self.path:
+            return
+        temporary = f"{self.path}.tmp"
+        try:
+            with open(temporary, 'w') as f:
+                json.dump(self.state, f, indent=2)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            print(f"{RED}[!] Could not write status file {self.path}: {str(e)}{RESET}")
+
+    def rotated(self, event):
+        """run_rotations callback: record the rotation and report it on one line"""
+        self.update(rotations=self.state['rotations'] + 1, next_rotation_in=event['interval'], last_rotation={
+            'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'ip': event['new_ip'],
+            'country_code': event['new_country_code'],
+            'target_country': event['target_country'],
+            'rerolls': event['rerolls']
+        })
+        print(f"{GREEN}[+] Identity changed: {BLUE}{event['old_ip']}{GREEN} -> {BLUE}{event['new_ip']}{GREEN} "
+              f"({event['new_country_code'] or '??'}), next change in {event['interval']} seconds{RESET}", flush=True)
+
+def run_daemon(config_path=None, overrides=None, pid_file=None, status_file=None):
+    """Daemon subcommand: rotate without prompts until SIGTERM; SIGHUP reloads the settings"""
+    pid_file = pid_file or DAEMON_PID_FILE
+    status_file = DAEMON_STATUS_FILE if status_file is None else status_file
+    try:
+        interval = apply_daemon_settings(load_daemon_settings(config_path, overrides))
+    except (OSError, ValueError, TypeError) as e:
+        print(f"{RED}[!] Invalid daemon settings: {str(e)}{RESET}")
+        return 2
+    if not acquire_pid_file(pid_file):
+        print(f"{RED}[!] Already running according to {pid_file}{RESET}")
+        return 1
+
+    status = DaemonStatus(status_file, config_path)
+    stop = threading.Event()
+    reload_requested = threading.Event()
+    wake = threading.Event()  # Interrupts run_rotations for either of the above
+
+    def on_signal(signum, frame):
+        if signum == getattr(signal, 'SIGHUP', None):
+            reload_requested.set()
+        else:
+            stop.set()
+        wake.set()
+
+    for name in ('SIGTERM', 'SIGINT', 'SIGHUP'):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), on_signal)
+
+    pipeline = None
+    try:
+        status.update(state='starting')
+        print(f"{GREEN}[+] Daemon started (PID {BLUE}{os.getpid()}{GREEN}), "
+              f"SOCKS proxy {BLUE}{TOR_SOCKS_PROXY}{RESET}", flush=True)
+        if METRICS_PORT:
+            start_metrics_server()
+        if TOR_POOL_SIZE and not start_tor_pool():
+            status.update(state='failed', last_error='tor pool did not start')
+            return 1
+        if not wait_for_tor_ready():
+            status.update(state='failed', last_error='tor did not bootstrap')
+            return 1
+
+        # No screen stage: each rotation is reported on one line by the status callback
+        pipeline = RotationPipeline(display=False).start()
+        while True:
+            wake.clear()
+            if stop.is_set():
+                break
+            if reload_requested.is_set():
+                reload_requested.clear()
+                print(f"{YELLOW}[*] Reloading settings...{RESET}", flush=True)
+                try:
+                    interval = apply_daemon_settings(load_daemon_settings(config_path, overrides), reload=True)
+                    print(f"{GREEN}[✓] Settings reloaded{RESET}", flush=True)
+                except (OSError, ValueError, TypeError) as e:
+                    print(f"{RED}[!] Reload failed, keeping the current settings: {str(e)}{RESET}", flush=True)
+                    status.update(errors=status.state['errors'] + 1, last_error=f"reload: {str(e)}")
+
+            scheduler = RotationScheduler(interval, cron=ROTATION_CRON)
+            status.update(state='running', interval=interval, cron=ROTATION_CRON)
+            try:
+                run_rotations(scheduler, pipeline, stop=wake, on_rotation=status.rotated)
+            except Exception as e:
+                print(f"{RED}[!] Rotation failed: {str(e)}, retrying in {DAEMON_RETRY_DELAY} seconds{RESET}", flush=True)
+                status.update(state='retrying', errors=status.state['errors'] + 1, last_error=str(e))
+                wake.wait(DAEMON_RETRY_DELAY)
+    finally:
+        status.update(state='stopping')
+        print(f"{YELLOW}[*] Stopping daemon...{RESET}", flush=True)
+        if pipeline is not None:
+            pipeline.stop()
+        flush_log()
+        stop_tor_pool()
+        status.update(state='stopped')
+        release_pid_file(pid_file)
+    return 0
+
 def main_menu():
     """Display the main menu and handle user choices"""
     global MAC_CHANGE_ENABLED, MAC_CHANGE_METHOD, NEW_MAC
@@ -751,11 +5193,11 @@ def main_menu():
             print(f"\n{YELLOW}[*] Starting Tor service...{RESET}")
             try:
                 subprocess.run(['sudo', 'systemctl', 'start', 'tor'], check=True)
-                time.sleep(3)  # Give Tor time to start
             except Exception as e:
                 print(f"{RED}[!] Failed to start Tor: {str(e)}{RESET}")
                 input(f"{YELLOW}Press Enter to continue...{RESET}")
                 continue
+            wait_for_tor_ready()
 
         real_ip = get_real_ip()
         real_mac = get_current_mac()
@@ -764,6 +5206,10 @@ def main_menu():
         print(f"{GREEN}[+] Your MAC: {BLUE}{real_mac}{RESET}")
         print(f"{GREEN}[+] Tor SOCKS Proxy: {BLUE}{TOR_SOCKS_PROXY}{RESET}")
         print(f"{GREEN}[+] Tor Control Port: {BLUE}{TOR_CONTROL_PORT}{RESET}")
+        print(f"{GREEN}[+] Tor Status: {format_tor_status()}{RESET}")
+        if _tor_pool is not None:
+            pool_status = ', '.join(f"{count} {state}" for state, count in sorted(_tor_pool.status().items()))
+            print(f"{GREEN}[+] Tor Pool: {BLUE}{pool_status}{RESET}")
         print(f"{GREEN}[+] MAC Changing: {BLUE}{'Enabled' if MAC_CHANGE_ENABLED else 'Disabled'}{RESET}\n")
 
         print(f"{YELLOW}Menu Options:")
@@ -790,10 +5236,13 @@ def main_menu():
             MAC_CHANGE_ENABLED = original_mac_setting
         elif choice == "2":
             # Change MAC only
-            if change_mac_address():
-                new_mac = get_current_mac()
+            results = rotate_mac_addresses()
+            if not results:
+                print(f"\n{RED}[!] No interface to change the MAC address of{RESET}")
+            elif all(result['ok'] for result in results.values()):
                 print(f"\n{GREEN}[✓] MAC address changed successfully{RESET}")
-                print(f"{GREEN}[+] New MAC: {BLUE}{new_mac}{RESET}")
+                for interface, result in results.items():
+                    print(f"{GREEN}[+] New MAC ({interface}): {BLUE}{result['new_mac']}{RESET}")
                 input(f"\n{YELLOW}Press Enter to continue...{RESET}")
         elif choice == "3":
             # Change both IP and MAC
@@ -817,16 +5266,139 @@ def main_menu():
             break
         else:
             print(f"{RED}[!] Invalid choice{RESET}")
-            time.sleep(2)
+            pause(2)
+
+def parse_args(argv=None):
+    """Parse command line arguments; no subcommand starts the interactive menu"""
+    parser = argparse.ArgumentParser(prog="KAREEM_NET_FRED", description="IP Changer with Country & City Lookup")
+    parser.add_argument("--pool", type=int, default=None, metavar="N",
+                        help="run N tor instances and rotate by switching between them")
+    parser.add_argument("--probe", action="store_true", help="probe new circuits and re-roll slow exits")
+    parser.add_argument("--probe-url", default=None, metavar="URL",
+                        help="probe target, e.g. a probe-server you host (required with --probe or --adaptive)")
+    parser.add_argument("--recheck", action="store_true", help="check requirements even if a cached check still applies")
+    parser.add_argument("--metrics-port", type=int, default=None, metavar="PORT",
+                        help=f"serve Prometheus metrics on http://{METRICS_LISTEN}:PORT/metrics")
+    parser.add_argument("--metrics-textfile", default=None, metavar="FILE",
+                        help="write Prometheus metrics to FILE after every rotation")
+    parser.add_argument("--cron", default=None, metavar="EXPR", help="rotate on a cron schedule, e.g. '*/5 * * * *'")
+    parser.add_argument("--jitter", type=float, default=None, metavar="SECONDS",
+                        help="randomly move each rotation up to SECONDS around its slot")
+    parser.add_argument("--overrun", choices=["catch_up", "skip"], default=None,
+                        help="what to do with slots missed by a slow rotation (default: catch_up)")
+    parser.add_argument("--adaptive", action="store_true", help="rotate sooner while the circuit probe keeps failing")
+    parser.add_argument("--countries", default=None, metavar="LIST",
+                        help="exit countries to rotate through, e.g. 'de,nl,se' or 'de:3,nl:1' for weights")
+    parser.add_argument("--country-mode", choices=["round_robin", "no_repeat", "weighted"], default=None,
+                        help="how --countries are scheduled (default: round_robin, weighted if weights are given)")
+    subcommands = parser.add_subparsers(dest="command")
+
+    identities = subcommands.add_parser("identities", help="hold several isolated identities on one tor at once")
+    identities.add_argument("count", type=int, help="number of concurrent identities")
+    identities.add_argument("--interval", type=int, default=None, help="rotate every identity every N seconds")
+
+    proxy = subcommands.add_parser("proxy", help="run a local rotating SOCKS5/HTTP proxy in front of tor")
+    proxy.add_argument("--listen", default=None, help=f"address to listen on (default: {PROXY_LISTEN})")
+    proxy.add_argument("--port", type=int, default=None, help=f"port to listen on (default: {PROXY_PORT})")
+    proxy.add_argument("--rotate-requests", type=int, default=None, metavar="N", help="rotate after N connections")
+    proxy.add_argument("--rotate-bytes", type=int, default=None, metavar="N", help="rotate after N bytes relayed")
+    proxy.add_argument("--rotate-interval", type=int, default=None, metavar="SECONDS", help="rotate after SECONDS")
+    proxy.add_argument("--isolation", choices=["client", "shared"], default=None,
+                       help="give each client address its own circuits (default: client)")
+
+    probe_server = subcommands.add_parser("probe-server", help="host a target for the circuit quality probe")
+    probe_server.add_argument("--listen", default="0.0.0.0", help="address to listen on (default: 0.0.0.0)")
+    probe_server.add_argument("--port", type=int, default=8000, help="port to listen on (default: 8000)")
+
+    daemon = subcommands.add_parser("daemon", help="rotate without prompts, for service managers")
+    daemon.add_argument("--config", default=None, metavar="FILE", help="JSON settings file, re-read on SIGHUP")
+    daemon.add_argument("--socks-port", type=int, default=None, help="tor SOCKS port (default: from torrc)")
+    daemon.add_argument("--control-port", type=int, default=None, help="tor control port (default: from torrc)")
+    daemon.add_argument("--control-socket", default=None, metavar="PATH", help="tor control socket")
+    daemon.add_argument("--interval", type=int, default=None, metavar="SECONDS",
+                        help=f"seconds between rotations (default: {DAEMON_INTERVAL})")
+    daemon.add_argument("--mac", choices=["off", "random", "specific"], default=None,
+                        help="MAC address policy (default: off)")
+    daemon.add_argument("--mac-address", default=None, help="MAC address for --mac specific")
+    daemon.add_argument("--interface", dest="mac_interfaces", action="append", default=None, metavar="NAME",
+                        help="interface (or pattern) to rotate the MAC of; repeat for more")
+    daemon.add_argument("--log-file", default=None, metavar="FILE", help="log rotations to FILE")
+    daemon.add_argument("--telegram-token", default=None, help="Telegram bot token (prefer the config file)")
+    daemon.add_argument("--telegram-chat-id", default=None, help="Telegram chat ID")
+    daemon.add_argument("--pid-file", default=None, help=f"PID file (default: {DAEMON_PID_FILE})")
+    daemon.add_argument("--status-file", default=None, help=f"status file (default: {DAEMON_STATUS_FILE})")
+
+    analytics = subcommands.add_parser("analytics", help="summarise the identity log")
+    analytics.add_argument("paths", nargs="*", help=f"log files or segments (default: {LOG_FILE} and its rotated segments)")
+    analytics.add_argument("--workers", type=int, default=None, help="parallel worker processes (default: CPU count)")
+    analytics.add_argument("--json", action="store_true", help="print raw aggregates as JSON")
+
+    return parser.parse_args(argv)
 
 def main():
     # Initialize global variables
-    global MAC_CHANGE_ENABLED, MAC_CHANGE_METHOD, NEW_MAC
+    global MAC_CHANGE_ENABLED, MAC_CHANGE_METHOD, NEW_MAC, TOR_POOL_SIZE, TOR_SOCKS_PROXY, PROBE_ENABLED
+    global COUNTRY_SCHEDULE_MODE, COUNTRY_SCHEDULE
+    global ROTATION_CRON, ROTATION_JITTER, ROTATION_OVERRUN, ROTATION_ADAPTIVE
+    global METRICS_PORT, METRICS_TEXTFILE, PROBE_URL
+    
+    args = parse_args()
+    if args.metrics_port:
+        METRICS_PORT = args.metrics_port
+    if args.metrics_textfile:
+        METRICS_TEXTFILE = args.metrics_textfile
+    if args.probe:
+        PROBE_ENABLED = True
+    if args.cron:
+        ROTATION_CRON = args.cron
+    if args.jitter is not None:
+        ROTATION_JITTER = args.jitter
+    if args.overrun:
+        ROTATION_OVERRUN = args.overrun
+    if args.adaptive:
+        ROTATION_ADAPTIVE = PROBE_ENABLED = True
+    if args.probe_url:
+        PROBE_URL = args.probe_url
+    if args.countries:
+        COUNTRY_SCHEDULE = parse_country_list(args.countries)
+        COUNTRY_SCHEDULE_MODE = args.country_mode or ('weighted' if isinstance(COUNTRY_SCHEDULE, dict) else 'round_robin')
+    elif args.country_mode:
+        COUNTRY_SCHEDULE_MODE = args.country_mode
+    if args.command == "analytics":
+        return run_analytics(args.paths, args.workers, args.json)
+    if args.command == "daemon":
+        overrides = {key: getattr(args, key) for key in (
+            'socks_port', 'control_port', 'control_socket', 'interval', 'mac', 'mac_address', 'mac_interfaces',
+            'log_file', 'telegram_token', 'telegram_chat_id', 'pool', 'cron', 'jitter', 'overrun', 'countries',
+            'country_mode')}
+        overrides['probe'] = args.probe or None
+        overrides['adaptive'] = args.adaptive or None
+        overrides['metrics_port'] = args.metrics_port
+        overrides['metrics_textfile'] = args.metrics_textfile
+        overrides['probe_url'] = args.probe_url
+        return run_daemon(args.config, overrides, args.pid_file, args.status_file)
+    if PROBE_ENABLED and not PROBE_URL and args.command != "probe-server":
+        print(f"{RED}[!] --probe and --adaptive need a target: set --probe-url (or PROBE_URL), "
+              f"e.g. to a probe-server you host{RESET}")
+        return 1
+    if METRICS_PORT and args.command != "probe-server":
+        start_metrics_server()
+    if args.command == "identities":
+        socks_port, control_port = detect_tor_ports()
+        TOR_SOCKS_PROXY = f"socks5h://127.0.0.1:{socks_port}"
+        return run_identities(args.count, args.interval)
+    if args.command == "probe-server":
+        return run_probe_server(args.listen, args.port)
+    if args.command == "proxy":
+        socks_port, control_port = detect_tor_ports()
+        TOR_SOCKS_PROXY = f"socks5h://127.0.0.1:{socks_port}"
+        return run_proxy(args.listen, args.port, args.rotate_requests, args.rotate_bytes, args.rotate_interval,
+                         args.isolation)
     
     # Check requirements
     clear_screen()
     print_banner()
-    if not check_requirements():
+    if not check_requirements(use_cache=not args.recheck):
         print(f"\n{RED}[!] Missing requirements{RESET}")
         input(f"{YELLOW}Press Enter to exit...{RESET}")
         return
@@ -834,6 +5406,12 @@ def main():
     # Configure Tor ports
     configure_tor_ports()
     
+    # Pool instances take their ports from the ones just configured
+    if args.pool is not None:
+        TOR_POOL_SIZE = args.pool
+    if TOR_POOL_SIZE:
+        start_tor_pool()
+    
     # Ask about logging
     setup_logging()
     
@@ -841,4 +5419,4 @@ def main():
     main_menu()
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
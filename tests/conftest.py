@@ -0,0 +1,10 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "src"), os.path.join(ROOT, "benchmarks")]
+
+import KAREEM_NET_FRED  # noqa: E402
+
+# Keep the shared geo cache in memory, away from the working directory
+KAREEM_NET_FRED.geo_cache.path = None
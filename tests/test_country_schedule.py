@@ -0,0 +1,60 @@
+import random
+
+import KAREEM_NET_FRED as kareem
+
+
+class Index:
+    """Stand-in for the consensus exit index"""
+
+    def __init__(self, *countries):
+        self._countries = set(countries)
+
+    def countries(self):
+        return self._countries
+
+
+def test_parse_country_list():
+    assert kareem.parse_country_list("de, nl,,se") == ["de", "nl", "se"]
+    assert kareem.parse_country_list("de:3,nl:1") == {"de": 3.0, "nl": 1.0}
+    assert kareem.parse_country_list("de:3,nl") == {"de": 3.0, "nl": 1.0}
+    assert kareem.parse_country_list("") == []
+
+
+def test_round_robin_cycles_and_skips_countries_without_exits():
+    schedule = kareem.CountrySchedule("round_robin", ["de", "nl", "se"])
+    index = Index("DE", "SE")
+    assert [schedule.next(index) for _ in range(4)] == ["DE", "SE", "DE", "SE"]
+
+
+def test_no_country_with_exits_gives_none():
+    schedule = kareem.CountrySchedule("round_robin", ["de"])
+    assert schedule.next(Index("NL")) is None
+
+
+def test_no_repeat_never_picks_the_same_country_twice_in_a_row():
+    random.seed(1)
+    schedule = kareem.CountrySchedule("no_repeat", ["de", "nl", "se"])
+    index = Index("DE", "NL", "SE")
+    picks = [schedule.next(index) for _ in range(50)]
+    assert all(a != b for a, b in zip(picks, picks[1:]))
+    assert set(picks) == {"DE", "NL", "SE"}
+
+
+def test_no_repeat_without_a_list_uses_every_country_with_exits():
+    random.seed(2)
+    schedule = kareem.CountrySchedule("no_repeat", [])
+    picks = [schedule.next(Index("DE", "NL")) for _ in range(6)]
+    assert picks in (["DE", "NL"] * 3, ["NL", "DE"] * 3)
+
+
+def test_no_repeat_with_one_country_repeats_it():
+    schedule = kareem.CountrySchedule("no_repeat", ["de"])
+    assert [schedule.next(Index("DE")) for _ in range(2)] == ["DE", "DE"]
+
+
+def test_weighted_follows_the_weights():
+    random.seed(3)
+    schedule = kareem.CountrySchedule("weighted", {"de": 9, "nl": 1, "se": 5})
+    picks = [schedule.next(Index("DE", "NL")) for _ in range(1000)]
+    assert set(picks) == {"DE", "NL"}
+    assert 800 < picks.count("DE") < 970
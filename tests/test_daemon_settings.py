@@ -0,0 +1,101 @@
+import json
+import types
+
+import pytest
+
+import KAREEM_NET_FRED as kareem
+
+# Globals apply_daemon_settings assigns, restored after every test
+APPLIED = (
+    'TOR_SOCKS_PROXY', 'TOR_CONTROL_PORT', 'TOR_CONTROL_SOCKET', 'TOR_CONTROL_PASSWORD', 'TOR_POOL_SIZE',
+    'ROTATION_CRON', 'ROTATION_JITTER', 'ROTATION_OVERRUN', 'ROTATION_ADAPTIVE', 'PROBE_ENABLED', 'PROBE_URL',
+    'COUNTRY_SCHEDULE', 'COUNTRY_SCHEDULE_MODE', 'MAC_CHANGE_ENABLED', 'MAC_CHANGE_METHOD', 'NEW_MAC',
+    'MAC_INTERFACES', 'LOG_ENABLED', 'LOG_FILE', 'TELEGRAM_BOT_TOKEN', 'TELEGRAM_CHAT_ID', 'TELEGRAM_ENABLED',
+    'METRICS_PORT', 'METRICS_TEXTFILE', '_tor_pool',
+)
+
+
+@pytest.fixture(autouse=True)
+def configuration(monkeypatch):
+    for name in APPLIED:
+        monkeypatch.setattr(kareem, name, getattr(kareem, name))
+    monkeypatch.setattr(kareem, "detect_tor_ports", lambda: (9050, 9051))
+    monkeypatch.setattr(kareem, "detect_tor_control_socket", lambda: None)
+
+
+def test_load_merges_the_file_with_overrides(tmp_path):
+    config = tmp_path / "daemon.json"
+    config.write_text(json.dumps({"interval": 60, "log-file": "a.log", "mac": "random"}))
+    settings = kareem.load_daemon_settings(str(config), {"interval": 30, "mac": None})
+    assert settings == {"interval": 30, "log_file": "a.log", "mac": "random"}
+
+
+def test_load_rejects_unknown_settings_and_non_objects(tmp_path):
+    with pytest.raises(ValueError, match="intervall"):
+        kareem.load_daemon_settings(overrides={"intervall": 30})
+    config = tmp_path / "daemon.json"
+    config.write_text("[1, 2]")
+    with pytest.raises(ValueError):
+        kareem.load_daemon_settings(str(config))
+
+
+def test_apply_sets_the_configuration():
+    interval = kareem.apply_daemon_settings({
+        "interval": 45, "socks_port": 9150, "jitter": 2, "overrun": "skip", "countries": "de:3,nl",
+        "mac": "specific", "mac_address": "00:11:22:33:44:55", "mac_interfaces": "eth0, wlan*",
+        "log_file": "r.log", "telegram_token": "t", "telegram_chat_id": "c",
+    })
+    assert interval == 45
+    assert kareem.TOR_SOCKS_PROXY == "socks5h://127.0.0.1:9150"
+    assert kareem.TOR_CONTROL_PORT == 9051
+    assert (kareem.ROTATION_JITTER, kareem.ROTATION_OVERRUN) == (2.0, "skip")
+    assert kareem.COUNTRY_SCHEDULE == {"de": 3.0, "nl": 1.0}
+    assert kareem.COUNTRY_SCHEDULE_MODE == "weighted"
+    assert kareem.MAC_CHANGE_ENABLED and kareem.NEW_MAC == "00:11:22:33:44:55"
+    assert kareem.MAC_INTERFACES == ["eth0", "wlan*"]
+    assert kareem.LOG_ENABLED and kareem.LOG_FILE == "r.log"
+    assert kareem.TELEGRAM_ENABLED
+
+
+@pytest.mark.parametrize("settings", [
+    {"interval": -5},
+    {"interval": "soon"},
+    {"cron": "* * *"},
+    {"overrun": "later"},
+    {"country_mode": "random", "countries": "de"},
+    {"mac": "sometimes"},
+    {"mac": "specific", "mac_address": "00:11:22"},
+    {"probe": True},
+    {"adaptive": True},
+])
+def test_invalid_settings_change_nothing(settings):
+    kareem.apply_daemon_settings({"interval": 60, "log_file": "keep.log", "jitter": 5})
+    before = {name: getattr(kareem, name) for name in APPLIED}
+    with pytest.raises(ValueError):
+        kareem.apply_daemon_settings(dict(settings, log_file="other.log"), reload=True)
+    assert {name: getattr(kareem, name) for name in APPLIED} == before
+
+
+def test_probe_needs_a_url():
+    kareem.apply_daemon_settings({"probe": True, "probe_url": "http://probe.example/"})
+    assert kareem.PROBE_ENABLED and kareem.PROBE_URL == "http://probe.example/"
+
+
+def test_reload_keeps_start_up_settings(capsys):
+    kareem.apply_daemon_settings({"pool": 3, "metrics_port": 9100})
+    kareem.apply_daemon_settings({"pool": 5, "metrics_port": 9200, "interval": 10}, reload=True)
+    assert (kareem.TOR_POOL_SIZE, kareem.METRICS_PORT) == (3, 9100)
+    assert "pool, metrics_port" in capsys.readouterr().out
+
+
+def test_reload_keeps_the_endpoints_of_a_running_pool(capsys):
+    kareem.apply_daemon_settings({"pool": 2})
+    base = (kareem.TOR_SOCKS_PROXY, kareem.TOR_CONTROL_PORT, kareem.TOR_CONTROL_SOCKET, kareem.TOR_CONTROL_PASSWORD)
+    kareem._tor_pool = types.SimpleNamespace(base_settings=base)
+    kareem.TOR_SOCKS_PROXY = "socks5h://127.0.0.1:19050"  # Pointed at the active instance
+    kareem.apply_daemon_settings({"pool": 2, "socks_port": 9150}, reload=True)
+    assert kareem.TOR_SOCKS_PROXY == "socks5h://127.0.0.1:19050"
+    assert "socks_port" in capsys.readouterr().out
+
+    kareem.apply_daemon_settings({"pool": 2}, reload=True)
+    assert "Restart" not in capsys.readouterr().out
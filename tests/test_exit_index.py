@@ -0,0 +1,103 @@
+import pytest
+
+import KAREEM_NET_FRED as kareem
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = kareem.BloomFilter(1000)
+    ips = [f"10.0.{i // 256}.{i % 256}" for i in range(1000)]
+    for ip in ips:
+        bloom.add(ip)
+    assert all(ip in bloom for ip in ips)
+    assert bloom.count == 1000
+
+
+def test_bloom_filter_false_positive_rate():
+    bloom = kareem.BloomFilter(1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"10.0.{i // 256}.{i % 256}")
+    false_positives = sum(f"192.168.{i // 256}.{i % 256}" in bloom for i in range(10000))
+    assert false_positives < 300  # 1% expected, with plenty of slack
+
+
+@pytest.mark.parametrize("backend", ["lru", "bloom"])
+def test_repeats_are_detected(backend):
+    index = kareem.SeenExitIndex(backend=backend, size=100, ttl=0, recent_countries=0)
+    assert not index.is_repeat("1.1.1.1")
+    index.add("1.1.1.1")
+    assert index.is_repeat("1.1.1.1")
+    assert not index.is_repeat("2.2.2.2")
+    assert not index.is_repeat(None)
+
+
+def test_lru_backend_evicts_the_oldest_exit():
+    index = kareem.SeenExitIndex(backend="lru", size=2, ttl=0, recent_countries=0)
+    for ip in ("1.1.1.1", "2.2.2.2", "1.1.1.1", "3.3.3.3"):
+        index.add(ip)
+    assert not index.is_repeat("2.2.2.2")
+    assert index.is_repeat("1.1.1.1") and index.is_repeat("3.3.3.3")
+
+
+def test_lru_backend_expires_exits_after_ttl():
+    index = kareem.SeenExitIndex(backend="lru", size=10, ttl=60, recent_countries=0)
+    index.add("1.1.1.1")
+    index.add("2.2.2.2")
+    index._exits["1.1.1.1"] -= 61
+    assert not index.is_repeat("1.1.1.1")
+    assert index.is_repeat("2.2.2.2")
+
+
+def test_bloom_backend_ages_exits_out_over_two_generations():
+    index = kareem.SeenExitIndex(backend="bloom", size=100, ttl=60, recent_countries=0)
+    index.add("1.1.1.1")
+    index._generation_started -= 31
+    index.add("2.2.2.2")  # Starts a new generation; 1.1.1.1 is in the previous one
+    assert index.is_repeat("1.1.1.1")
+    index._generation_started -= 31
+    assert not index.is_repeat("1.1.1.1")
+    assert index.is_repeat("2.2.2.2")
+
+
+def test_bloom_backend_rolls_over_when_full():
+    index = kareem.SeenExitIndex(backend="bloom", size=2, ttl=0, recent_countries=0)
+    for ip in ("1.1.1.1", "2.2.2.2", "3.3.3.3", "4.4.4.4", "5.5.5.5"):
+        index.add(ip)
+    assert not index.is_repeat("1.1.1.1")
+    assert index.is_repeat("5.5.5.5")
+
+
+def test_recent_countries_count_as_repeats():
+    index = kareem.SeenExitIndex(backend="lru", size=10, ttl=0, recent_countries=2)
+    index.add("1.1.1.1", "DE")
+    index.add("2.2.2.2", "NL")
+    assert index.is_repeat("3.3.3.3", "DE")
+    index.add("4.4.4.4", "SE")  # Pushes DE out of the recent countries
+    assert not index.is_repeat("3.3.3.3", "DE")
+
+
+def test_record_counts_the_repeat_rate():
+    index = kareem.SeenExitIndex(backend="lru", size=10, ttl=0, recent_countries=0)
+    assert index.repeat_rate() == 0.0
+    index.record("1.1.1.1", None, False, 0)
+    index.record("1.1.1.1", None, True, 2)
+    assert index.repeat_rate() == 0.5
+    assert index.avoided == 2
+
+
+class BrokenControl:
+    def get_country_code(self, ip):
+        raise OSError("control port down")
+
+
+def test_exit_country_code_falls_back_to_geolocation(monkeypatch):
+    monkeypatch.setattr(kareem, "EXIT_AVOID_RECENT_COUNTRIES", 3)
+    monkeypatch.setattr(kareem, "get_tor_control", BrokenControl)
+    monkeypatch.setattr(kareem, "get_location_for_ip", lambda ip, track=True: ("Germany", "Berlin"))
+    assert kareem.exit_country_code("1.1.1.1") == "DE"
+    assert kareem.exit_country_code("1.1.1.1", "NL") == "NL"
+
+
+def test_exit_country_code_is_only_looked_up_when_avoiding_countries(monkeypatch):
+    monkeypatch.setattr(kareem, "EXIT_AVOID_RECENT_COUNTRIES", 0)
+    monkeypatch.setattr(kareem, "get_tor_control", BrokenControl)
+    assert kareem.exit_country_code("1.1.1.1") is None
@@ -0,0 +1,61 @@
+import json
+
+import KAREEM_NET_FRED as kareem
+
+
+def test_get_returns_fresh_entries():
+    cache = kareem.GeoCache(path=None)
+    cache.put("1.2.3.4", "Germany", "Berlin")
+    assert cache.get("1.2.3.4") == ("Germany", "Berlin")
+    assert cache.get("5.6.7.8") is None
+
+
+def test_expired_entries_are_dropped():
+    cache = kareem.GeoCache(path=None, ttl=60)
+    cache.put("1.2.3.4", "Germany", "Berlin")
+    cache._entries["1.2.3.4"][2] -= 61
+    assert cache.get("1.2.3.4") is None
+    assert "1.2.3.4" not in cache._entries
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = kareem.GeoCache(path=None, max_size=2)
+    cache.put("1.1.1.1", "A", None)
+    cache.put("2.2.2.2", "B", None)
+    cache.get("1.1.1.1")  # Now the most recently used
+    cache.put("3.3.3.3", "C", None)
+    assert cache.get("2.2.2.2") is None
+    assert cache.get("1.1.1.1") == ("A", None)
+    assert cache.get("3.3.3.3") == ("C", None)
+
+
+def test_save_and_load_skip_expired_entries(tmp_path):
+    path = str(tmp_path / "geo.json")
+    cache = kareem.GeoCache(path=path, ttl=60)
+    cache.put("1.1.1.1", "A", "a")
+    cache.put("2.2.2.2", "B", "b")
+    cache._entries["2.2.2.2"][2] -= 61
+    cache._dirty = True
+    cache.save()
+    assert set(json.loads(open(path).read())) == {"1.1.1.1", "2.2.2.2"}
+
+    reloaded = kareem.GeoCache(path=path, ttl=60)
+    assert reloaded.get("1.1.1.1") == ("A", "a")
+    assert reloaded.get("2.2.2.2") is None
+
+
+def test_load_keeps_the_newest_entries_within_max_size(tmp_path):
+    path = tmp_path / "geo.json"
+    now = kareem.time.time()
+    path.write_text(json.dumps({"1.1.1.1": ["A", None, now - 3], "2.2.2.2": ["B", None, now - 2],
+                                "3.3.3.3": ["C", None, now - 1]}))
+    cache = kareem.GeoCache(path=str(path), max_size=2)
+    assert cache.get("1.1.1.1") is None
+    assert cache.get("3.3.3.3") == ("C", None)
+
+
+def test_unreadable_file_is_ignored(tmp_path):
+    path = tmp_path / "geo.json"
+    path.write_text("not json")
+    cache = kareem.GeoCache(path=str(path))
+    assert cache.get("1.1.1.1") is None
@@ -0,0 +1,57 @@
+import KAREEM_NET_FRED as kareem
+
+
+def build(tmp_path):
+    geoip = tmp_path / "geoip"
+    geoip.write_text("# tor geoip\n"
+                     "16777216,16777471,AU\n"  # 1.0.0.0 - 1.0.0.255
+                     "16777472,16778239,??\n"
+                     "134744064,134744319,US\n")  # 8.8.8.0 - 8.8.8.255
+    geoip6 = tmp_path / "geoip6"
+    geoip6.write_text("2001:4860::,2001:4860:ffff:ffff:ffff:ffff:ffff:ffff,US\n")
+    index = kareem.GeoIPIndex()
+    assert index.load_tor_geoip(str(geoip)) == 2
+    assert index.load_tor_geoip(str(geoip6)) == 1
+    return index.freeze()
+
+
+def test_lookup_by_range(tmp_path):
+    index = build(tmp_path)
+    assert len(index) == 3
+    assert index.lookup("1.0.0.0") == ("Australia", None)
+    assert index.lookup("1.0.0.255") == ("Australia", None)
+    assert index.lookup("8.8.8.8") == ("United States", None)
+    assert index.lookup("2001:4860:4860::8888") == ("United States", None)
+
+
+def test_uncovered_and_invalid_addresses(tmp_path):
+    index = build(tmp_path)
+    assert index.lookup("1.0.1.0") is None  # Unknown country, skipped
+    assert index.lookup("0.255.255.255") is None
+    assert index.lookup("9.9.9.9") is None
+    assert index.lookup("2a00::1") is None
+    assert index.lookup("not an ip") is None
+
+
+def test_ipv4_mapped_ipv6(tmp_path):
+    assert build(tmp_path).lookup("::ffff:8.8.8.8") == ("United States", None)
+
+
+def test_csv_with_cities_and_header(tmp_path):
+    db = tmp_path / "geo.csv"
+    db.write_text("start,end,country,city\n"
+                  "10.0.0.0,10.0.0.255,DE,Berlin\n"
+                  "10.0.1.0,10.0.1.255,Netherlands,\n")
+    index = kareem.GeoIPIndex()
+    assert index.load_csv(str(db)) == 2
+    index.freeze()
+    assert index.lookup("10.0.0.7") == ("Germany", "Berlin")
+    assert index.lookup("10.0.1.7") == ("Netherlands", None)
+
+
+def test_freeze_merges_later_ranges(tmp_path):
+    index = build(tmp_path)
+    index.add_range("9.9.9.0", "9.9.9.255", "CH")
+    index.freeze()
+    assert index.lookup("9.9.9.9") == ("Switzerland", None)
+    assert index.lookup("8.8.8.8") == ("United States", None)
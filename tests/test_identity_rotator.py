@@ -0,0 +1,124 @@
+import json
+
+import pytest
+
+import KAREEM_NET_FRED as kareem
+from fakes import Fault, FakeNetwork
+
+
+@pytest.fixture(scope="module")
+def network():
+    with FakeNetwork(circuit=Fault(0.02)) as network:
+        yield network
+
+
+@pytest.fixture(autouse=True)
+def fakes(network, monkeypatch):
+    for name, value in network.settings().items():
+        monkeypatch.setattr(kareem, name, value)
+    monkeypatch.setattr(kareem, "METRICS_TEXTFILE", None)
+    return network
+
+
+@pytest.fixture
+def rotator():
+    with kareem.IdentityRotator(name="test") as rotator:
+        yield rotator
+
+
+def test_rotate_switches_identity(rotator):
+    rotated = []
+    rotator.on('rotate', lambda old, new: rotated.append((old, new)))
+    session = rotator.session()
+    old = rotator.current_identity()
+
+    new = rotator.rotate()
+    assert new.ip and new.ip != old.ip
+    assert new.country not in (None, "Not Defined")
+    assert new.generation == old.generation + 1
+    assert rotated == [(old, new)]
+    assert list(rotator.history) == [new]
+    assert session.proxies["https"] == rotator._proxy
+
+
+def test_rotators_get_separate_identities(rotator):
+    with kareem.IdentityRotator(name="other") as other:
+        assert other.current_identity().ip != rotator.current_identity().ip
+
+
+def test_repeated_exit_is_rerolled(rotator, monkeypatch):
+    old = rotator.current_identity()
+    new_proxy = rotator._new_proxy
+    proxies = iter([rotator._proxy])  # The first switch keeps the same credentials, so the same exit
+    monkeypatch.setattr(rotator, "_new_proxy", lambda: next(proxies, None) or new_proxy())
+    assert rotator.rotate().ip != old.ip
+
+
+def test_repeated_exit_is_kept_after_the_budget():
+    with kareem.IdentityRotator(kareem.TorConfig(repeat_budget=0), name="test") as rotator:
+        old = rotator.current_identity()
+        rotator._new_proxy = lambda: rotator._proxy
+        assert rotator.rotate().ip == old.ip
+
+
+def test_newnym_rotation(fakes):
+    newnyms = fakes.tor.newnyms
+    with kareem.IdentityRotator(kareem.TorConfig(isolate=False), name="test") as rotator:
+        old = rotator.current_identity()
+        assert rotator.rotate().ip != old.ip
+    assert fakes.tor.newnyms == newnyms + 1
+
+
+def test_failed_rotation_reaches_error_callbacks():
+    errors = []
+    with kareem.IdentityRotator(kareem.TorConfig(isolate=False, control_port=1), name="test") as rotator:
+        rotator.on('error', errors.append)
+        rotator._identity = kareem.Identity("1.2.3.4", None, None, None, 0, None)
+        with pytest.raises(Exception) as raised:
+            rotator.rotate()
+    assert errors == [raised.value]
+
+
+def test_unknown_event(rotator):
+    with pytest.raises(ValueError):
+        rotator.on('rotated', print)
+
+
+def test_rotation_is_logged_and_metrics_exported(tmp_path, monkeypatch):
+    log, textfile = tmp_path / "rotations.log", tmp_path / "metrics.prom"
+    monkeypatch.setattr(kareem, "METRICS_TEXTFILE", str(textfile))
+    with kareem.IdentityRotator(log=kareem.LogConfig(str(log)), name="test") as rotator:
+        old = rotator.current_identity()
+        new = rotator.rotate()
+    entry = json.loads(log.read_text())
+    assert (entry["old_ip"], entry["new_ip"]) == (old.ip, new.ip)
+    assert "kareem_net_fred_phase_seconds" in textfile.read_text()
+
+
+def test_mac_settings_are_passed_down(monkeypatch):
+    calls = []
+
+    def rotate_mac_addresses(interfaces=None, new_mac=None, specific=True, backend=None, rollback=None):
+        calls.append((interfaces, new_mac, specific, backend))
+        return {interfaces[0]: {'ok': True, 'old_mac': "00:00:00:00:00:01", 'new_mac': "02:00:00:00:00:02"}}
+
+    monkeypatch.setattr(kareem, "rotate_mac_addresses", rotate_mac_addresses)
+    mac = kareem.MacConfig(enabled=True, interfaces=["eth9"], backend="ip")
+    rotated = []
+    with kareem.IdentityRotator(mac=mac, name="test") as rotator:
+        rotator.on('rotate', lambda old, new: rotated.append((old.mac, new.mac)))
+        assert rotator.rotate().mac == "02:00:00:00:00:02"
+    assert calls == [(["eth9"], None, False, "ip")]
+    assert rotated == [("00:00:00:00:00:01", "02:00:00:00:00:02")]
+
+
+def test_ip_check_stats_are_per_rotator():
+    shared = kareem.get_ip_check_stats()
+    missing = kareem.IP_CHECK_ENDPOINTS[0].rsplit("/", 3)[0] + "/missing"
+    with kareem.IdentityRotator(kareem.TorConfig(check_endpoints=[missing]), name="test") as rotator, \
+            kareem.IdentityRotator(name="other") as other:
+        assert rotator.current_identity().ip is None
+        assert other.current_identity().ip
+        assert rotator.ip_check_stats()[missing]['failure'] == 1
+        assert missing not in other.ip_check_stats()
+    assert kareem.get_ip_check_stats() == shared
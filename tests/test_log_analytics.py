@@ -0,0 +1,87 @@
+import gzip
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import KAREEM_NET_FRED as kareem
+
+START = datetime(2024, 1, 1, 12, 0, 0)
+COUNTRIES = ["Germany", "Netherlands", "Sweden"]
+
+
+def entries(count, offset=0):
+    for i in range(offset, offset + count):
+        entry = {
+            "timestamp": (START + timedelta(seconds=30 * i + i % 7)).isoformat(),
+            "old_ip": f"10.0.0.{i % 5}",
+            "new_ip": f"10.0.0.{(i + 1) % 5 if i % 10 else i % 5}",  # Every tenth one repeats
+            "new_country": COUNTRIES[i % 3],
+        }
+        if i % 4 == 0:
+            entry["mac_changed"] = i % 8 == 0
+        yield json.dumps(entry)
+
+
+def write_log(path, lines):
+    path.write_text("".join(line + "\n" for line in lines))
+    return str(path)
+
+
+def test_segment_aggregates(tmp_path):
+    path = write_log(tmp_path / "log", [*entries(20), "not json", json.dumps({"timestamp": START.isoformat(),
+                                                                             "event": "bootstrap"})])
+    stats = kareem.analyze_log_segment(path)
+    assert stats["entries"] == 20
+    assert stats["invalid"] == 1
+    assert stats["countries"] == {"Germany": 7, "Netherlands": 7, "Sweden": 6}
+    assert stats["repeat_ip"] == 2
+    assert (stats["mac_attempts"], stats["mac_changed"]) == (5, 3)
+    assert stats["interval_count"] == 19
+    assert stats["first"] == START.isoformat()
+
+
+@pytest.mark.parametrize("chunks", [2, 3, 7, 16])
+def test_chunks_count_every_line_exactly_once(tmp_path, chunks):
+    path = write_log(tmp_path / "log", entries(50))
+    whole = kareem.analyze_log_segment(path)
+    size = (tmp_path / "log").stat().st_size
+    step = size // chunks + 1
+    parts = [kareem.analyze_log_segment(path, start, min(start + step, size)) for start in range(0, size, step)]
+    assert sum(part["entries"] for part in parts) == 50
+    assert kareem.merge_log_stats(parts) == whole
+
+
+def test_chunk_boundary_on_a_line_start(tmp_path):
+    path = write_log(tmp_path / "log", entries(3))
+    first_line = len((tmp_path / "log").read_bytes().split(b"\n")[0]) + 1
+    head = kareem.analyze_log_segment(path, 0, first_line)
+    tail = kareem.analyze_log_segment(path, first_line)
+    assert (head["entries"], tail["entries"]) == (1, 2)
+
+
+def test_merge_stitches_intervals_across_segments(tmp_path):
+    older = write_log(tmp_path / "log.1", entries(10))
+    newer = tmp_path / "log.2.gz"
+    with gzip.open(newer, "wt") as f:
+        f.write("".join(line + "\n" for line in entries(10, offset=10)))
+    whole = kareem.analyze_log_segment(write_log(tmp_path / "log", entries(20)))
+
+    # Given newest first, as a pool of workers may return them
+    merged = kareem.merge_log_stats([kareem.analyze_log_segment(str(newer)), kareem.analyze_log_segment(older)])
+    assert merged == whole
+    assert merged["interval_count"] == 19
+
+
+def test_merge_ignores_empty_parts(tmp_path):
+    stats = kareem.analyze_log_segment(write_log(tmp_path / "log", entries(5)))
+    empty = kareem.analyze_log_segment(write_log(tmp_path / "empty", []))
+    assert kareem.merge_log_stats([empty, stats, empty]) == stats
+
+
+def test_analyze_logs_splits_large_files(tmp_path, monkeypatch):
+    path = write_log(tmp_path / "log", entries(40))
+    monkeypatch.setattr(kareem, "ANALYTICS_CHUNK_BYTES", 500)
+    stats = kareem.analyze_logs([path], workers=1)
+    assert stats.pop("segments") == 1
+    assert stats == kareem.analyze_log_segment(path)
@@ -0,0 +1,72 @@
+import pytest
+
+import KAREEM_NET_FRED as kareem
+
+
+def test_render_histograms_and_counters():
+    metrics = kareem.Metrics(buckets=(0.1, 1))
+    metrics.observe("geo", 0.05, provider="ipapi")
+    metrics.observe("geo", 0.5, provider="ipapi")
+    metrics.observe("geo", 5, False, provider="ipapi")
+    assert metrics.render() == (
+        '# TYPE kareem_net_fred_geo_seconds histogram\n'
+        'kareem_net_fred_geo_seconds_bucket{provider="ipapi",le="0.1"} 1\n'
+        'kareem_net_fred_geo_seconds_bucket{provider="ipapi",le="1"} 2\n'
+        'kareem_net_fred_geo_seconds_bucket{provider="ipapi",le="+Inf"} 3\n'
+        'kareem_net_fred_geo_seconds_sum{provider="ipapi"} 5.550000\n'
+        'kareem_net_fred_geo_seconds_count{provider="ipapi"} 3\n'
+        '# TYPE kareem_net_fred_geo_total counter\n'
+        'kareem_net_fred_geo_total{provider="ipapi",result="failure"} 1\n'
+        'kareem_net_fred_geo_total{provider="ipapi",result="success"} 2\n'
+    )
+
+
+def test_render_without_labels_and_bucket_edges():
+    metrics = kareem.Metrics(buckets=(1,))
+    metrics.observe("mac", 1)  # A value on a bound falls in that bucket
+    text = metrics.render()
+    assert 'kareem_net_fred_mac_seconds_bucket{le="1"} 1\n' in text
+    assert "kareem_net_fred_mac_seconds_count 1\n" in text
+    assert 'kareem_net_fred_mac_total{result="success"} 1\n' in text
+
+
+def test_render_escapes_label_values():
+    metrics = kareem.Metrics(buckets=(1,))
+    metrics.observe("telegram", 0.1, status='say "hi"\\\n')
+    assert 'status="say \\"hi\\"\\\\\\n"' in metrics.render()
+
+
+def test_render_empty():
+    assert kareem.Metrics().render() == "\n"
+
+
+def test_timed_counts_exceptions_as_failures():
+    metrics = kareem.Metrics(buckets=(1,))
+    with pytest.raises(RuntimeError):
+        with metrics.timed("probe"):
+            raise RuntimeError
+    with metrics.timed("probe") as timing:
+        timing.fail()
+    assert 'kareem_net_fred_probe_total{result="failure"} 2' in metrics.render()
+
+
+def test_nested_breakdowns_add_up_in_the_enclosing_one():
+    metrics = kareem.Metrics()
+    with metrics.breakdown() as outer:
+        with metrics.phase("rotation"):
+            pass
+        with metrics.breakdown() as inner:
+            with metrics.phase("geo"):
+                pass
+    assert set(inner) == {"geo"}
+    assert set(outer) == {"rotation", "geo"}
+    assert 'kareem_net_fred_phase_total{phase="geo",result="success"} 1' in metrics.render()
+
+
+def test_write_textfile(tmp_path):
+    metrics = kareem.Metrics(buckets=(1,))
+    metrics.observe("geo", 0.5)
+    path = tmp_path / "metrics.prom"
+    metrics.write_textfile(str(path))
+    assert path.read_text() == metrics.render()
+    assert not (tmp_path / "metrics.prom.tmp").exists()
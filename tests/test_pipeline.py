@@ -0,0 +1,91 @@
+import threading
+import time
+
+import KAREEM_NET_FRED as kareem
+
+
+class OneShotScheduler:
+    """Plans a single rotation, then stops the loop"""
+
+    def begin(self):
+        pass
+
+    def feedback(self, probe):
+        pass
+
+    def plan(self):
+        return 1
+
+    def stats(self):
+        return {}
+
+    def wait(self, stop):
+        return True
+
+
+def hang(event):
+    time.sleep(1)
+    return event
+
+
+def test_sinks_get_locations_when_enrich_times_out(monkeypatch):
+    received = {'log': [], 'notify': [], 'display': []}
+    monkeypatch.setattr(kareem, "PIPELINE_STAGE_TIMEOUTS", {'enrich': 0.05, 'log': 1, 'notify': 1, 'display': 1})
+    monkeypatch.setattr(kareem, "enrich_rotation", hang)
+    monkeypatch.setattr(kareem, "record_rotation", received['log'].append)
+    monkeypatch.setattr(kareem, "notify_rotation", received['notify'].append)
+    monkeypatch.setattr(kareem, "display_rotation", received['display'].append)
+    monkeypatch.setattr(kareem, "start_country_schedule", lambda: None)
+    monkeypatch.setattr(kareem, "resolve_exit_ip", lambda: ("203.0.113.1", "de"))
+    monkeypatch.setattr(kareem, "rotate_identity", lambda target: ("203.0.113.2", "fr", None, 0, False))
+    monkeypatch.setattr(kareem, "exit_index", kareem.SeenExitIndex())
+    monkeypatch.setattr(kareem, "export_metrics", lambda: None)
+    monkeypatch.setattr(kareem, "MAC_CHANGE_ENABLED", False)
+
+    pipeline = kareem.RotationPipeline().start()
+    kareem.run_rotations(OneShotScheduler(), pipeline)
+    pipeline.stop(timeout=2)
+
+    assert pipeline.enrich.timed_out == 1
+    for name, events in received.items():
+        assert len(events) == 1, name
+        event = events[0]
+        assert event['new_ip'] == "203.0.113.2"
+        for key in ('old_country', 'old_city', 'new_country', 'new_city'):
+            assert event[key] == "Not Defined"
+
+
+def test_stage_keeps_one_handler_thread():
+    threads = []
+    stage = kareem.PipelineStage('count', lambda event: threads.append(threading.get_ident()), timeout=1,
+                                 overflow='block')
+    stage.start()
+    for n in range(20):
+        stage.submit({'n': n})
+    stage.stop(timeout=2)
+
+    assert len(threads) == 20
+    assert len(set(threads)) == 1
+
+
+def test_stage_replaces_handler_after_timeout():
+    release = threading.Event()
+
+    def handler(event):
+        if event['n'] == 0:
+            release.wait(2)
+        return dict(event, handled=True)
+
+    results = []
+    sink = kareem.PipelineStage('sink', results.append, timeout=1)
+    stage = kareem.PipelineStage('slow', handler, timeout=0.05).then(sink)
+    sink.start()
+    stage.start()
+    stage.submit({'n': 0})
+    stage.submit({'n': 1})
+    stage.stop(timeout=2)
+    sink.stop(timeout=2)
+    release.set()
+
+    assert stage.timed_out == 1
+    assert results == [{'n': 0}, {'n': 1, 'handled': True}]
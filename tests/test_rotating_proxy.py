@@ -0,0 +1,53 @@
+import asyncio
+
+import KAREEM_NET_FRED as kareem
+
+
+def make_proxy(**options):
+    # Built outside the loop, as run_proxy does before asyncio.run()
+    return kareem.RotatingProxy(socks_proxy="socks5h://127.0.0.1:9050", isolation="shared", **options)
+
+
+def test_rotation_drains_the_old_identity():
+    proxy = make_proxy(rotate_requests=1)
+
+    async def scenario():
+        old = proxy._acquire()
+        new = proxy._acquire()  # Due after one request: rotates, old still has a connection
+        assert new is not old and proxy.rotations == 1
+        draining = list(proxy._draining)  # Finished tasks drop out of the set
+        assert len(draining) == 1
+        await asyncio.sleep(0.01)  # _retire is now waiting for the old identity
+        proxy._release(old)
+        await asyncio.wait_for(asyncio.gather(*draining), 1)
+        assert old.idle.is_set() and not new.idle.is_set()
+
+    asyncio.run(scenario())
+
+
+def test_stragglers_are_closed_after_the_drain_timeout(monkeypatch):
+    monkeypatch.setattr(kareem, "PROXY_DRAIN_TIMEOUT", 0.05)
+    proxy = make_proxy(rotate_requests=1)
+    closed = []
+
+    class Writer:
+        def close(self):
+            closed.append(self)
+
+    async def scenario():
+        old = proxy._acquire()
+        old.writers.add(Writer())
+        proxy._acquire()
+        await asyncio.wait_for(asyncio.gather(*list(proxy._draining)), 1)
+
+    asyncio.run(scenario())
+    assert len(closed) == 1
+
+
+def test_identity_without_connections_is_idle():
+    identity = kareem.ProxyIdentity()
+
+    async def idle():
+        return identity.idle.is_set()
+
+    assert asyncio.run(idle())
@@ -0,0 +1,101 @@
+from datetime import datetime
+
+import pytest
+
+import KAREEM_NET_FRED as kareem
+
+# 2024-01-01 was a Monday
+
+
+@pytest.mark.parametrize("expression, moment, expected", [
+    ("0 0 * * *", datetime(2024, 1, 3), True),
+    ("0 0 * * 1-5", datetime(2024, 1, 1), True),  # Monday
+    ("0 0 * * 1-5", datetime(2024, 1, 6), False),  # Saturday
+    ("0 0 * * 0", datetime(2024, 1, 7), True),  # Sunday as 0
+    ("0 0 * * 7", datetime(2024, 1, 7), True),  # ... and as 7
+    ("0 0 15 * *", datetime(2024, 1, 15), True),
+    ("0 0 15 * *", datetime(2024, 1, 16), False),
+    ("0 0 1 * *", datetime(2024, 1, 1), True),
+    # Both day fields restricted: either one matching is enough
+    ("0 0 15 * 1", datetime(2024, 1, 15), True),  # The 15th, also a Monday
+    ("0 0 15 * 1", datetime(2024, 1, 8), True),  # A Monday
+    ("0 0 15 * 1", datetime(2024, 2, 15), True),  # The 15th, a Thursday
+    ("0 0 15 * 1", datetime(2024, 1, 9), False),
+    # One restricted, the other '*': the restricted one decides
+    ("0 0 15 * *", datetime(2024, 1, 8), False),
+    ("0 0 * * 1", datetime(2024, 1, 15), True),
+])
+def test_day_matches(expression, moment, expected):
+    assert kareem.CronSchedule(expression)._day_matches(moment) is expected
+
+
+@pytest.mark.parametrize("expression, after, expected", [
+    ("*/15 * * * *", datetime(2024, 1, 1, 10, 7), datetime(2024, 1, 1, 10, 15)),
+    ("*/15 * * * *", datetime(2024, 1, 1, 10, 15), datetime(2024, 1, 1, 10, 30)),
+    ("0 9-17 * * 1-5", datetime(2024, 1, 5, 17, 30), datetime(2024, 1, 8, 9, 0)),
+    ("30 2 29 2 *", datetime(2024, 3, 1), datetime(2028, 2, 29, 2, 30)),
+])
+def test_next_after(expression, after, expected):
+    assert kareem.CronSchedule(expression).next_after(after) == expected
+
+
+@pytest.mark.parametrize("expression", ["* * * *", "60 * * * *", "* 24 * * *", "5-1 * * * *", "0 0 31 2 *"])
+def test_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        kareem.CronSchedule(expression).next_after(datetime(2024, 1, 1))
+
+
+def overrun(scheduler, slots):
+    """Pretend the last slot was this many intervals ago"""
+    scheduler._slot = kareem.time.monotonic() - slots * scheduler.interval
+
+
+def test_plan_keeps_to_the_grid():
+    scheduler = kareem.RotationScheduler(60, jitter=0)
+    assert 59 < scheduler.plan() <= 60
+    scheduler._slot = kareem.time.monotonic() - 20  # The rotation took 20 seconds of its slot
+    assert 39 < scheduler.plan() <= 40
+
+
+def test_plan_catches_up_on_missed_slots(monkeypatch):
+    monkeypatch.setattr(kareem, "ROTATION_MAX_CATCH_UP", 3)
+    scheduler = kareem.RotationScheduler(10, jitter=0, overrun='catch_up')
+    overrun(scheduler, 2.5)
+    assert scheduler.plan() == 0.0  # Missed slots run back to back
+    assert scheduler.skipped == 0
+
+
+def test_plan_skips_when_too_far_behind_to_catch_up(monkeypatch):
+    monkeypatch.setattr(kareem, "ROTATION_MAX_CATCH_UP", 3)
+    scheduler = kareem.RotationScheduler(10, jitter=0, overrun='catch_up')
+    overrun(scheduler, 5.5)
+    assert 4 < scheduler.plan() <= 5
+    assert scheduler.skipped == 5
+
+
+def test_plan_skips_missed_slots():
+    scheduler = kareem.RotationScheduler(10, jitter=0, overrun='skip')
+    overrun(scheduler, 2.5)
+    assert 4 < scheduler.plan() <= 5  # The next slot still on the grid
+    assert scheduler.skipped == 2
+
+
+def test_jitter_stays_within_half_the_interval():
+    scheduler = kareem.RotationScheduler(10, jitter=100)
+    for _ in range(50):
+        scheduler._slot = kareem.time.monotonic()
+        assert 5 - 0.1 <= scheduler.plan() <= 15
+
+
+def test_adaptive_interval_shrinks_on_failed_probes(monkeypatch):
+    monkeypatch.setattr(kareem, "ROTATION_ADAPTIVE_FACTOR", 0.5)
+    monkeypatch.setattr(kareem, "ROTATION_MIN_INTERVAL", 10)
+    monkeypatch.setattr(kareem, "PROBE_ENABLED", True)
+    scheduler = kareem.RotationScheduler(60, jitter=0, adaptive=True)
+    scheduler.feedback(None)
+    assert scheduler.current_interval() == 30
+    scheduler.feedback(None)
+    scheduler.feedback(None)
+    assert scheduler.current_interval() == 10
+    scheduler.feedback({'ttfb': 0.1, 'throughput': 10 ** 6, 'bytes': 1})
+    assert scheduler.current_interval() == 60
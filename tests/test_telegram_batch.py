@@ -0,0 +1,54 @@
+import pytest
+
+import KAREEM_NET_FRED as kareem
+
+LIMIT = kareem.TELEGRAM_MAX_MESSAGE_LENGTH
+SEPARATOR = kareem.TELEGRAM_BATCH_SEPARATOR
+
+
+@pytest.fixture
+def notifier():
+    """A notifier with its worker stopped, so batches are only taken by the test"""
+    notifier = kareem.TelegramNotifier()
+    notifier.stop(0)
+    yield notifier
+
+
+def take_all(notifier, *messages):
+    notifier._pending.extend(messages)
+    batches = []
+    while notifier._pending:
+        batches.append(notifier._take_batch())
+    return batches
+
+
+def test_small_messages_are_coalesced(notifier):
+    assert take_all(notifier, "one", "two", "three") == [["one", "two", "three"]]
+
+
+def test_batches_stay_within_the_length_limit(notifier):
+    message = "x" * (LIMIT // 3)
+    batches = take_all(notifier, *[message] * 7)
+    assert sum(len(batch) for batch in batches) == 7
+    assert all(len(SEPARATOR.join(batch)) <= LIMIT for batch in batches)
+    assert len(batches) > 1
+
+
+def test_a_message_at_the_limit_goes_alone(notifier):
+    assert take_all(notifier, "a" * LIMIT, "b") == [["a" * LIMIT], ["b"]]
+
+
+def test_long_message_is_split_at_line_breaks(notifier):
+    line = "<b>Old IP:</b> <code>1.2.3.4</code>\n"
+    message = line * (2 * LIMIT // len(line) + 5)
+    batches = take_all(notifier, message, "next")
+    parts = [part for batch in batches for part in batch]
+    assert all(len(SEPARATOR.join(batch)) <= LIMIT for batch in batches)
+    assert all(part.rstrip("\n").endswith("</code>") for part in parts[:-1])  # No tag cut in half
+    assert "\n".join(parts[:-1]) == message
+    assert parts[-1] == "next"
+
+
+def test_long_line_is_cut_at_the_limit(notifier):
+    batches = take_all(notifier, "x" * (LIMIT * 2 + 10))
+    assert [len(batch[0]) for batch in batches] == [LIMIT, LIMIT, 10]